@@ -1,17 +1,147 @@
-from flask import Flask
+from flask import Flask, Response, abort, jsonify, request, send_file
 from flask.templating import render_template
+import io
+import math
 import os
+import re
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "pipeline"))
+import hotspot_index
+import hotspot_lod
+import hotspot_store
+import hotspot_tiles
 
 app = Flask(__name__, static_url_path="/static")
 
 folders = os.listdir("apps")
 folders.sort()
 
+# Country folders and grid sizes of the URLs, so they never leave the db folder
+DB_NAME = re.compile(r"[A-Za-z0-9_]+(\.[0-9]+)?")
+
+# Cells returned by the query API at most
+MAX_CELLS = 50000
+
 
 @app.route("/")
 def index():
     return render_template("index.html", folders=folders, l=len(folders))
 
 
+def total_path(country, grid_size):
+    # Path of a total, 404 if the country or the grid size do not exist
+    if not (DB_NAME.fullmatch(country) and DB_NAME.fullmatch(grid_size)):
+        abort(404)
+    path = hotspot_store.total_path(country, grid_size)
+    if not os.path.exists(path):
+        abort(404)
+    return path
+
+
+def load_index(country, grid_size):
+    # Cell index of a total, shared with the dashboard loads of this process and
+    # reloaded when the pipeline rewrites the total
+    return hotspot_lod.lod_index(total_path(country, grid_size))
+
+
+@app.route("/tiles/<country>/<grid_size>/<int:z>/<int:x>/<int:y>.png")
+def hotspot_tile(country, grid_size, z, x, y):
+    if not hotspot_tiles.valid_tile(z, x, y):
+        abort(404)
+    path = total_path(country, grid_size)
+
+    png = hotspot_tiles.tile_png(path, z, x, y)
+    # The dashboard adds the data version to the tile URLs, so browsers can keep them
+    return send_file(io.BytesIO(png), mimetype="image/png", max_age=86400)
+
+
+@app.route("/tiles/<country>/lod/<int:z>/<int:x>/<int:y>.png")
+def hotspot_lod_tile(country, z, x, y):
+    # Tiles at the resolution picked for their zoom among the totals of the country
+    if not (DB_NAME.fullmatch(country) and hotspot_tiles.valid_tile(z, x, y)):
+        abort(404)
+    totals = hotspot_lod.country_totals(country)
+    if not totals:
+        abort(404)
+
+    png = hotspot_tiles.lod_tile_png(totals, z, x, y)
+    return send_file(io.BytesIO(png), mimetype="image/png", max_age=86400)
+
+
+def float_arg(name, default=None):
+    value = request.args.get(name, default)
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        abort(400, f"Missing or invalid {name}")
+    if not math.isfinite(value):
+        abort(400, f"Invalid {name}")
+    return value
+
+
+def int_arg(name, default, minimum=1, maximum=MAX_CELLS):
+    value = request.args.get(name, default)
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        abort(400, f"Invalid {name}")
+    return min(max(value, minimum), maximum)
+
+
+def window_args():
+    # lat_min, lat_max, lon_min, lon_max of the request, None if it has no window
+    names = ["lat_min", "lat_max", "lon_min", "lon_max"]
+    if not any(name in request.args for name in names):
+        return None
+    lat_min, lat_max, lon_min, lon_max = (float_arg(name) for name in names)
+    if lat_min > lat_max or lon_min > lon_max:
+        abort(400, "Empty window")
+    return lat_min, lat_max, lon_min, lon_max
+
+
+def cells_response(cell_index, positions, **extra):
+    # JSON with a list per column, or an Arrow IPC stream with format=arrow
+    table = cell_index.records(positions)
+    if request.args.get("format") == "arrow":
+        return Response(
+            hotspot_index.to_ipc(table), mimetype="application/vnd.apache.arrow.stream"
+        )
+    return jsonify(
+        grid=cell_index.grid.to_dict(),
+        count=table.num_rows,
+        cells=hotspot_index.to_columns(table),
+        **extra,
+    )
+
+
+@app.route("/api/cells/<country>/<grid_size>/bbox")
+def cells_bbox(country, grid_size):
+    cell_index = load_index(country, grid_size)
+    window = window_args()
+    if window is None:
+        abort(400, "Missing lat_min, lat_max, lon_min and lon_max")
+    limit = int_arg("limit", MAX_CELLS)
+
+    positions = cell_index.window(*window)
+    truncated = len(positions) > limit
+    return cells_response(cell_index, positions[:limit], truncated=truncated)
+
+
+@app.route("/api/cells/<country>/<grid_size>/point")
+def cells_point(country, grid_size):
+    cell_index = load_index(country, grid_size)
+    position = cell_index.point(float_arg("lat"), float_arg("lon"))
+    return cells_response(cell_index, [] if position is None else [position])
+
+
+@app.route("/api/cells/<country>/<grid_size>/top")
+def cells_top(country, grid_size):
+    cell_index = load_index(country, grid_size)
+    window = window_args()
+    positions = None if window is None else cell_index.window(*window)
+    return cells_response(cell_index, cell_index.top(int_arg("k", 10), positions))
+
+
 if __name__ == "__main__":
     app.run(debug=True, host="0.0.0.0", port=80)
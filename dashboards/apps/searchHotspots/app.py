@@ -1,18 +1,16 @@
 # Imports
 # -----------------------------------------------------------
 import streamlit as st
-import pandas as pd
 import folium
-import geopandas
-from shapely.geometry import Polygon
 import os
+import sys
 import json
-import ast
-from folium.plugins import Search
-from streamlit_folium import folium_static
-import io
-from zipfile import ZipFile
-import tempfile
+from streamlit_folium import st_folium
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../pipeline"))
+import hotspot_exports
+import hotspot_lod
+import morton
 
 # -----------------------------------------------------------
 # change icon and page name
@@ -34,16 +32,11 @@ def get_folders_in_directory(directory):
     return folders
 
 
-@st.cache
-def get_countries_geos():
-    return geopandas.read_file("data/countries.geojson", driver="GeoJSON")
-
-
 countries = get_folders_in_directory("db")
 dates = get_folders_in_directory("db/ESP")
 color_map = ["green", "yellow", "orange", "red"]
-
-countries_geos = get_countries_geos()
+# Flask app of the dashboards folder serving the hotspot tiles, reached by the browser
+TILE_SERVER = os.environ.get("HOTSPOTS_TILE_SERVER", "http://localhost")
 
 # -----------------------------------------------------------
 st.sidebar.title("Map Options")
@@ -52,17 +45,24 @@ selected_country = st.sidebar.selectbox("Select a country", countries)
 
 
 # -----------------------------------------------------------
-@st.cache
 def get_country(selected_country):
+    # The cells are drawn by the tile server, the page only needs the map center and
+    # the totals of the country
     with open(f"db/{selected_country}/center_coordinates.json", "r") as infile:
         center_data = json.load(infile)
     center = center_data["center_coordinates"]
-    cell_colors_sums = pd.read_csv(f"db/{selected_country}/total_0.08.csv")
-    cell_colors_sums["grid_bbox"] = cell_colors_sums["grid_bbox"].apply(
-        lambda x: ast.literal_eval(x)
-    )
+    totals = hotspot_lod.country_totals(selected_country, db_dir="db")
+    if not totals:
+        raise FileNotFoundError(f"No totals for {selected_country}")
+
+    return totals, center
+
 
-    return cell_colors_sums, center
+def grid_label(grid):
+    # Name of a grid in the download options
+    if isinstance(grid, morton.MortonGrid):
+        return f"Morton tile {grid.level}"
+    return f"{grid.cell_size}° cells"
 
 
 # -----------------------------------------------------------
@@ -111,40 +111,47 @@ with col1:
     hide_map = st.checkbox("Hide Visualization")
 # Read the JSON file # -----------------------------------------------------------
 try:
-    cell_colors_sums, center = get_country(selected_country)
-
-    priority_dict = {"green": "P4", "yellow": "P3", "orange": "P2", "red": "P1"}
+    totals, center = get_country(selected_country)
 
     ### MAP CREATION # -----------------------------------------------------------
 
     m = folium.Map(location=center, zoom_start=5, prefer_canvas=True)
 
-    # Create a layer with the colored rectangles
-
-    # Iterate over the cells in the grid and draw a rectangle for each cell
-    for color_level in color_map:
-        colored_rectangles = folium.FeatureGroup(
-            name=f"{priority_dict[color_level]}", min_zoom=6, max_zoom=8
-        )
-        specific_colored_df = cell_colors_sums[cell_colors_sums["color"] == color_level]
-
-        cell_colors_sums_dict = specific_colored_df.to_dict("records")
-        for row in cell_colors_sums_dict:
-            box = row["grid_bbox"]
-            rect = folium.Rectangle(
-                bounds=[(box[0], box[2]), (box[1], box[3])],
-                color=color_level,
-                weight=0.5,
-                fill=True,
-                # tooltip=folium.Tooltip(f"Count:{row['value']} <br> Bounds:{box}"),
-            ).add_to(colored_rectangles)
-
-        colored_rectangles.add_to(m)
+    # The cells are rendered into PNG tiles by the Flask app, so the page does not grow
+    # with the number of cells. Each zoom is drawn from the finest total whose cells are
+    # still a few pixels wide, rolled up when none is. The data version makes browsers
+    # reload updated tiles
+    version = hotspot_lod.totals_version(totals)
+    folium.TileLayer(
+        tiles=f"{TILE_SERVER}/tiles/{selected_country}/lod/{{z}}/{{x}}/{{y}}.png?v={version}",
+        attr="Search hotspots",
+        name="Hotspots",
+        overlay=True,
+        control=True,
+    ).add_to(m)
     print("Map generated!!!")
     # Add a layer control widget to the map
     if not hide_map:
         folium.LayerControl().add_to(m)
-        folium_static(m, width=2048, height=700)
+        map_state = st_folium(m, key="hotspots_map", width=2048, height=700) or {}
+
+        # Only the cells inside the viewport reported back by the map are sent
+        bounds = map_state.get("bounds") or {}
+        south_west, north_east = bounds.get("_southWest") or {}, bounds.get("_northEast") or {}
+        if map_state.get("zoom") is not None and None not in (
+            south_west.get("lat"), north_east.get("lat"), south_west.get("lng"), north_east.get("lng")
+        ):
+            viewport_cells, viewport_grid = hotspot_lod.viewport_cells(
+                selected_country,
+                map_state["zoom"],
+                (south_west["lat"], north_east["lat"], south_west["lng"], north_east["lng"]),
+                db_dir="db",
+            )
+            if viewport_cells is not None and viewport_cells.num_rows:
+                st.caption(
+                    f"Hottest cells in view, {viewport_grid.cell_size:.3f}° cells at zoom {map_state['zoom']}"
+                )
+                st.dataframe(viewport_cells.to_pandas())
 
     st.markdown(
         """
@@ -170,61 +177,35 @@ try:
         unsafe_allow_html=True,
     )
 
-    grid_dict = {"Morton Tile 10": 0.08, "Morton Tile 14": 0.022}
+    # Every grid the pipeline wrote a total of, from the finest
     col1, col2, col3 = st.columns(3)
     with col1:
-        selected_grid_size = st.selectbox(
-            "Select precision for download", ["Morton Tile 10", "Morton Tile 14"]
+        selected_grid = st.selectbox(
+            "Select precision for download",
+            [grid for _, grid in totals],
+            format_func=grid_label,
         )
 
-    @st.cache
-    def convert_df(df):
-        # IMPORTANT: Cache the conversion to prevent computation on every rerun
-        polygons = []
-
-        for bbox in df["grid_bbox"]:
-            coords = [
-                (float(bbox[2]), float(bbox[0])),
-                (float(bbox[2]), float(bbox[1])),
-                (float(bbox[3]), float(bbox[1])),
-                (float(bbox[3]), float(bbox[0])),
-            ]
-            polygon = Polygon(coords)
-            polygons.append(polygon)
-        gdf = geopandas.GeoDataFrame(
-            df[["value", "color"]], geometry=polygons, crs="epsg:4326"
+    with col2:
+        selected_format = st.selectbox(
+            "Select format for download",
+            list(hotspot_exports.EXPORT_FORMATS),
+            format_func=lambda export_format: hotspot_exports.EXPORT_FORMATS[export_format][0],
         )
 
-        return gdf
-
-    @st.cache
-    def save_shapefile_with_bytesio(dataframe, directory):
-        dataframe.to_file(f"{directory}/user_shapefiles.shp", driver="ESRI Shapefile")
-        zipObj = ZipFile(f"{directory}/user_shapefiles_zip.zip", "w")
-        zipObj.write(f"{directory}/user_shapefiles.shp", arcname="user_shapefiles.shp")
-        zipObj.write(f"{directory}/user_shapefiles.cpg", arcname="user_shapefiles.cpg")
-        zipObj.write(f"{directory}/user_shapefiles.dbf", arcname="user_shapefiles.dbf")
-        zipObj.write(f"{directory}/user_shapefiles.prj", arcname="user_shapefiles.prj")
-        zipObj.write(f"{directory}/user_shapefiles.shx", arcname="user_shapefiles.shx")
-        zipObj.close()
-
-    def export(selected_country, sel_grid_size):
-        export_df = pd.read_csv(f"db/{selected_country}/total_{sel_grid_size}.csv")
-        export_df["grid_bbox"] = export_df["grid_bbox"].apply(
-            lambda x: ast.literal_eval(x)
-        )
-        gdf = convert_df(export_df)
-        with tempfile.TemporaryDirectory() as tmp:
-            save_shapefile_with_bytesio(gdf, tmp)
-            return open(f"{tmp}/user_shapefiles_zip.zip", "rb")
-
-    if not cell_colors_sums.empty:
-        st.download_button(
-            label="Download data as shapefile (.shp)",
-            data=export(selected_country, grid_dict[selected_grid_size]),
-            file_name=f"{selected_country}_{grid_dict[selected_grid_size]}.zip",
-            mime="application/zip",
-        )
+    # The files are built by the monthly pipeline, the dashboard only streams them
+    export_path = hotspot_exports.export_path(
+        selected_country, selected_grid.name, selected_format, db_dir="db"
+    )
+    if os.path.exists(export_path):
+        label, mime = hotspot_exports.EXPORT_FORMATS[selected_format]
+        with open(export_path, "rb") as export_file:
+            st.download_button(
+                label=f"Download data as {label}",
+                data=export_file,
+                file_name=f"{selected_country}_{selected_grid.name}.{selected_format}",
+                mime=mime,
+            )
 
 except Exception as e:
     print(e)
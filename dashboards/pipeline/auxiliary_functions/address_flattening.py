@@ -0,0 +1,175 @@
+import io
+import json
+import re
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.json as pa_json
+
+# Address components of the search results, all of them strings
+ADDRESS_COMPONENTS = (
+    'streetNumber', 'streetName', 'crossStreet', 'municipalitySubdivision', 'neighbourhood',
+    'municipality', 'localName', 'countryTertiarySubdivision', 'countrySecondarySubdivision',
+    'countrySubdivision', 'countrySubdivisionName', 'countrySubdivisionCode', 'postalCode',
+    'extendedPostalCode', 'countryCode', 'country', 'countryCodeISO3', 'freeformAddress',
+)
+
+# Component and JSON kind of the value the Arrow JSON reader could not read as a string, like
+# "Column(/postalCode) changed from string to number in row 0"
+ERROR_COLUMN = re.compile(r"Column\(/([^)]+)\) changed from \w+ to (\w+)")
+
+# Arrow types the values of a JSON kind are read with, before being cast into strings
+JSON_KIND_TYPES = {'number': (pa.int64(), pa.float64()), 'boolean': (pa.bool_(),)}
+
+
+def address_schema(components: tuple or list = ADDRESS_COMPONENTS) -> pa.Schema:
+    """Gets the Arrow schema of the address components to read.
+
+    :param components: Names of the address components, defaults to ADDRESS_COMPONENTS.
+    :type components: tuple or list, optional
+    :rtype: pa.Schema
+    """
+    return pa.schema([(component, pa.string()) for component in components])
+
+
+def component_string(value) -> str or None:
+    """Converts a parsed component value into a string, non string values as their JSON text, like 28001 into '28001'.
+
+    :rtype: str or None
+    """
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value)
+
+
+def read_json_lines(data: bytes, schema: pa.Schema) -> pa.Table:
+    """Reads newline delimited JSON documents in bulk, with the columns of the schema only.
+
+    :rtype: pa.Table
+    """
+    return pa_json.read_json(
+        io.BytesIO(data),
+        parse_options=pa_json.ParseOptions(explicit_schema=schema, unexpected_field_behavior='ignore'),
+    )
+
+
+def parse_component_rows(lines: list, name: str) -> pa.Array:
+    """Parses the values of one component address by address, for the components whose values mix JSON kinds, like 28013 and '28001', or are objects or arrays.
+
+    :param lines: List of address JSON strings.
+    :type lines: list
+    :param name: Name of the component.
+    :type name: str
+    :rtype: pa.Array
+    """
+    addresses = (json.loads(line) for line in lines)
+    return pa.array(
+        [component_string(address.get(name)) if isinstance(address, dict) else None for address in addresses],
+        type=pa.string(),
+    )
+
+
+def read_component_strings(data: bytes, lines: list, name: str, kind: str) -> pa.Array:
+    """Reads a component with values that are not strings as strings. The values of a single JSON kind are
+    read in bulk with the Arrow type of that kind and cast, like 28001 into '28001'.
+
+    :param data: Newline delimited address JSON documents.
+    :type data: bytes
+    :param lines: List of the same address JSON strings.
+    :type lines: list
+    :param name: Name of the component.
+    :type name: str
+    :param kind: JSON kind of the first value that is not a string, as reported by the Arrow JSON reader.
+    :type kind: str
+    :rtype: pa.Array or pa.ChunkedArray
+    """
+    for arrow_type in JSON_KIND_TYPES.get(kind, ()):
+        try:
+            column = read_json_lines(data, pa.schema([(name, arrow_type)])).column(name)
+        except pa.ArrowInvalid:
+            continue
+        return pc.cast(column, pa.string())
+    return parse_component_rows(lines, name)
+
+
+def parse_address_chunk(addresses: pd.Series, schema: pa.Schema) -> pa.Table:
+    """Parses a chunk of address JSON strings in bulk, as one newline delimited JSON document.
+    The components missing from an address are null and the ones not in the schema are skipped.
+    The components with values that are not strings, like a numeric postalCode, are left out of the
+    bulk read and read on their own as strings, so the other components are still parsed in bulk.
+
+    :param addresses: Series of address JSON strings.
+    :type addresses: pd.Series
+    :param schema: Schema of the components to read, as returned by address_schema.
+    :type schema: pa.Schema
+    :return: Table with a column per component and a row per address.
+    :rtype: pa.Table
+    """
+    # Compact JSON documents have no raw newlines, pretty printed ones only between tokens
+    lines = addresses.fillna('{}').astype(str).str.replace('\n', ' ', regex=False)
+    # Empty addresses and JSON values that are not objects have no components
+    lines = lines.where(lines.str.lstrip().str.startswith('{'), '{}')
+    data = '\n'.join(lines).encode('utf-8') + b'\n'
+
+    string_schema, kinds = schema, {}
+    while True:
+        try:
+            table = read_json_lines(data, string_schema)
+            break
+        except pa.ArrowInvalid as e:
+            match = ERROR_COLUMN.search(str(e))
+            if match is None or match.group(1) not in string_schema.names:
+                raise
+            kinds[match.group(1)] = match.group(2)
+            string_schema = string_schema.remove(string_schema.get_field_index(match.group(1)))
+
+    if table.num_rows != len(addresses):
+        raise ValueError(f"Parsed {table.num_rows} addresses out of {len(addresses)}")
+    columns = [
+        read_component_strings(data, lines, name, kinds[name]) if name in kinds else table.column(name)
+        for name in schema.names
+    ]
+    return pa.table(columns, schema=schema)
+
+
+def iter_flattened_addresses(
+    addresses: pd.Series, components: tuple or list = ADDRESS_COMPONENTS, chunk_size: int = 500_000
+):
+    """Flattens the address JSON strings in chunks, so a large sample is never parsed at once.
+
+    :param addresses: Series of address JSON strings.
+    :type addresses: pd.Series
+    :param components: Names of the address components to read, defaults to ADDRESS_COMPONENTS.
+    :type components: tuple or list, optional
+    :param chunk_size: Number of addresses parsed at once, defaults to 500000.
+    :type chunk_size: int, optional
+    :return: Generator of DataFrames with a column per component, indexed like the addresses of the chunk.
+    :rtype: typing.Iterator[pd.DataFrame]
+    """
+    schema = address_schema(components)
+    for start in range(0, len(addresses), chunk_size):
+        chunk = addresses.iloc[start:start + chunk_size]
+        chunk_df = parse_address_chunk(chunk, schema).to_pandas()
+        chunk_df.index = chunk.index
+        yield chunk_df
+
+
+def flatten_addresses(
+    addresses: pd.Series, components: tuple or list = ADDRESS_COMPONENTS, chunk_size: int = 500_000
+) -> pd.DataFrame:
+    """Flattens the address JSON strings into a column per address component.
+
+    :param addresses: Series of address JSON strings.
+    :type addresses: pd.Series
+    :param components: Names of the address components to read, defaults to ADDRESS_COMPONENTS.
+    :type components: tuple or list, optional
+    :param chunk_size: Number of addresses parsed at once, defaults to 500000.
+    :type chunk_size: int, optional
+    :return: DataFrame with a column per component, indexed like the addresses.
+    :rtype: pd.DataFrame
+    """
+    chunks = list(iter_flattened_addresses(addresses, components, chunk_size))
+    if not chunks:
+        return pd.DataFrame(columns=list(components), index=addresses.index)
+    return pd.concat(chunks)
@@ -0,0 +1,118 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from auxiliary_functions.adx_utils import get_request_properties, response_to_dataframe
+
+
+class RateLimiter:
+    """Token bucket shared by the threads of a FetchEngine, that allows up to `rate`
+    queries per second with bursts of up to `burst` queries.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class FetchEngine:
+    """Runs ADX queries with a single client through one persistent, bounded thread pool.
+    Every query submitted to the engine goes to the same work queue, whatever the country
+    or the day it is for.
+
+    :param client: Client used for every query, like a KustoClient or any local stand-in implementing `execute(database, query, properties)`.
+    :type client: azure.kusto.data.KustoClient
+    :param database: Name of the database the queries run on.
+    :type database: str
+    :param max_workers: Maximum number of queries running at the same time, defaults to 15.
+    :type max_workers: int, optional
+    :param rate_limit: Maximum number of queries started per second, defaults to None which means no limit.
+    :type rate_limit: float or None, optional
+    :param retries: Number of times a failed query is retried, defaults to 3.
+    :type retries: int, optional
+    :param backoff: Seconds waited before the first retry, doubled on every retry, defaults to 2.
+    :type backoff: float, optional
+    :param timeout: Server side timeout of each query in seconds, defaults to 600.
+    :type timeout: float or None, optional
+    """
+
+    def __init__(
+        self, client, database: str, max_workers: int = 15, rate_limit: float or None = None,
+        retries: int = 3, backoff: float = 2.0, timeout: float or None = 600,
+    ):
+        self.client = client
+        self.database = database
+        self.retries = retries
+        self.backoff = backoff
+        self.properties = get_request_properties(timeout) if timeout is not None else None
+        self.rate_limiter = RateLimiter(rate_limit) if rate_limit else None
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="adx-fetch")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+
+    def execute(self, query: str):
+        """Executes a query, retrying with exponential backoff and jitter when it fails.
+
+        :param query: ADX query string.
+        :type query: str
+        :return: The ADX response of the query.
+        """
+        for attempt in range(self.retries + 1):
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            try:
+                return self.client.execute(self.database, query, self.properties)
+            except Exception:
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    def submit(self, query: str, decode=response_to_dataframe):
+        """Adds a query to the work queue.
+
+        :param decode: Function that converts the ADX response, defaults to response_to_dataframe.
+        :type decode: callable, optional
+        :return: Future with the decoded response.
+        :rtype: concurrent.futures.Future
+        """
+        return self.executor.submit(lambda: decode(self.execute(query)))
+
+    def fetch(self, queries, decode=response_to_dataframe):
+        """Runs every query and yields their results as soon as they complete.
+
+        :param queries: Iterable of (key, query) pairs, where the key identifies the query, like (country, day).
+        :type queries: typing.Iterable[tuple]
+        :param decode: Function that converts each ADX response, defaults to response_to_dataframe.
+        :type decode: callable, optional
+        :return: Generator of (key, status, data) tuples, with status "success" and the decoded response, or "error" and the exception raised by the last retry.
+        :rtype: typing.Iterator[tuple]
+        """
+        futures = {self.submit(query, decode=decode): key for key, query in queries}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], "success", future.result()
+            except Exception as e:
+                yield futures[future], "error", e
@@ -1,5 +1,29 @@
+import functools
+from datetime import timedelta
+
+import numpy
 import pandas
-from azure.kusto.data import KustoClient, KustoConnectionStringBuilder
+import pyarrow
+from azure.kusto.data import ClientRequestProperties, KustoClient, KustoConnectionStringBuilder
+
+
+# Arrow types of the Kusto column types, the other types are inferred
+KUSTO_TYPES = {
+    "string": pyarrow.string(),
+    "long": pyarrow.int64(),
+    "int": pyarrow.int32(),
+    "real": pyarrow.float64(),
+    "bool": pyarrow.bool_(),
+}
+
+# Explicit types of the columns returned by the search logs queries
+COLUMN_TYPES = {
+    "lat": pyarrow.float64(),
+    "lon": pyarrow.float64(),
+    "search_query_counts": pyarrow.uint32(),
+    "grid_row": pyarrow.int64(),
+    "grid_col": pyarrow.int64(),
+}
 
 
 def get_adx_secrets():
@@ -21,7 +45,110 @@ def get_adx_secrets():
 
 
 
-def execute_adx_query(query, cluster, database, client_id, secret_id, tenant_id):
+@functools.lru_cache(maxsize=None)
+def get_adx_client(cluster, client_id, secret_id, tenant_id):
+    """Method to get the authenticated ADX client of a cluster. The client is created once per
+    process and reused by every query, so the AAD authentication is only done once.
+
+    Args:
+        cluster ([str]): Sting input with name of cluster to connect in ADX.
+        client_id ([str]): String input with app registry client_id value.
+        secret_id ([str]): String input with app registry secret_id value.
+        tenant_id ([str]): String input with app registry tenant_id value.
+
+    Returns:
+        [azure.kusto.data.KustoClient]: Output client connected to the cluster.
+    """
+    kcsb = KustoConnectionStringBuilder.with_aad_application_key_authentication(cluster, client_id, secret_id, tenant_id)
+    return KustoClient(kcsb)
+
+
+def get_request_properties(timeout):
+    """Method to get the request properties of a query with a server side timeout.
+
+    Args:
+        timeout ([float]): Float input with the query timeout in seconds.
+
+    Returns:
+        [azure.kusto.data.ClientRequestProperties]: Output properties to pass to the client.
+    """
+    properties = ClientRequestProperties()
+    properties.set_option(ClientRequestProperties.request_timeout_option_name, timedelta(seconds=timeout))
+    return properties
+
+
+def column_to_arrow(values, column_type, arrow_type=None):
+    """Method to build a typed Arrow array from the raw values of a Kusto column.
+
+    Args:
+        values ([list]): Input raw JSON values of the column.
+        column_type ([str]): Kusto type of the column, like "long" or "real".
+        arrow_type ([pyarrow.DataType]): Optional type to cast the column to, instead of the type of the Kusto type.
+
+    Returns:
+        [pyarrow.Array]: Output typed array of the column.
+    """
+    kusto_type = KUSTO_TYPES.get(column_type)
+    try:
+        array = pyarrow.array(values, type=kusto_type)
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError, TypeError):
+        # Kusto writes non finite reals as the strings "NaN" and "Infinity"
+        array = pyarrow.array(pandas.to_numeric(numpy.asarray(values, dtype=object), errors="coerce"))
+    if arrow_type is not None and not array.type.equals(arrow_type):
+        array = array.cast(arrow_type)
+    return array
+
+
+def rows_to_record_batch(columns, raw_rows, column_types=None):
+    """Method to build a record batch column by column from raw Kusto rows, without creating a dict per row.
+
+    Args:
+        columns ([list]): Input KustoResultColumn list of the table.
+        raw_rows ([list]): Input raw rows of the table, as lists of values.
+        column_types ([dict]): Optional explicit Arrow types by column name, defaults to COLUMN_TYPES.
+
+    Returns:
+        [pyarrow.RecordBatch]: Output typed record batch.
+    """
+    column_types = COLUMN_TYPES if column_types is None else column_types
+    values = list(zip(*raw_rows)) if raw_rows else [[] for _ in columns]
+    return pyarrow.RecordBatch.from_arrays(
+        [
+            column_to_arrow(list(column_values), column.column_type, column_types.get(column.column_name))
+            for column, column_values in zip(columns, values)
+        ],
+        [column.column_name for column in columns],
+    )
+
+
+def response_to_arrow(response, column_types=None):
+    """Method to convert the primary result table of an ADX response into a typed Arrow table.
+
+    Args:
+        response ([azure.kusto.data.response.KustoResponseDataSetV2]): Input response of the ADX query.
+        column_types ([dict]): Optional explicit Arrow types by column name, defaults to COLUMN_TYPES.
+
+    Returns:
+        [pyarrow.Table]: Output Arrow table with table queried in ADX.
+    """
+    table = response.tables[1]
+    return pyarrow.Table.from_batches([rows_to_record_batch(table.columns, table.raw_rows, column_types)])
+
+
+def response_to_dataframe(response, column_types=None):
+    """Method to convert the primary result table of an ADX response into a dataframe with typed columns.
+
+    Args:
+        response ([azure.kusto.data.response.KustoResponseDataSetV2]): Input response of the ADX query.
+        column_types ([dict]): Optional explicit Arrow types by column name, defaults to COLUMN_TYPES.
+
+    Returns:
+        [pandas.core.frame.DataFrame]: Output pandas dataframe with table queried in ADX.
+    """
+    return response_to_arrow(response, column_types).to_pandas(split_blocks=True, self_destruct=True)
+
+
+def execute_adx_query(query, cluster, database, client_id, secret_id, tenant_id, client=None, properties=None):
     """Method to execute an adx query.
 
     Args:
@@ -31,13 +158,15 @@ def execute_adx_query(query, cluster, database, client_id, secret_id, tenant_id)
         client_id ([str]): String input with app registry client_id value.
         secret_id ([str]): String input with app registry secret_id value.
         tenant_id ([str]): String input with app registry tenant_id value.
+        client ([azure.kusto.data.KustoClient]): Optional client to use instead of the cached client of the cluster.
+        properties ([azure.kusto.data.ClientRequestProperties]): Optional request properties of the query.
 
     Returns:
         [pandas.core.frame.DataFrame]: Output pandas dataframe with table queried in ADX.
         [azure.kusto.data.response.KustoResponseDataSetV2]: Output response of the ADX query.
     """
-    kcsb = KustoConnectionStringBuilder.with_aad_application_key_authentication(cluster, client_id, secret_id, tenant_id)
-    client = KustoClient(kcsb)
-    response = client.execute(database, query)
-    out_df = pandas.DataFrame(data=response.tables[1].to_dict()["data"])
-    return out_df, response
\ No newline at end of file
+    if client is None:
+        client = get_adx_client(cluster, client_id, secret_id, tenant_id)
+    response = client.execute(database, query, properties)
+    out_df = response_to_dataframe(response)
+    return out_df, response
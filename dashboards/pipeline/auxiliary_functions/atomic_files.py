@@ -0,0 +1,24 @@
+import contextlib
+import os
+
+
+@contextlib.contextmanager
+def atomic_write(path: str, suffix: str = ""):
+    """Context manager that yields a temporary path next to `path` to write the file to. The
+    temporary file is moved in place when the block succeeds and removed when it fails, so
+    readers never see a half-written file.
+
+    :param path: Destination file path.
+    :type path: str
+    :param suffix: Suffix of the temporary file, for the writers that pick the format from the extension, defaults to "".
+    :type suffix: str, optional
+    :return: Context manager yielding the temporary path.
+    :rtype: typing.ContextManager[str]
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp{suffix}"
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
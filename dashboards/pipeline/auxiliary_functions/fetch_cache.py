@@ -0,0 +1,104 @@
+import hashlib
+import os
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from auxiliary_functions.atomic_files import atomic_write
+
+
+class FetchCache:
+    """On-disk cache of the (country, day) query results. Every result is stored as a compact
+    columnar Feather file addressed by its country, its day and the fingerprint of the query
+    that produced it, so a changed query never reads the results of the previous one.
+
+    Only successful results are stored, so the days missing from the cache are the ones never
+    fetched or that failed, and a rerun only has to query those.
+
+    :param cache_dir: Folder of the cache.
+    :type cache_dir: str
+    :param max_bytes: Maximum size of the cache, the least recently used results are evicted above it, defaults to 2 GB.
+    :type max_bytes: int, optional
+    :param max_age: Days after which a result is stale and evicted, defaults to 62.
+    :type max_age: float or None, optional
+    """
+
+    EXTENSION = "feather"
+
+    def __init__(self, cache_dir: str, max_bytes: int = 2 * 1024 ** 3, max_age: float or None = 62):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    @staticmethod
+    def fingerprint(query: str) -> str:
+        """Gets the fingerprint of a query, the hash of the generated KQL.
+
+        :rtype: str
+        """
+        return hashlib.sha256(query.encode("utf-8")).hexdigest()[:32]
+
+    def path(self, country: str, day, query: str) -> str:
+        return f"{self.cache_dir}/{country}/{day:%Y-%m-%d}_{self.fingerprint(query)}.{self.EXTENSION}"
+
+    def get(self, country: str, day, query: str) -> pd.DataFrame or None:
+        """Gets the cached result of a query, marking it as recently used.
+
+        :return: The result DataFrame, or None when the query is not cached.
+        :rtype: pd.DataFrame or None
+        """
+        path = self.path(country, day, query)
+        try:
+            df = feather.read_feather(path)
+            os.utime(path)
+        except (FileNotFoundError, pa.ArrowInvalid):
+            return None
+        return df
+
+    def put(self, country: str, day, query: str, df: pd.DataFrame) -> None:
+        """Stores the result of a query. The file is written next to its destination and moved
+        in place, so a crash never leaves a partial result in the cache.
+        """
+        path = self.path(country, day, query)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with atomic_write(path) as tmp_path:
+            feather.write_feather(df.reset_index(drop=True), tmp_path, compression="zstd")
+
+    def entries(self) -> list:
+        # (last use, size, path) of every cached result
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(f".{self.EXTENSION}"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self) -> int:
+        """Removes the stale results, then the least recently used ones until the cache fits in max_bytes.
+
+        :return: Number of results removed.
+        :rtype: int
+        """
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        oldest = time.time() - self.max_age * 86400 if self.max_age is not None else None
+
+        removed = 0
+        for last_use, size, path in entries:
+            if total <= self.max_bytes and (oldest is None or last_use >= oldest):
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        return removed
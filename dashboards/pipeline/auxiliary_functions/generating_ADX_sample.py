@@ -1,20 +1,21 @@
 # Databricks notebook source
 import pandas as pd
-import numpy as np
 # from maps_analytics_utils.connections import adx, connections_utils
-from auxiliary_functions.adx_utils import get_adx_secrets, execute_adx_query
+from auxiliary_functions.adx_utils import get_adx_secrets, get_adx_client
+from auxiliary_functions.adx_fetch import FetchEngine
+from auxiliary_functions.fetch_cache import FetchCache
+from auxiliary_functions.grid_pushdown import cell_summary_kql
+from auxiliary_functions.address_flattening import ADDRESS_COMPONENTS, flatten_addresses
+from auxiliary_functions.query_decoding import decode_searched_queries
 import typing
-import json
+import collections
 from datetime import date, datetime, timedelta
-import math
-import os
-import urllib.parse
-import glob
-import shutil
 
-from threading import current_thread
+ADX_CLUSTER = "https://ttapianalyticsadxpweu.westeurope.kusto.windows.net"
+ADX_DATABASE = "ttapianalytics-onlineSearch"
 
-import multiprocessing.pool
+# Fetch engine of the process, see get_fetch_engine
+fetch_engine = None
 
 # COMMAND ----------
 
@@ -25,7 +26,7 @@ import multiprocessing.pool
 # COMMAND ----------
 
 def query_addresses_new_OnlineSearch(
-    country_code: str or None,
+    country_code: str or typing.List[str] or typing.Tuple[str] or None,
     endpoint_list: typing.List[str] or typing.Tuple[str] or None = None,
     exclude_endpoint_list: typing.List[str] or typing.Tuple[str] or None = ('search 2 poiSearch'),
     sample: int or None = 100000,
@@ -33,10 +34,14 @@ def query_addresses_new_OnlineSearch(
     start: datetime or None = (date.today() - timedelta(days=15)),
     end: datetime or None = (date.today() - timedelta(days=1)),
     check_query: bool = False,
+    cell_summary: str or None = None,
 ) -> str:
 
     """Function that generates the string query in KQL (kusto query language) to perform in ADX.
+    When a list of country codes is given, a single query returns the results of all of them, sampled and grouped by countryCode server-side, with a countryCode column to split them by.
 
+    :param country_code: ISO-2 code of the country, or list of ISO-2 codes of a batch of countries.
+    :type country_code: str or typing.List[str] or typing.Tuple[str]
     :param country_names: List of names the country can have. Most countries have a lot of denominations and in ADX, the countries denominations are not consistent. So, in order to obtain all possible results, we pass this argument that contain a lot of possible country denominations. This are generated using the "get_country_spellings" function.
     :type country_names: typing.List[str] or typing.Tuple[str] or None
     :param endpoint_list: List of the endpoints you want to filter out for your query, defaults to None, which means no endpoint will be filtered out. 
@@ -51,6 +56,8 @@ def query_addresses_new_OnlineSearch(
     :type ago: int or None, optional
     :param check_query: Boolean that allows to print the query that was passed to kusto in order to debug. Only switch to True if you are having problems with the query response or the number of responses. Defaults to False, which means that the query shouldn't be printed.
     :type check_query: bool, optional.
+    :param cell_summary: KQL that summarizes the sampled locations per grid cell server-side, as generated by grid_pushdown.cell_summary_kql. Defaults to None, which means the counts are returned per location.
+    :type cell_summary: str or None, optional
     :return: The string to pass to the ADX instance in order to get the response for a specific country.
     :rtype: str
     """
@@ -79,6 +86,22 @@ def query_addresses_new_OnlineSearch(
         sample_string = f"| sample 1000"
 
 
+    if isinstance(country_code, (list, tuple)):
+        # Batch of countries: keep the countryCode of every result and sample each country on its own
+        country_filter = f"(countryCode in ({', '.join(repr(code) for code in country_code)}))"
+        distinct_string = "distinct ['Tracking-ID'], countryCode, location = tostring(location)"
+        sample_string = f"| partition hint.strategy=native by countryCode ({sample_string[2:]})"
+        summarize_string = "summarize search_query_counts = count() by countryCode, tostring(location)"
+        final_sample_string = "| partition hint.strategy=native by countryCode (sample 100000)"
+    else:
+        country_filter = f"(countryCode == '{country_code}')"
+        distinct_string = "distinct ['Tracking-ID'], location = tostring(location)"
+        summarize_string = "summarize search_query_counts = count() by tostring(location)"
+        final_sample_string = "| sample 100000"
+        if cell_summary is not None:
+            # The cell summary joins the grids of each country on its countryCode
+            final_sample_string += f"\n                        | extend countryCode = '{country_code}'"
+
     building_string = f'''
                         {look_back}
                         let SearchNormalRequests = (
@@ -105,10 +128,10 @@ def query_addresses_new_OnlineSearch(
                             database("ttapianalytics-onlineSearch").
                             OnlineSearchResults
                             | where timestamp between(timeStart .. timeEnd)
-                            | where (rank == 0) and (['Tracking-ID'] != 'DMS') and (countryCode == '{country_code}')
+                            | where (rank == 0) and (['Tracking-ID'] != 'DMS') and {country_filter}
                             | where matchConfidence.score >= 0.80 or isnull(matchConfidence.score)
                             | project-away timestamp, rank
-                            | distinct ['Tracking-ID'], location = tostring(location)
+                            | {distinct_string}
                             {sample_string}
                         );
                         let SearchResults = (
@@ -117,9 +140,11 @@ def query_addresses_new_OnlineSearch(
                             | project-away ['Tracking-ID1']
                         );
                         SearchResults
-                        | summarize search_query_counts = count() by tostring(location)
-                        | sample 100000
+                        | {summarize_string}
+                        {final_sample_string}
                     '''
+    if cell_summary is not None:
+        building_string += cell_summary
     if check_query:
         print('THIS IS THE QUERY YOU EXECUTED ON ADX:')
         print(building_string)
@@ -127,10 +152,59 @@ def query_addresses_new_OnlineSearch(
     
     return building_string
 
+def get_fetch_engine() -> FetchEngine:
+    """Gets the fetch engine of the process, created on first use. It holds the only ADX client
+    and the only query thread pool of the process, so every (country, day) query shares them.
+
+    :return: The fetch engine connected to the search logs cluster.
+    :rtype: FetchEngine
+    """
+    global fetch_engine
+    if fetch_engine is None:
+        tenant_id, client_id, secret_value, secret_id = get_adx_secrets()
+        client = get_adx_client(ADX_CLUSTER, client_id, secret_id, tenant_id)
+        fetch_engine = FetchEngine(client, ADX_DATABASE, max_workers=15)
+    return fetch_engine
+
+
+def country_day_queries(
+    country: str or tuple, end: datetime, endpoint_list: list or tuple or None = None, sample: int=10000,
+    ago: int = 365, exclude_endpoint_list: list or tuple or str or None = ('search 2 poiSearch'),
+    check_query: bool = False, cell_summary: str or None = None
+) -> list:
+    """Generates one query per day for a given country, or a batch of countries, going back "ago" days from the end date.
+    The parameters are the same as in get_country_logs_multiThreading.
+
+    :param country: ISO-2 code of the country, or tuple of ISO-2 codes of a batch of countries queried together.
+    :type country: str or tuple
+    :param cell_summary: KQL that summarizes the results per grid cell server-side, defaults to None.
+    :type cell_summary: str or None, optional
+    :return: List of ((country, day), query) pairs.
+    :rtype: list
+    """
+    queries = []
+    start = end - timedelta(days=1)
+    for _ in range(int(ago)):
+        queries.append(((country, start), query_addresses_new_OnlineSearch(
+            country_code=country,
+            endpoint_list=endpoint_list,
+            sample=int(sample/int(ago)),
+            exclude_endpoint_list=exclude_endpoint_list,
+            ago=ago,
+            start=start,
+            end=end,
+            check_query=check_query,
+            cell_summary=cell_summary,
+        )))
+        start = start - timedelta(days=1)
+        end = end - timedelta(days=1)
+    return queries
+
+
 def get_country_logs_multiThreading(
     country: str, end: datetime, endpoint_list: list or tuple or None = None, sample: int=10000, 
     ago: int = 365, exclude_endpoint_list: list or tuple or str or None = ('search 2 poiSearch'),
-    check_query: bool = False
+    check_query: bool = False, engine: FetchEngine or None = None, cache: FetchCache or None = None
 ) -> pd.DataFrame:
     """Gets search logs for a given country
     :param country: string of ISO-2 code of a country ('ES', not 'ESP').
@@ -149,118 +223,198 @@ def get_country_logs_multiThreading(
     :type exclude_endpoint_list: typing.List[str] or typing.Tuple[str] or str or None
     :param check_query: Boolean that allows to print the query that was passed to kusto in order to debug. Only switch to True if you are having problems with the query response or the number of responses. Defaults to False, which means that the query shouldn't be printed.
     :type check_query: bool, optional.
+    :param engine: Fetch engine that runs the day queries, defaults to None, which means the engine of the process.
+    :type engine: FetchEngine or None, optional
+    :param cache: Cache of the (country, day) results, defaults to None, which means every day is queried.
+    :type cache: FetchCache or None, optional
     :return: DataFrame with logs for the specified search parameters.
     :rtype: pd.DataFrame
     """
+    queries = country_day_queries(
+        country=country, end=end, endpoint_list=endpoint_list, sample=sample, ago=ago,
+        exclude_endpoint_list=exclude_endpoint_list, check_query=check_query
+    )
+    return collect_country_logs(queries, engine or get_fetch_engine(), cache=cache)[country]
 
-    end = end
-    start = end - timedelta(days=1)
-    addresses_df = pd.DataFrame()
-    num_threads = 15
-    iterations = 0
-    while iterations < int(ago):
-        
-        if (int(ago) - (iterations)) < num_threads:
-            num_threads = (int(ago) - (iterations))
-        print(f"ITERATION {int(iterations/num_threads)}: days {iterations } to {(iterations + num_threads)}")
-        
-        countries_queries = []
-        for i in range(num_threads):
-            countries_queries.append(query_addresses_new_OnlineSearch(
-                country_code=country,
-                endpoint_list=endpoint_list,
-                sample=int(sample/int(ago)),
-                exclude_endpoint_list=exclude_endpoint_list,
-                ago=ago,
-                start=start,
-                end=end,
-                check_query=check_query,
-            ))
-            # print(f"Getting records for {start} - {end}...")
-            start = start - timedelta(days=1)
-            end = end - timedelta(days=1)
-
-        # a thread pool that implements the process pool API.
-        pool = multiprocessing.pool.ThreadPool(processes=num_threads)
-        return_list = pool.map(makeRequest, countries_queries, chunksize=1)
-        pool.close()
-
-        for status, data in return_list:
-            addresses_df = pd.concat([addresses_df, data])
-
-        # addresses_df = deduplicate_on(addresses_df, 'searched_query', 'search_query_counts')    
-        print(f"TOTAL: {addresses_df.shape[0]} Records ")
-        iterations += num_threads
-    
-    addresses_df = deduplicate_on(addresses_df, 'location', 'search_query_counts')
-    print(f"FINAL RESULT: {addresses_df.shape[0]} Records ")
-    # parse_address_and_search_request(addresses_df)
-    return addresses_df
-# COMMAND ----------
-def makeRequest(query_country):
-    """ Function that receives an ADX query string and assigns it to each of the active threads that performs an ADX call.
-    
-    :param query_country: ADX Query for a specific day and specific country
-    :param query_country: str
-    :return: Returns the response from ADX.
-    :rtype: list
-    """  
-    try:
-        thread = current_thread()
-        # print(f'Worker thread: name={thread.name}, idnet={get_ident()}, id={get_native_id()}')
 
-        tenant_id, client_id, secret_value, secret_id = get_adx_secrets()
-        partial_addresses_df, _ = execute_adx_query(
-            query=query_country,
-            cluster="https://ttapianalyticsadxpweu.westeurope.kusto.windows.net",
-            database="ttapianalytics-onlineSearch",
-            client_id=client_id,
-            secret_id=secret_id,
-            tenant_id=tenant_id,
+class LocationCounter:
+    """Hash aggregation of the search counts by location. Each response is folded into it as soon as it arrives,
+    so the counts are summed without concatenating the responses of every day first.
+    """
+
+    def __init__(self):
+        self.counts = collections.Counter()
+
+    def add(self, df: pd.DataFrame) -> None:
+        """Adds the search counts of a response DataFrame with location and search_query_counts columns.
+
+        :param df: Response of one (country, day) query.
+        :type df: pd.DataFrame
+        """
+        if df.empty:
+            return
+        self.counts.update(df.groupby('location', sort=False)['search_query_counts'].sum().to_dict())
+
+    def to_frame(self) -> pd.DataFrame:
+        """Gets the deduplicated logs, same as deduplicate_on(logs, 'location', 'search_query_counts').
+
+        :return: DataFrame with the location and search_query_counts columns.
+        :rtype: pd.DataFrame
+        """
+        return pd.DataFrame(
+            {'location': list(self.counts.keys()), 'search_query_counts': list(self.counts.values())},
+            columns=['location', 'search_query_counts']
         )
-        return "success", partial_addresses_df
-    except:
-        return "error", "Error"
 
-# COMMAND ----------
 
-def parse_searched_query(x) :
-    """ Mapping function that receives the query string and translates all coded charactes like %20 -> space
-    
-    :param x: Query value for each row containing encoded query string
-    :param x: str
-    :return: Returns the decoded query string.
-    :rtype: str
-    """  
-    if not x:
-        x = ''
-    else:
-        x = urllib.parse.unquote(x)
-        x = x[:min([idx if y == '.' else len(x) for idx, y in enumerate(x) ])]
-    
-    return x
+def key_countries(country: str or tuple) -> tuple:
+    """Gets the countries of a query key, that can be a single country or a batch of countries.
 
+    :rtype: tuple
+    """
+    return tuple(country) if isinstance(country, (list, tuple)) else (country,)
+
+
+def cache_key(country: str or tuple) -> str:
+    # Cache folder of the results of a country or a batch of countries
+    return '_'.join(key_countries(country))
+
+
+def add_response(accumulators: dict, country: str or tuple, data: pd.DataFrame) -> None:
+    """Adds a response to the accumulators of its countries. The response of a batch of countries is split on its countryCode column.
+
+    :param accumulators: Dictionary with the countries as keys and objects with an add(df) method as values.
+    :type accumulators: dict
+    :param country: Country, or batch of countries, of the query.
+    :type country: str or tuple
+    :param data: Response of the query.
+    :type data: pd.DataFrame
+    """
+    if not isinstance(country, (list, tuple)):
+        accumulators[country].add(data)
+        return
+    if data.empty:
+        return
+    # Match the codes returned by ADX with the requested ones, whatever their case
+    requested = {code.upper(): code for code in country}
+    for code, country_df in data.groupby('countryCode', sort=False):
+        if str(code).upper() in requested:
+            accumulators[requested[str(code).upper()]].add(country_df.drop(columns='countryCode'))
+
+
+def batch_countries(country_list: list, batch_size: int) -> list:
+    """Splits the countries into batches queried together. Batches of one country are kept as a single country, so their queries are the same as the per-country ones.
+
+    :param country_list: List of countries in ISO-2 code.
+    :type country_list: list
+    :param batch_size: Maximum number of countries per query.
+    :type batch_size: int
+    :return: List of countries and tuples of countries.
+    :rtype: list
+    """
+    batch_size = max(int(batch_size), 1)
+    batches = [tuple(country_list[i:i + batch_size]) for i in range(0, len(country_list), batch_size)]
+    return [batch[0] if len(batch) == 1 else batch for batch in batches]
+
+
+def accumulate_country_logs(
+    queries: list, engine: FetchEngine, accumulators: dict, cache: FetchCache or None = None
+) -> dict:
+    """Runs all the ((country, day), query) pairs in the work queue of the engine and folds every response into the
+    accumulator of its country as soon as it arrives, while the other queries are still running.
+    With a cache, the days already cached are read from it and only the missing or failed days are queried.
+    When any day fails, it raises after every other query has run, so the countries are not gridded with an incomplete month
+    and a rerun only queries the failed days.
+
+    :param queries: List of ((country, day), query) pairs, as returned by country_day_queries. The country can be a batch of countries.
+    :type queries: list
+    :param engine: Fetch engine that runs the queries.
+    :type engine: FetchEngine
+    :param accumulators: Dictionary with the countries as keys and objects with an add(df) method as values, like LocationCounter or grid_utils.GridAccumulator.
+    :type accumulators: dict
+    :param cache: Cache of the (country, day) results, defaults to None, which means every query is run.
+    :type cache: FetchCache or None, optional
+    :return: The same accumulators dictionary.
+    :rtype: dict
+    """
+    missing = []
+    for (country, day), query in queries:
+        data = cache.get(cache_key(country), day, query) if cache is not None else None
+        if data is None:
+            missing.append(((country, day), query))
+        else:
+            add_response(accumulators, country, data)
+    if cache is not None:
+        print(f"{len(queries) - len(missing)} days read from the cache, {len(missing)} to query")
+
+    query_of = dict(missing)
+    failed = []
+    for (country, day), status, data in engine.fetch(missing):
+        if status == "success":
+            if cache is not None:
+                cache.put(cache_key(country), day, query_of[(country, day)], data)
+            add_response(accumulators, country, data)
+        else:
+            print(f"Could not get records for {country} on {day:%Y-%m-%d}: {data}")
+            failed.extend(code for code in key_countries(country) if code not in failed)
+
+    if cache is not None:
+        cache.evict()
+    # An incomplete month must never be gridded, it would be folded into the totals as applied
+    if failed:
+        raise RuntimeError(f"Could not get every day of {failed}, the days fetched are kept in the cache")
+    return accumulators
+
+
+def collect_country_logs(queries: list, engine: FetchEngine, cache: FetchCache or None = None) -> dict:
+    """Runs all the ((country, day), query) pairs in the work queue of the engine and gathers the deduplicated logs of each country.
+
+    :param queries: List of ((country, day), query) pairs, as returned by country_day_queries.
+    :type queries: list
+    :param engine: Fetch engine that runs the queries.
+    :type engine: FetchEngine
+    :param cache: Cache of the (country, day) results, defaults to None, which means every query is run.
+    :type cache: FetchCache or None, optional
+    :return: Dictionary with the countries as keys and their logs DataFrames as values.
+    :rtype: dict
+    """
+    counters = accumulate_country_logs(
+        queries, engine,
+        {country: LocationCounter() for (key, _), _ in queries for country in key_countries(key)},
+        cache=cache
+    )
+
+    country_dict = {}
+    for country, counter in counters.items():
+        addresses_df = counter.to_frame()
+        print(f"FINAL RESULT {country}: {addresses_df.shape[0]} Records ")
+        country_dict[country] = addresses_df
+    return country_dict
 # COMMAND ----------
 
 
 # COMMAND ----------
 
-def parse_address_and_search_request(df: pd.DataFrame) -> pd.DataFrame:
+def parse_address_and_search_request(
+    df: pd.DataFrame, components: list or tuple = ADDRESS_COMPONENTS, chunk_size: int = 500_000
+) -> pd.DataFrame:
     """Function that gets the DataFrame and parses the address and generates columns for each of its components and also parses the search_request.
     
     :param df: DataFrame that contains the data as obtained from the sampling process from ADX.
     :type df: pd.DataFrame
-    :param save_path: Specifies the path on which you want to save the data.
-    :type save_path: str
+    :param components: Address components to generate columns for, defaults to every component in ADDRESS_COMPONENTS. Components missing from an address are left empty.
+    :type components: typing.List[str] or typing.Tuple[str], optional
+    :param chunk_size: Number of addresses parsed at once, defaults to 500000.
+    :type chunk_size: int, optional
     :return: A DataFrame with the parsed relevant responses
     :rtype: pd.DataFrame
     """
-    df['searched_query'] = df['searched_query'].map(parse_searched_query)
+    df['searched_query'] = decode_searched_queries(df['searched_query'])
 
-    # We convert the address string to a dictionary so we can apply the then use the utility pandas has to transform dictionaries into columns
-    df['address'] = df['address'].apply(lambda x :json.loads(x))
-
-    df = pd.concat([df.drop(['address'], axis=1), df['address'].apply(pd.Series)], axis=1)
+    # The address strings are parsed in bulk, in chunks, straight into a column per component
+    df = pd.concat(
+        [df.drop(['address'], axis=1), flatten_addresses(df['address'], components, chunk_size)], axis=1
+    )
 
     return df
 
@@ -288,7 +442,9 @@ def deduplicate_on(df: pd.DataFrame, on_column: str, counts_column: str) -> pd.D
 def address_components_sample_generator(
     country_list: list, end:datetime, endpoint_list: list or tuple or None = None, sample: int = 10000, 
     exclude_endpoint_list: list or tuple or None = ('search 2 poiSearch'),
-    ago: int = 31, check_query: bool = False
+    ago: int = 31, check_query: bool = False, engine: FetchEngine or None = None,
+    accumulators: dict or None = None, cache: FetchCache or None = None, batch_size: int = 1,
+    pushdown_grids: dict or None = None
 ) -> dict:
     '''
     Function that receives the list of countries you want to get the sample for in ISO-2 code, a list of endpoints you want to include in your search, etc. It returns a dictionary with the responses for each of the countries in the list.
@@ -307,54 +463,34 @@ def address_components_sample_generator(
     :type ago: int, optional
     :param check_query: Boolean that allows to print the query that was passed to kusto in order to debug. Only switch to True if you are having problems with the query response or the number of responses. Defaults to False, which means that the query shouldn't be printed.
     :type check_query: bool, optional.
-    :return: Returns a dictionary with the countries as keys and the query response dataframes as values for each country.
+    :param engine: Fetch engine that runs the day queries of all the countries, defaults to None, which means the engine of the process.
+    :type engine: FetchEngine or None, optional
+    :param accumulators: Dictionary with the countries as keys and the accumulators their responses are folded into as they arrive, like grid_utils.GridAccumulator, defaults to None, which means the deduplicated logs are returned.
+    :type accumulators: dict or None, optional
+    :param cache: Cache of the (country, day) results, so a rerun only queries the days that are missing or failed. Defaults to None, which means every day is queried.
+    :type cache: FetchCache or None, optional
+    :param batch_size: Number of countries queried together in every day query, defaults to 1. Bigger batches need fewer round trips to ADX but return bigger responses.
+    :type batch_size: int, optional
+    :param pushdown_grids: Dictionary with the countries as keys and the lists of their grids as values. When given, ADX sums the counts per cell of these grids and only returns (countryCode, grid, grid_row, grid_col, search_query_counts) rows, which need accumulators that take them, like grid_utils.GridAccumulator. Defaults to None, which means the counts are returned per location.
+    :type pushdown_grids: dict or None, optional
+    :return: Returns a dictionary with the countries as keys and the query response dataframes as values for each country, or the accumulators when they are given.
     :rtype: dict
     '''
-    # Create an empty dictionary where we will store all the samples by country name:
-    country_dict = {}
-    
-    # Iterate through the country list and call the get_country_logs function on each country:
-    for country in country_list:
-        sample_df = get_country_logs_multiThreading(
+    # Put the day queries of every country in the same work queue of the fetch engine:
+    queries = []
+    for country in batch_countries(country_list, batch_size):
+        if pushdown_grids is not None:
+            cell_summary = cell_summary_kql({code: pushdown_grids[code] for code in key_countries(country)})
+        else:
+            cell_summary = None
+        queries.extend(country_day_queries(
             country=country,  end=end, endpoint_list=endpoint_list, sample=sample,
-            ago=ago, exclude_endpoint_list=exclude_endpoint_list, check_query=check_query
-        )
-        
-        country_dict[country] = sample_df
-        
-    return country_dict
-
-
-#### SAVING THE SAMPLE ####
-def general_dbfs_save_function_dict_of_countries(
-    dictionary: dict, path: str, name_append: str) -> None:
-    """Function that saves the results of the dataframe you pass into different files following the structure: '{path}/{name_append}_{country}'.
-    
-    :param dictionary: Dictionary that contains the countries used to generate the samples as keys and the DataFrames of the samples as values.
-    :type dictionary: dict
-    :param path: String of the base path on which you want to save the content. This will be the base on which you build the saving path.
-    :type path: str
-    :param name_append: The extension you want to paste after you base path. This will be the name of your file in the folder of the base path, without the extension!!
-    :type name_append: str
-    """
-    for country in dictionary.keys():
-        df = dictionary[country]
-        file_path = f'apps/searchHotspots/search-logs/{name_append}_{country}'
-
-        # df.write\
-        #     .mode("overwrite")\
-        #     .parquet((file_path + '_parquet'))
-
-        # df.write\
-        #     .mode("overwrite")\
-        #     .option("escape", "\"")\
-        #     .option("header",True)\
-        #     .option("delimiter",";")\
-        #     .csv((file_path))
-        
-        # csv_files = glob.glob(os.path.join(file_path , "*.csv"))
-        # query_counts_df = pd.concat((pd.read_csv(f, sep=';') for f in csv_files), ignore_index=True)
-        df.to_csv(f'{file_path}.csv', index=False)
-        # shutil.rmtree(file_path, ignore_errors=False, onerror=None)
-        
-        print(f'{country.upper()} is done in {file_path}!!')
\ No newline at end of file
+            ago=ago, exclude_endpoint_list=exclude_endpoint_list, check_query=check_query,
+            cell_summary=cell_summary
+        ))
+
+    if pushdown_grids is not None and accumulators is None:
+        raise ValueError("The per-cell responses of pushdown_grids need accumulators")
+    if accumulators is not None:
+        return accumulate_country_logs(queries, engine or get_fetch_engine(), accumulators, cache=cache)
+    return collect_country_logs(queries, engine or get_fetch_engine(), cache=cache)
@@ -0,0 +1,108 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+CELL_RESPONSE_COLUMNS = ['countryCode', 'grid', 'grid_row', 'grid_col', 'search_query_counts']
+
+
+def grid_rows(grids_by_country: dict) -> list:
+    """Gets the parameters of the cell math of every grid of every country.
+
+    :param grids_by_country: Dictionary with the ISO-2 codes of the countries as keys and the lists of their grids as values, like grid_spec.GridSpec or morton.MortonGrid.
+    :type grids_by_country: dict
+    :return: List of (countryCode, grid, lat_origin, lon_origin, cell_size, rows, cols, truncate) tuples.
+    :rtype: list
+    """
+    return [
+        (
+            country, grid.name, float(grid.lat_origin), float(grid.lon_origin), float(grid.cell_size),
+            int(grid.rows), int(grid.cols), grid.rounding == 'trunc'
+        )
+        for country, grids in grids_by_country.items()
+        for grid in grids
+    ]
+
+
+def kql_literal(value) -> str:
+    # KQL literal of a datatable value, with the floats written so they read back exactly
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, str):
+        return repr(value)
+    if isinstance(value, float):
+        return f'real({value!r})'
+    return f'long({value})'
+
+
+def kql_cell_index(offset: str) -> str:
+    # Cell index of an offset in cells, floored or truncated towards zero like the grid does
+    return f'tolong(iff(truncate and {offset} < 0, -floor(-{offset}, 1), floor({offset}, 1)))'
+
+
+def cell_summary_kql(grids_by_country: dict) -> str:
+    """Generates the KQL that turns the sampled (countryCode, location, search_query_counts) rows into the summed
+    search counts of every cell of every grid. ADX then only ships back one row per (countryCode, grid, cell).
+    The cell math is the same as the one of the grids, see evaluate_cell_summary.
+
+    :param grids_by_country: Dictionary with the ISO-2 codes of the countries as keys and the lists of their grids as values.
+    :type grids_by_country: dict
+    :return: KQL to append to the query.
+    :rtype: str
+    """
+    values = ', '.join(
+        ', '.join(kql_literal(value) for value in row) for row in grid_rows(grids_by_country)
+    )
+    return f'''
+                        | extend lat = todouble(parse_json(location).lat), lon = todouble(parse_json(location).lon)
+                        | where isfinite(lat) and isfinite(lon)
+                        | join kind=inner (
+                            datatable(countryCode:string, grid:string, lat_origin:real, lon_origin:real, cell_size:real, rows:long, cols:long, truncate:bool)
+                            [{values}]
+                        ) on countryCode
+                        | extend row_offset = (lat - lat_origin) / cell_size, col_offset = (lon - lon_origin) / cell_size
+                        | extend grid_row = {kql_cell_index('row_offset')}, grid_col = {kql_cell_index('col_offset')}
+                        | where grid_row >= 0 and grid_row < rows and grid_col >= 0 and grid_col < cols
+                        | summarize search_query_counts = sum(search_query_counts) by countryCode, grid, grid_row, grid_col
+                    '''
+
+
+def evaluate_cell_summary(df: pd.DataFrame, grids_by_country: dict) -> pd.DataFrame:
+    """Local stand-in of cell_summary_kql: evaluates the same cell math on the rows ADX would summarize, so the
+    pushdown can be checked without a cluster. Only the tests use it, the pipeline always runs the KQL.
+
+    :param df: DataFrame with the countryCode, location and search_query_counts columns.
+    :type df: pd.DataFrame
+    :param grids_by_country: Dictionary with the ISO-2 codes of the countries as keys and the lists of their grids as values.
+    :type grids_by_country: dict
+    :return: DataFrame with the countryCode, grid, grid_row, grid_col and search_query_counts columns.
+    :rtype: pd.DataFrame
+    """
+    locations = [json.loads(location) if isinstance(location, str) else {} for location in df['location']]
+    lats = pd.to_numeric(pd.Series([location.get('lat') for location in locations]), errors='coerce').values
+    lons = pd.to_numeric(pd.Series([location.get('lon') for location in locations]), errors='coerce').values
+    valid = np.isfinite(lats) & np.isfinite(lons)
+    countries = df['countryCode'].values[valid]
+    lats, lons = lats[valid], lons[valid]
+    counts = df['search_query_counts'].values[valid]
+
+    frames = []
+    for country, grid, lat_origin, lon_origin, cell_size, rows, cols, truncate in grid_rows(grids_by_country):
+        in_country = countries == country
+        rounding = np.trunc if truncate else np.floor
+        grid_row = rounding((lats[in_country] - lat_origin) / cell_size).astype(np.int64)
+        grid_col = rounding((lons[in_country] - lon_origin) / cell_size).astype(np.int64)
+        inside = (grid_row >= 0) & (grid_row < rows) & (grid_col >= 0) & (grid_col < cols)
+        frames.append(pd.DataFrame({
+            'countryCode': country,
+            'grid': grid,
+            'grid_row': grid_row[inside],
+            'grid_col': grid_col[inside],
+            'search_query_counts': counts[in_country][inside],
+        }, columns=CELL_RESPONSE_COLUMNS))
+
+    if not frames:
+        return pd.DataFrame(columns=CELL_RESPONSE_COLUMNS)
+    return pd.concat(frames).groupby(
+        ['countryCode', 'grid', 'grid_row', 'grid_col'], as_index=False, sort=False
+    )['search_query_counts'].sum()
@@ -0,0 +1,67 @@
+import urllib.parse
+
+import numpy as np
+import pandas as pd
+
+
+def parse_searched_query(x):
+    """ Mapping function that receives the query string and translates all coded charactes like %20 -> space
+
+    :param x: Query value for each row containing encoded query string
+    :param x: str
+    :return: Returns the decoded query string.
+    :rtype: str
+    """
+    if not x:
+        x = ''
+    else:
+        x = urllib.parse.unquote(x)
+        x = x[:min([idx if y == '.' else len(x) for idx, y in enumerate(x) ])]
+
+    return x
+
+
+def decode_searched_queries(queries: pd.Series) -> pd.Series:
+    """Batch version of parse_searched_query, with the same output for every string: URL-decodes the
+    queries and truncates them at the first '.'. Each distinct query is only decoded once, and only the
+    ones with a '%' go through urllib. Missing values are decoded as an empty string.
+
+    :param queries: Series of encoded query strings.
+    :type queries: pd.Series
+    :return: Series of decoded query strings, with the same index.
+    :rtype: pd.Series
+    """
+    codes, uniques = pd.factorize(queries)
+    if len(uniques) == 0:
+        return pd.Series('', index=queries.index, dtype=object, name=queries.name)
+    uniques = pd.Series(np.asarray(uniques, dtype=object)).map(str)
+
+    decoded = uniques.values.astype(object)
+    encoded = uniques.str.contains('%', regex=False).values
+    decoded[encoded] = [urllib.parse.unquote(query) for query in decoded[encoded]]
+    decoded = pd.Series(decoded, dtype=object).str.partition('.')[0].values.astype(object)
+
+    # factorize gives the missing values the code -1
+    result = pd.Series(decoded.take(codes), index=queries.index, dtype=object, name=queries.name)
+    result[codes == -1] = ''
+    return result
+
+
+def decode_searched_queries_spark(column_name: str):
+    """Spark native expression version of decode_searched_queries, without a Python UDF.
+    java.net.URLDecoder also decodes '+' as a space and fails on malformed escapes, so both are
+    escaped first to keep them as urllib.parse.unquote does.
+
+    :param column_name: Name of the Spark column of encoded query strings.
+    :type column_name: str
+    :return: Spark column of decoded query strings.
+    :rtype: pyspark.sql.Column
+    """
+    from pyspark.sql import functions as F
+
+    column = f"`{column_name}`"
+    escaped = f"regexp_replace(regexp_replace({column}, '%(?![0-9a-fA-F]{{2}})', '%25'), '[+]', '%2B')"
+    return F.expr(
+        f"CASE WHEN {column} IS NULL OR {column} = '' THEN '' "
+        f"ELSE substring_index(reflect('java.net.URLDecoder', 'decode', {escaped}, 'UTF-8'), '.', 1) END"
+    )
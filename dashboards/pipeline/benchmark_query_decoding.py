@@ -0,0 +1,86 @@
+"""Benchmark of the searched_query decoders on generated search queries.
+
+Run it from the dashboards folder, like the pipeline:
+
+    python pipeline/benchmark_query_decoding.py [--rows 1000000] [--spark]
+"""
+import argparse
+import time
+import urllib.parse
+
+import numpy as np
+import pandas as pd
+
+from auxiliary_functions.query_decoding import (
+    decode_searched_queries,
+    decode_searched_queries_spark,
+    parse_searched_query,
+)
+
+STREETS = ["Main Street", "Calle Mayor", "Rue de la Paix", "Königstraße", "Via Roma",
+           "Østergade", "Jalan Sudirman", "Ulica Długa", "São João", "Mannheim Rd"]
+CITIES = ["Madrid", "Paris", "München", "Roma", "København", "Jakarta", "Gdańsk",
+          "São Paulo", "Chicago", "Zürich"]
+SUFFIXES = [".json", ".xml", "", ""]
+
+
+def generate_queries(rows, distinct, seed=0):
+    """Generates URL-encoded search queries like the ones in the logs, with house numbers,
+    non ASCII street and city names, format suffixes and a skewed repetition of the queries.
+
+    :rtype: pd.Series
+    """
+    rng = np.random.default_rng(seed)
+    queries = [
+        urllib.parse.quote(
+            f"{rng.integers(1, 3000)} {STREETS[rng.integers(len(STREETS))]}, "
+            f"{CITIES[rng.integers(len(CITIES))]}"
+        ) + SUFFIXES[rng.integers(len(SUFFIXES))]
+        for _ in range(distinct)
+    ]
+    # Popular queries are repeated much more often than the rest
+    picks = np.minimum(rng.zipf(1.3, rows) - 1, distinct - 1)
+    series = pd.Series(np.array(queries, dtype=object)[picks])
+    series[rng.random(rows) < 0.01] = None
+    return series
+
+
+def timed(label, function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    print(f"{label:<28}{time.perf_counter() - start:>10.3f} s")
+    return result
+
+
+def benchmark_spark(queries, expected):
+    from grid_backends import spark_session
+
+    spark = spark_session()
+    df = spark.createDataFrame(pd.DataFrame({"searched_query": queries})).cache()
+    df.count()
+    decoded = timed(
+        "spark native expressions",
+        lambda: df.select(decode_searched_queries_spark("searched_query").alias("q")).toPandas(),
+    )
+    print(f"spark output matches: {decoded['q'].tolist() == expected.tolist()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--distinct", type=int, default=200_000)
+    parser.add_argument("--spark", action="store_true", help="Also benchmark the Spark version")
+    args = parser.parse_args()
+
+    queries = generate_queries(args.rows, args.distinct)
+    print(f"{args.rows} queries, {queries.nunique()} distinct")
+
+    mapped = timed(
+        "parse_searched_query map",
+        lambda: queries.map(lambda x: parse_searched_query(x) if isinstance(x, str) else ""),
+    )
+    decoded = timed("decode_searched_queries", decode_searched_queries, queries)
+    print(f"vectorized output matches: {decoded.tolist() == mapped.tolist()}")
+
+    if args.spark:
+        benchmark_spark(queries, mapped)
@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+
+# Coloring of the cells, kept apart from grid_utils so the tile server does not import
+# the geometry dependencies of the pipeline
+
+
+def coloring(df):
+
+    # compute the log of the values
+    df['log_value'] = np.log10(df['value'] + 1)
+
+    # set the number of bins
+    num_bins = 6
+
+    # compute the bin edges using log-scale binning
+    bin_edges = np.logspace(df['log_value'].min(), df['log_value'].max(), num=num_bins+1)
+    bin_edges = np.concatenate((bin_edges[:1], bin_edges[3:]), axis=0)
+    # bin the data using the computed bin edges
+    df['bin'] = pd.cut(df['value'], bins=bin_edges, labels=False)
+
+    # Define the bin edges
+    bins = np.arange(5)
+    # Define the bin labels
+    labels = [ 'green', 'yellow', 'orange', 'red']
+
+    # Assign labels to each bin
+    df['color'] = pd.cut(df['bin'], bins=bins, labels=labels, include_lowest=True, right=False)
+
+    df.drop(['bin','log_value'], inplace=True, axis=1)
+    
+    return df
@@ -0,0 +1,109 @@
+import collections
+import os
+import threading
+import time
+
+import pandas as pd
+
+import hotspot_store
+
+# Memory ceiling in MB, number of entries and time to live in seconds of the data loaded
+# from the db by the dashboards, see cells
+CELLS_CACHE_MB = int(os.environ.get("HOTSPOTS_CELLS_CACHE_MB", 1024))
+CELLS_CACHE_ENTRIES = int(os.environ.get("HOTSPOTS_CELLS_CACHE_ENTRIES", 64))
+CELLS_CACHE_TTL = float(os.environ.get("HOTSPOTS_CELLS_CACHE_TTL", 6 * 3600))
+
+
+def size_of(value):
+    # Approximate memory size in bytes of a cached value
+    if isinstance(value, tuple):
+        return sum(size_of(item) for item in value)
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, bytes):
+        return len(value)
+    return getattr(value, "nbytes", 0)
+
+
+class CellsCache:
+    """In-memory LRU cache of data loaded from the db files, shared by every session
+    of the process. Entries are keyed by the path, the loader and its extra arguments,
+    and only valid for the data version the file had when they were loaded, so a file
+    rewritten by the pipeline is loaded again. They are evicted least recently used
+    first above max_entries or max_bytes, or when older than ttl. The same value is
+    returned to every caller, so it must not be mutated.
+
+    :param max_bytes: Memory ceiling of the cached values, in bytes.
+    :type max_bytes: int
+    :param max_entries: Maximum number of cached values.
+    :type max_entries: int
+    :param ttl: Seconds a value is kept after being loaded, None keeps it until evicted.
+    :type ttl: float or None
+    """
+
+    def __init__(self, max_bytes=1024 ** 3, max_entries=32, ttl=None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, path, loader, *args):
+        """Gets the value loaded from a file, loading it with loader(path, *args) on a
+        miss or when the file changed since it was loaded.
+
+        :param path: Path of the db file the value is loaded from, see hotspot_store.total_path.
+        :type path: str
+        :param loader: Module level function that loads the value from the path.
+        :type loader: callable
+        :param args: Extra hashable arguments of the loader, part of the key.
+        """
+        key = (path, loader, args)
+        version = hotspot_store.data_version(path)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version and not self.expired(entry):
+                self.entries.move_to_end(key)
+                return entry[1]
+
+        # Loaded outside the lock, so a slow load does not block the other sessions
+        value = loader(path, *args)
+        size = size_of(value)
+        with self.lock:
+            self.pop(key)
+            if size <= self.max_bytes:
+                self.entries[key] = (version, value, size, time.monotonic())
+                self.nbytes += size
+            self.evict()
+        return value
+
+    def expired(self, entry):
+        return self.ttl is not None and time.monotonic() - entry[3] > self.ttl
+
+    def pop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[2]
+
+    def evict(self):
+        for key in [key for key, entry in self.entries.items() if self.expired(entry)]:
+            self.pop(key)
+        while self.entries and (
+            len(self.entries) > self.max_entries or self.nbytes > self.max_bytes
+        ):
+            self.pop(next(iter(self.entries)))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+
+# Cache shared by everything the dashboards load from the totals in this process: the
+# grids, the cell indexes and the rolled up levels
+cells = CellsCache(
+    max_bytes=CELLS_CACHE_MB * 1024 ** 2,
+    max_entries=CELLS_CACHE_ENTRIES,
+    ttl=CELLS_CACHE_TTL,
+)
@@ -0,0 +1,201 @@
+import functools
+import os
+
+import numpy as np
+import pyarrow.parquet as pq
+
+import grid_utils
+import hotspot_store
+import stage_handoff
+
+GRID_SUMS_DIR = "apps/searchHotspots/grid-sums"
+
+# Only columns of the samples the gridding reads, with their compact types
+SAMPLE_COLUMNS = ["location", "search_query_counts"]
+SAMPLE_DTYPES = {"search_query_counts": np.uint32}
+
+
+@functools.lru_cache(maxsize=None)
+def spark_session(master="local[8]", driver_memory="8G"):
+    # The JVM is only started the first time a Spark backend needs it
+    from pyspark.sql import SparkSession
+
+    return (
+        SparkSession.builder.master(master)
+        .config("spark.driver.memory", driver_memory)
+        .config("spark.sql.execution.arrow.pyspark.enabled", "true")
+        .config("spark.sql.sources.partitionOverwriteMode", "dynamic")
+        .appName("SearchLogs")
+        .getOrCreate()
+    )
+
+
+class PandasBackend:
+    """Grids the samples in the driver process with NumPy. With a chunk size, the
+    samples are read and binned in chunks of that many rows whose per-cell partial
+    sums are merged, so the peak memory does not depend on the sample size.
+    """
+
+    name = "pandas"
+    # Samples only need to be handed over in memory
+    spill = None
+
+    def __init__(self, chunk_size=None):
+        self.chunk_size = chunk_size
+
+    def grid_sums(self, sample_name, grids, country, month):
+        """Sums the search counts of a sample per cell of every grid.
+
+        :param sample_name: Name the sample was handed over with, see stage_handoff.
+        :type sample_name: str
+        :param grids: Grids to bin the sample on.
+        :type grids: list
+        :param country: ISO-2 code of the country of the sample.
+        :type country: str
+        :param month: Month of the sample.
+        :type month: datetime.datetime
+        :return: Dictionary with the grids as keys and their per-cell sums as values.
+        :rtype: dict
+        """
+        if self.chunk_size:
+            return self.chunked_grid_sums(sample_name, grids)
+
+        coordinates_df = stage_handoff.get(sample_name).to_pandas()
+        coordinates_df.dropna(subset=["location"], inplace=True)
+
+        # Parse the locations once, every grid is binned from the same arrays
+        accumulator = grid_utils.GridAccumulator(grids)
+        accumulator.add_coordinates(*grid_utils.get_coordinates(coordinates_df))
+        return {grid: accumulator.grid_sums(grid) for grid in grids}
+
+    def chunked_grid_sums(self, sample_name, grids):
+        accumulator = grid_utils.GridAccumulator(grids)
+        for batch in stage_handoff.iter_batches(
+            sample_name, SAMPLE_COLUMNS, chunk_size=self.chunk_size
+        ):
+            chunk = batch.to_pandas().astype(SAMPLE_DTYPES)
+            accumulator.add(chunk)
+        return {grid: accumulator.grid_sums(grid) for grid in grids}
+
+
+class SparkBackend:
+    """Grids the samples with Spark native column expressions, reading them from their
+    Parquet spill and writing the per-cell sums partitioned by country, month and grid,
+    so a sample never has to fit in the driver memory. The fetched sample is released
+    once it is spilled. The session is local to the process, so the countries are
+    gridded one at a time and the pipeline runs with a single worker.
+    """
+
+    name = "spark"
+    # Spark reads the samples from their Parquet spill
+    spill = "parquet"
+
+    def __init__(self, output_dir=GRID_SUMS_DIR):
+        self.output_dir = output_dir
+
+    @staticmethod
+    def cell_index(offset, rounding):
+        # Spark expression of the cell index of an offset, like grid.cell_index
+        from pyspark.sql import functions as F
+
+        if rounding == "trunc":
+            return F.when(offset < 0, F.ceil(offset)).otherwise(F.floor(offset))
+        return F.floor(offset)
+
+    def cells(self, points, grid):
+        from pyspark.sql import functions as F
+
+        row = self.cell_index(
+            (F.col("lat") - F.lit(grid.lat_origin)) / F.lit(grid.cell_size), grid.rounding
+        )
+        col = self.cell_index(
+            (F.col("lon") - F.lit(grid.lon_origin)) / F.lit(grid.cell_size), grid.rounding
+        )
+        return (
+            points.select(
+                F.lit(grid.name).alias("grid"),
+                row.alias("grid_row"),
+                col.alias("grid_col"),
+                "search_query_counts",
+            )
+            .where(
+                (F.col("grid_row") >= 0)
+                & (F.col("grid_row") < grid.rows)
+                & (F.col("grid_col") >= 0)
+                & (F.col("grid_col") < grid.cols)
+            )
+        )
+
+    def partition_path(self, country, month, grid):
+        return (
+            f"{self.output_dir}/country={country}/"
+            f"month={hotspot_store.month_key(month)}/grid={grid.name}"
+        )
+
+    def grid_sums(self, sample_name, grids, country, month):
+        """Same as PandasBackend.grid_sums, with the sample read from its Parquet spill.
+        Like on the pandas backend, only the finest Morton level is binned by Spark and
+        the coarser ones are rolled up from its sums.
+        """
+        from pyspark.sql import functions as F
+
+        spark = spark_session()
+        lat = F.get_json_object("location", "$.lat").cast("double")
+        lon = F.get_json_object("location", "$.lon").cast("double")
+        points = (
+            spark.read.parquet(stage_handoff.spill_path(sample_name, "parquet"))
+            .where(F.col("location").isNotNull())
+            .select(
+                lat.alias("lat"),
+                lon.alias("lon"),
+                F.col("search_query_counts").cast("long").alias("search_query_counts"),
+            )
+            .where(
+                F.col("lat").isNotNull()
+                & F.col("lon").isNotNull()
+                & ~F.isnan("lat")
+                & ~F.isnan("lon")
+            )
+        )
+
+        accumulator = grid_utils.GridAccumulator(grids)
+        cells = functools.reduce(
+            lambda left, right: left.unionByName(right),
+            [self.cells(points, grid) for grid in accumulator.binned_grids],
+        )
+        (
+            cells.groupBy("grid", "grid_row", "grid_col")
+            .agg(F.sum("search_query_counts").alias("search_query_counts"))
+            .withColumn("country", F.lit(country))
+            .withColumn("month", F.lit(hotspot_store.month_key(month)))
+            .write.mode("overwrite")
+            .partitionBy("country", "month", "grid")
+            .parquet(self.output_dir)
+        )
+
+        for grid in accumulator.binned_grids:
+            path = self.partition_path(country, month, grid)
+            if not os.path.exists(path):
+                continue
+            table = pq.read_table(path, columns=["grid_row", "grid_col", "search_query_counts"])
+            accumulator.merge(
+                grid,
+                table.column("grid_row").to_numpy().astype(np.int64),
+                table.column("grid_col").to_numpy().astype(np.int64),
+                table.column("search_query_counts").to_numpy(),
+            )
+        return {grid: accumulator.grid_sums(grid) for grid in grids}
+
+
+BACKENDS = {"pandas": PandasBackend, "spark": SparkBackend}
+
+
+def get_backend(name, **options):
+    """Gets the grid backend by name, "pandas" or "spark".
+
+    :param options: Keyword arguments of the backend, like the chunk_size of the pandas backend.
+    :rtype: PandasBackend or SparkBackend
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown grid backend: {name}")
+    return BACKENDS[name](**options)
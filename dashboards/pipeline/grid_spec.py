@@ -0,0 +1,101 @@
+import numpy as np
+
+
+class GridSpec:
+    """Implicit regular lat/lon grid. Only the origin, the cell size and the
+    number of rows and columns are stored, cell bounds are computed on demand.
+    """
+
+    __slots__ = ("lat_origin", "lon_origin", "cell_size", "rows", "cols")
+
+    # cell_index truncates the cell offsets towards zero
+    rounding = "trunc"
+
+    def __init__(self, lat_origin, lon_origin, cell_size, rows, cols):
+        self.lat_origin = float(lat_origin)
+        self.lon_origin = float(lon_origin)
+        self.cell_size = float(cell_size)
+        self.rows = int(rows)
+        self.cols = int(cols)
+
+    def __repr__(self):
+        return (
+            f"GridSpec(lat_origin={self.lat_origin}, lon_origin={self.lon_origin}, "
+            f"cell_size={self.cell_size}, rows={self.rows}, cols={self.cols})"
+        )
+
+    def __eq__(self, other):
+        if not isinstance(other, GridSpec):
+            return NotImplemented
+        return all(getattr(self, attr) == getattr(other, attr) for attr in self.__slots__)
+
+    def __hash__(self):
+        return hash(tuple(getattr(self, attr) for attr in self.__slots__))
+
+    @property
+    def name(self):
+        return f"{self.cell_size}"
+
+    @property
+    def shape(self):
+        return self.rows, self.cols
+
+    def lat_edges(self):
+        return np.round(self.lat_origin + np.arange(self.rows + 1) * self.cell_size, 5)
+
+    def lon_edges(self):
+        return np.round(self.lon_origin + np.arange(self.cols + 1) * self.cell_size, 5)
+
+    def contains(self, rows, cols):
+        # Whether the (row, col) indices fall inside the grid
+        rows, cols = np.asarray(rows), np.asarray(cols)
+        return (rows >= 0) & (rows < self.rows) & (cols >= 0) & (cols < self.cols)
+
+    def cell_index(self, lats, lons):
+        # (row, col) of the cell holding each coordinate, truncated like int()
+        rows = np.trunc((np.asarray(lats) - self.lat_origin) / self.cell_size)
+        cols = np.trunc((np.asarray(lons) - self.lon_origin) / self.cell_size)
+        return rows.astype(np.int64), cols.astype(np.int64)
+
+    def cell_bbox(self, rows, cols):
+        # (lat_min, lat_max, lon_min, lon_max) of the cells, vectorized over arrays
+        rows, cols = np.asarray(rows), np.asarray(cols)
+        lat_min = np.round(self.lat_origin + rows * self.cell_size, 5)
+        lat_max = np.round(self.lat_origin + (rows + 1) * self.cell_size, 5)
+        lon_min = np.round(self.lon_origin + cols * self.cell_size, 5)
+        lon_max = np.round(self.lon_origin + (cols + 1) * self.cell_size, 5)
+        if rows.ndim == 0 and cols.ndim == 0:
+            return float(lat_min), float(lat_max), float(lon_min), float(lon_max)
+        return lat_min, lat_max, lon_min, lon_max
+
+    def cell_ids(self, rows, cols):
+        # Flat integer id of each (row, col) cell, row-major
+        rows, cols = np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)
+        return (rows * self.cols + cols).astype(np.uint64)
+
+    def cell_rowcol(self, cell_ids):
+        # (row, col) of each flat cell id
+        cell_ids = np.asarray(cell_ids, dtype=np.int64)
+        return cell_ids // self.cols, cell_ids % self.cols
+
+    def cell_bounds(self, cell_ids):
+        # (lat_min, lat_max, lon_min, lon_max) of each flat cell id
+        return self.cell_bbox(*self.cell_rowcol(cell_ids))
+
+    def coarsen(self, factor):
+        # Grid of cells factor times larger with the same origin, the cell (row, col)
+        # is in its cell (row // factor, col // factor)
+        return GridSpec(
+            self.lat_origin,
+            self.lon_origin,
+            self.cell_size * factor,
+            -(-self.rows // factor),
+            -(-self.cols // factor),
+        )
+
+    def to_dict(self):
+        return {"kind": "degree", **{attr: getattr(self, attr) for attr in self.__slots__}}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(*(data[attr] for attr in cls.__slots__))
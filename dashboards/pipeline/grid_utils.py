@@ -6,9 +6,26 @@ from tqdm import tqdm
 import pycountry
 import calendar
 import ast
+import functools
+import shapely
 from shapely.geometry import shape, box
+from shapely.prepared import prep
 import numpy as np
 import time
+import hotspot_exports
+import hotspot_store
+import morton
+from cell_colors import coloring
+from grid_spec import GridSpec
+
+LAT_PATTERN = r'"lat"\s*:\s*([-+0-9.eE]+)'
+LON_PATTERN = r'"lon"\s*:\s*([-+0-9.eE]+)'
+
+CELL_COLUMNS = ["cell_id", "color", "value"]
+
+# Folders with the region polygons each country is also split into
+REGION_DIRS = {"USA": "apps/searchHotspots/data/US_regions"}
+
 #### FUNCTIONS
 
 
@@ -17,47 +34,8 @@ def create_grid(lat_range, lon_range, cell_size):
     rows = int((lat_range[1] - lat_range[0]) / cell_size)
     cols = int((lon_range[1] - lon_range[0]) / cell_size)
 
-    # Calculate the rounded coordinates for each row and column
-    lats = np.arange(lat_range[0], lat_range[1], cell_size)
-    lats = np.round(lats, 5)
-    lons = np.arange(lon_range[0], lon_range[1], cell_size)
-    lons = np.round(lons, 5)
-
-    # Create the grid with boundary coordinates for each cell
-    grid = [[(lats[y], lats[y+1], lons[x], lons[x+1]) for x in range(cols)] for y in range(rows)]
-
-    return grid
-
-
-def color_grid(grid, occurrences, color_map):
-    # Initialize a dictionary to store the color for each cell
-    cell_colors = {}
-
-    # Iterate over the cells in the grid
-    for i, row in enumerate(grid):
-        for j, cell in enumerate(row):
-            # Count the number of occurrences in the cell
-            count = 0
-            for lat, lon in occurrences:
-                if (cell[0] <= lat <= cell[1]) and (cell[2] <= lon <= cell[3]):
-                    count += 1
-
-            # Choose the color for the cell based on the number of occurrences
-            if count == 0:
-                color = "white"
-            elif count <= 1:
-                color = color_map[0]
-            elif count <= 2:
-                color = color_map[1]
-            elif count <= 3:
-                color = color_map[2]
-            else:
-                color = color_map[3]
-
-            # Store the color for the cell
-            cell_colors[(i, j)] = color
-
-    return cell_colors
+    # The cells boundary coordinates are computed lazily by the grid spec
+    return GridSpec(lat_range[0], lon_range[0], cell_size, rows, cols)
 
 
 def getBoundingBox(country, countries_geos):
@@ -77,71 +55,160 @@ def getBoundingBox(country, countries_geos):
     return lat_range, lon_range
 
 
-def get_grid_sums(coordinates_df, lat_range, lon_range, grid_size):
-    coordinates_df["coordinates"] = (
-        coordinates_df["location"]
-        .apply(lambda x: (json.loads(x)["lat"], json.loads(x)["lon"]))
-        .tolist()
-    )
-    # Create a new column that contain grid cell index
-    coordinates_df["grid_index"] = coordinates_df.apply(
-        lambda row: (
-            int((row["coordinates"][0] - lat_range[0]) / grid_size),
-            int((row["coordinates"][1] - lon_range[0]) / grid_size),
-        ),
-        axis=1,
-    )
+def get_coordinates(coordinates_df):
+    # Parse the "location" json strings once into float lat/lon arrays
+    locations = coordinates_df["location"].astype(str)
+    lats = locations.str.extract(LAT_PATTERN, expand=False).astype(np.float64).values
+    lons = locations.str.extract(LON_PATTERN, expand=False).astype(np.float64).values
+    counts = coordinates_df["search_query_counts"].values
 
-    # Group by grid cell index and sum counts
-    grid_sums = coordinates_df.groupby(["grid_index"])["search_query_counts"].sum()
+    # Drop the locations that could not be parsed
+    valid = np.isfinite(lats) & np.isfinite(lons)
+    return lats[valid], lons[valid], counts[valid]
+
+
+def cell_sums_series(rows, cols, sums):
+    # Per-cell sums indexed by (grid_row, grid_col), as returned by every binning path
+    index = pd.MultiIndex.from_arrays(
+        [np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)],
+        names=["grid_row", "grid_col"],
+    )
+    return pd.Series(sums, index=index, name="search_query_counts")
+
+
+def bin_grid_sums(lats, lons, counts, lat_range, lon_range, grid_size):
+    # Integer (row, col) cell index of every coordinate, truncated like int()
+    rows = np.trunc((lats - lat_range[0]) / grid_size).astype(np.int64)
+    cols = np.trunc((lons - lon_range[0]) / grid_size).astype(np.int64)
+
+    if len(rows) == 0:
+        return cell_sums_series([], [], np.array([], dtype=np.int64))
+
+    # Flatten (row, col) into a single cell id and sum the counts per cell id
+    row_min, col_min = rows.min(), cols.min()
+    n_cols = cols.max() - col_min + 1
+    cell_ids = (rows - row_min) * n_cols + (cols - col_min)
+    unique_ids, inverse = np.unique(cell_ids, return_inverse=True)
+    sums = np.bincount(inverse, weights=counts, minlength=len(unique_ids))
+    if np.issubdtype(np.asarray(counts).dtype, np.integer):
+        sums = np.round(sums).astype(np.int64)
+
+    return cell_sums_series(unique_ids // n_cols + row_min, unique_ids % n_cols + col_min, sums)
+
+
+class GridAccumulator:
+    """Per-cell sums of the search counts on several grids, folded one response at a time,
+    so the raw sample never has to be held in memory. Summing the counts per cell is the
+    same whether the locations are deduplicated first or not. Of the Morton levels, only
+    the finest is binned, the coarser ones are rolled up from it when their sums are read.
+    """
+
+    def __init__(self, grids):
+        self.grids = list(grids)
+        self.binned_grids, self.rolled_up = morton.split_pyramid(self.grids)
+        self.cells = {
+            grid: (np.array([], dtype=np.uint64), np.array([], dtype=np.uint64))
+            for grid in self.binned_grids
+        }
+
+    def add(self, coordinates_df):
+        # Fold a DataFrame with location and search_query_counts columns, or the
+        # grid, grid_row, grid_col and search_query_counts rows of a pushdown query
+        if "grid_row" in coordinates_df.columns:
+            self.add_cells(coordinates_df)
+            return
+        coordinates_df = coordinates_df.dropna(subset=["location"])
+        self.add_coordinates(*get_coordinates(coordinates_df))
+
+    def add_coordinates(self, lats, lons, counts):
+        counts = np.asarray(counts)
+        for grid in self.binned_grids:
+            rows, cols = grid.cell_index(lats, lons)
+            self.merge(grid, rows, cols, counts)
+
+    def add_cells(self, cells_df):
+        # Cells already summed server-side, matched to the binned grids by name
+        for grid in self.binned_grids:
+            grid_cells = cells_df[cells_df["grid"].astype(str) == grid.name]
+            self.merge(
+                grid,
+                grid_cells["grid_row"].values.astype(np.int64),
+                grid_cells["grid_col"].values.astype(np.int64),
+                grid_cells["search_query_counts"].values,
+            )
+
+    def merge(self, grid, rows, cols, counts):
+        inside = grid.contains(rows, cols)
+        if not inside.any():
+            return
+        delta_ids, delta_values = morton.sum_by_key(
+            grid.cell_ids(rows[inside], cols[inside]), counts[inside]
+        )
+        cell_ids, values = self.cells[grid]
+        self.cells[grid] = hotspot_store.merge_values(
+            cell_ids, values, delta_ids, delta_values
+        )
 
-    return grid_sums
+    def grid_sums(self, grid):
+        # Per-cell sums indexed by (row, col), like bin_grid_sums
+        if grid in self.rolled_up:
+            finest = self.rolled_up[grid]
+            cell_ids, values = morton.roll_up(
+                *self.cells[finest], finest.level, grid.level
+            )
+        else:
+            cell_ids, values = self.cells[grid]
+        rows, cols = grid.cell_rowcol(cell_ids)
+        return cell_sums_series(rows, cols, values.astype(np.int64))
 
 
 def color_grid_sums(grid, occurrences, color_map):
-    # Initialize a dictionary to store the color for each cell
-    cell_colors = []
-
-    for index, value in occurrences.items():
-        if 0 <= index[0] < len(grid) and 0 <= index[1] < len(grid[0]):
-            # Choose the color for the cell based on the number of occurrences
-            if value == 0:
-                color = "white"
-            elif value <= 50:
-                color = color_map[0]
-            elif value <= 500:
-                color = color_map[1]
-            elif value <= 5000:
-                color = color_map[2]
-            else:
-                color = color_map[3]
-
-            # Store the color for the cell
-            cell_colors.append([color, value, grid[index[0]][index[1]]])
-
-    return cell_colors
-
-
-def save_data(cell_colors_sums, country, center, month, grid_size):
-    # create directory for country if it does not exist
-    if not os.path.exists(
-        f"apps/searchHotspots/db/{country}/{month.year}_{month.month}"
-    ):
-        os.makedirs(f"apps/searchHotspots/db/{country}/{month.year}_{month.month}")
-
-    # save monthly df to db
-    cell_colors_sums_df = pd.DataFrame(
-        cell_colors_sums, columns=["color", "value", "grid_bbox"]
+    if not isinstance(occurrences.index, pd.MultiIndex):
+        occurrences = pd.Series(
+            occurrences.values, index=pd.MultiIndex.from_tuples(occurrences.index)
+        )
+    rows = occurrences.index.get_level_values(0).values
+    cols = occurrences.index.get_level_values(1).values
+    values = occurrences.values
+
+    # Only keep the cells inside the grid
+    inside = grid.contains(rows, cols)
+    rows, cols, values = rows[inside], cols[inside], values[inside]
+
+    # Choose the color for the cell based on the number of occurrences
+    colors = np.select(
+        [values == 0, values <= 50, values <= 500, values <= 5000],
+        ["white", color_map[0], color_map[1], color_map[2]],
+        default=color_map[3],
     )
-    cell_colors_sums_df = coloring(cell_colors_sums_df)
-    cell_colors_sums_df.to_csv(
-        f"apps/searchHotspots/db/{country}/{month.year}_{month.month}/{calendar.month_name[int(month.month)]}_{grid_size}.csv",
-        index=False,
+
+    # Store the cell id, the color and the value of each cell
+    return pd.DataFrame(
+        {"cell_id": grid.cell_ids(rows, cols), "color": colors, "value": values},
+        columns=CELL_COLUMNS,
     )
-    cell_colors_sums_df = pd.read_csv(f"apps/searchHotspots/db/{country}/{month.year}_{month.month}/{calendar.month_name[int(month.month)]}_{grid_size}.csv")
-    
-    # Aggregate monthly counts to total
-    aggregate_data(cell_colors_sums_df, country, grid_size)
+
+
+def save_data(cell_colors_sums, country, center, month, grid):
+    grid_size = grid.name
+    total_path = hotspot_store.total_path(country, grid_size)
+
+    if hotspot_store.month_key(month) in hotspot_store.read_applied_months(total_path):
+        # Keep the monthly file as the data that was folded into the total
+        print(f"{hotspot_store.month_key(month)} already aggregated in {total_path}")
+    else:
+        # save monthly df to db
+        cell_colors_sums_df = pd.DataFrame(cell_colors_sums, columns=CELL_COLUMNS)
+        cell_colors_sums_df = coloring(cell_colors_sums_df)
+        hotspot_store.write_cells(
+            hotspot_store.month_path(country, month, grid_size), cell_colors_sums_df, grid
+        )
+
+        # Aggregate monthly counts to total
+        aggregate_data(cell_colors_sums_df, country, grid, month)
+
+    # Build the download artifacts of the total once, instead of on every dashboard rerun
+    hotspot_exports.update_exports(country, grid_size)
 
     # Add country center coordinates file if it does not exist
     if not os.path.exists(f"apps/searchHotspots/db/{country}/center_coordinates.json"):
@@ -152,84 +219,125 @@ def save_data(cell_colors_sums, country, center, month, grid_size):
             json.dump(data, outfile)
 
 
-def filter_by_region(searches_df, country_ISO3, center, prev_month, grid_size):
-
-    for region in os.listdir("apps/searchHotspots/data/US_regions"):
-        start_time = time.time()
-        print(f"processing region {region}")
-        country_name = f"{country_ISO3}_{region}"
-                    
-                    
-        region = geopandas.read_file(f"apps/searchHotspots/data/US_regions/{region}")
-        region_polygon = shape(region.geometry[0]) 
-
-        filtered_rectangles = []
-        searches_aux = []
-        searches_df = pd.DataFrame(
-            searches_df, columns=["color", "value", "grid_bbox"]
-        )  
-
-        searches_df_dict = searches_df.to_dict('records')
-        for row in searches_df_dict:
-            box_bound = row['grid_bbox']
-            rectangleBox = box(box_bound[2], box_bound[0], box_bound[3], box_bound[1])
-            if rectangleBox.within(region_polygon):
-                filtered_rectangles.append(row)
-            else:
-                searches_aux.append(row)
-
-        searches_df =  pd.DataFrame(searches_aux)
-                
-    
-        print(f"saving region")
-        save_data(
-            filtered_rectangles, country_name.split(".geojson")[0], center, prev_month, grid_size
+@functools.lru_cache(maxsize=None)
+def load_regions(regions_dir):
+    # Load every region polygon of the folder once, in a stable order
+    regions = []
+    for file_name in sorted(os.listdir(regions_dir)):
+        region = geopandas.read_file(os.path.join(regions_dir, file_name))
+        region_polygon = region.geometry.unary_union
+        regions.append(
+            (file_name.split(".geojson")[0], region_polygon, prep(region_polygon))
         )
-        print(f"time: {start_time-time.time()}")
-
-
+    return tuple(regions)
 
-def coloring(df):
 
-    # compute the log of the values
-    df['log_value'] = np.log10(df['value'] + 1)
+def cells_within(region_polygon, prepared_polygon, lat_min, lat_max, lon_min, lon_max):
+    # Whether each cell bbox lies within the region polygon
+    if hasattr(shapely, "box"):
+        # Shapely 2 tests all the boxes in a single vectorized call
+        shapely.prepare(region_polygon)
+        boxes = shapely.box(lon_min, lat_min, lon_max, lat_max)
+        return shapely.contains(region_polygon, boxes)
 
-    # set the number of bins
-    num_bins = 6
-
-    # compute the bin edges using log-scale binning
-    bin_edges = np.logspace(df['log_value'].min(), df['log_value'].max(), num=num_bins+1)
-    bin_edges = np.concatenate((bin_edges[:1], bin_edges[3:]), axis=0)
-    # bin the data using the computed bin edges
-    df['bin'] = pd.cut(df['value'], bins=bin_edges, labels=False)
-
-    # Define the bin edges
-    bins = np.arange(5)
-    # Define the bin labels
-    labels = [ 'green', 'yellow', 'orange', 'red']
-
-    # Assign labels to each bin
-    df['color'] = pd.cut(df['bin'], bins=bins, labels=labels, include_lowest=True, right=False)
-
-    df.drop(['bin','log_value'], inplace=True, axis=1)
-    
-    return df
-    
-def aggregate_data(cell_colors_sums_df, country, grid_size):
-    total_searches_path = f"apps/searchHotspots/db/{country}/total_{grid_size}.csv"
-    total_searches = pd.DataFrame()
-    if os.path.exists(total_searches_path):
-        total_searches = pd.read_csv(total_searches_path)
-    
-    concat_df = pd.concat([cell_colors_sums_df, total_searches])
-
-    merged_df = concat_df.groupby(["grid_bbox"])["value"].sum().reset_index()
+    return np.fromiter(
+        (
+            prepared_polygon.contains(box(*bounds))
+            for bounds in zip(lon_min, lat_min, lon_max, lat_max)
+        ),
+        dtype=bool,
+        count=len(lat_min),
+    )
 
 
-    merged_df = coloring(merged_df)
+def assign_regions(lat_min, lat_max, lon_min, lon_max, regions):
+    # Label each cell with the first region that contains it, "" if none does
+    labels = np.full(len(lat_min), "", dtype=object)
+    unassigned = np.ones(len(lat_min), dtype=bool)
+
+    for name, region_polygon, prepared_polygon in regions:
+        # Only the cells inside the region bounds can be within the region
+        min_x, min_y, max_x, max_y = region_polygon.bounds
+        candidates = np.flatnonzero(
+            unassigned
+            & (lon_min >= min_x)
+            & (lon_max <= max_x)
+            & (lat_min >= min_y)
+            & (lat_max <= max_y)
+        )
+        if len(candidates) == 0:
+            continue
+
+        within = candidates[
+            cells_within(
+                region_polygon,
+                prepared_polygon,
+                lat_min[candidates],
+                lat_max[candidates],
+                lon_min[candidates],
+                lon_max[candidates],
+            )
+        ]
+        labels[within] = name
+        unassigned[within] = False
+
+    return labels
+
+
+def filter_by_region(searches_df, country_ISO3, center, prev_month, grid, regions_dir=None):
+    start_time = time.time()
+    regions = load_regions(regions_dir or REGION_DIRS[country_ISO3])
+
+    searches_df = pd.DataFrame(searches_df, columns=CELL_COLUMNS)
+    if searches_df.empty:
+        return
+
+    # Label every cell with its region in a single pass
+    lat_min, lat_max, lon_min, lon_max = grid.cell_bounds(searches_df["cell_id"].values)
+    labels = assign_regions(lat_min, lat_max, lon_min, lon_max, regions)
+
+    for name, _, _ in regions:
+        region_cells = searches_df[labels == name]
+        if region_cells.empty:
+            continue
+
+        print(f"saving region {name}")
+        save_data(region_cells, f"{country_ISO3}_{name}", center, prev_month, grid)
+    print(f"time: {time.time() - start_time}")
+
+
+def aggregate_data(cell_colors_sums_df, country, grid, month):
+    total_searches_path = hotspot_store.total_path(country, grid.name)
+
+    # Fold the month into the total as a delta, reapplying a month is a no-op
+    applied = hotspot_store.apply_month(
+        total_searches_path,
+        hotspot_store.month_key(month),
+        cell_colors_sums_df,
+        grid,
+        coloring,
+    )
+    if not applied:
+        print(f"{hotspot_store.month_key(month)} already aggregated in {total_searches_path}")
+
+
+def retract_data(country, grid, month):
+    # Subtract a month that was already aggregated from the total, False if there
+    # was nothing to retract
+    month_path = hotspot_store.month_path(country, month, grid.name)
+    if not os.path.exists(month_path):
+        return False
+    month_cells, _ = hotspot_store.read_cells(month_path)
+    retracted = hotspot_store.retract_month(
+        hotspot_store.total_path(country, grid.name),
+        hotspot_store.month_key(month),
+        month_cells,
+        grid,
+        coloring,
+    )
+    hotspot_exports.update_exports(country, grid.name)
+    return retracted
 
-    merged_df.to_csv(total_searches_path, index=False)
-    
 
 def get_country_names(path):
     files = []
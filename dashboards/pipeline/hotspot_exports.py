@@ -0,0 +1,141 @@
+import os
+import tempfile
+from zipfile import ZipFile
+
+import geopandas
+import numpy as np
+import shapely
+
+import hotspot_store
+from auxiliary_functions.atomic_files import atomic_write
+
+# Download artifacts built for every total, by extension: label and mime type
+EXPORT_FORMATS = {
+    "zip": ("Shapefile (.shp)", "application/zip"),
+    "parquet": ("GeoParquet (.parquet)", "application/octet-stream"),
+    "fgb": ("FlatGeobuf (.fgb)", "application/octet-stream"),
+}
+SHAPEFILE_NAME = "user_shapefiles"
+SHAPEFILE_EXTENSIONS = ["shp", "cpg", "dbf", "prj", "shx"]
+
+# WKB of a polygon with a single closed ring of 5 points, little endian
+BOX_WKB = np.dtype(
+    [
+        ("byte_order", "u1"),
+        ("geometry_type", "<u4"),
+        ("rings", "<u4"),
+        ("points", "<u4"),
+        ("coordinates", "<f8", (10,)),
+    ]
+)
+
+
+def export_path(country, grid_size, export_format, db_dir=hotspot_store.DB_DIR):
+    return f"{db_dir}/{country}/exports/total_{grid_size}.{export_format}"
+
+
+def box_wkb(lat_min, lat_max, lon_min, lon_max):
+    # WKB of the cell boxes built with NumPy, in the ring order of shapely.box
+    boxes = np.zeros(len(lat_min), dtype=BOX_WKB)
+    boxes["byte_order"] = 1
+    boxes["geometry_type"] = 3
+    boxes["rings"] = 1
+    boxes["points"] = 5
+    boxes["coordinates"] = np.column_stack(
+        [lon_max, lat_min, lon_max, lat_max, lon_min, lat_max, lon_min, lat_min, lon_max, lat_min]
+    )
+    return boxes.view(f"V{BOX_WKB.itemsize}").astype(object)
+
+
+def cell_geometries(lat_min, lat_max, lon_min, lon_max):
+    # Polygons of the cells, without a Python loop over the cells
+    if hasattr(shapely, "box"):
+        # Shapely 2 builds all the boxes in a single vectorized call
+        return geopandas.GeoSeries(
+            shapely.box(lon_min, lat_min, lon_max, lat_max), crs="epsg:4326"
+        )
+    return geopandas.GeoSeries.from_wkb(
+        box_wkb(lat_min, lat_max, lon_min, lon_max), crs="epsg:4326"
+    )
+
+
+def cells_geodataframe(cells, grid):
+    """Converts the cells into a GeoDataFrame with the value, the color and the polygon of each cell.
+
+    :param cells: DataFrame with the cell_id, value and color columns.
+    :type cells: pd.DataFrame
+    :param grid: Grid the cell ids refer to.
+    :type grid: GridSpec
+    :rtype: geopandas.GeoDataFrame
+    """
+    lat_min, lat_max, lon_min, lon_max = grid.cell_bounds(cells["cell_id"].values)
+    return geopandas.GeoDataFrame(
+        {
+            # Shapefiles have no unsigned 64 bits integers
+            "value": cells["value"].values.astype(np.int64),
+            "color": cells["color"].astype(object).values,
+        },
+        geometry=cell_geometries(
+            np.asarray(lat_min, dtype=np.float64),
+            np.asarray(lat_max, dtype=np.float64),
+            np.asarray(lon_min, dtype=np.float64),
+            np.asarray(lon_max, dtype=np.float64),
+        ).values,
+        crs="epsg:4326",
+    )
+
+
+def write_shapefile_zip(gdf, path):
+    with tempfile.TemporaryDirectory() as tmp:
+        gdf.to_file(f"{tmp}/{SHAPEFILE_NAME}.shp", driver="ESRI Shapefile")
+        with ZipFile(path, "w") as zip_file:
+            for extension in SHAPEFILE_EXTENSIONS:
+                file_name = f"{SHAPEFILE_NAME}.{extension}"
+                if os.path.exists(f"{tmp}/{file_name}"):
+                    zip_file.write(f"{tmp}/{file_name}", arcname=file_name)
+
+
+WRITERS = {
+    "zip": write_shapefile_zip,
+    "parquet": lambda gdf, path: gdf.to_parquet(path),
+    "fgb": lambda gdf, path: gdf.to_file(path, driver="FlatGeobuf"),
+}
+
+
+def write_exports(country, grid_size, db_dir=hotspot_store.DB_DIR):
+    """Builds the download artifacts of the total of a country: a zipped shapefile, a
+    GeoParquet and a FlatGeobuf file. Each file is written next to its destination
+    and moved in place, so the dashboard never serves a half-written file.
+
+    :param country: ISO-3 code of the country.
+    :type country: str
+    :param grid_size: Grid name of the total, like 0.08.
+    :type grid_size: str or float
+    """
+    cells, grid = hotspot_store.read_cells(hotspot_store.total_path(country, grid_size, db_dir))
+    gdf = cells_geodataframe(cells, grid)
+
+    for export_format, write in WRITERS.items():
+        path = export_path(country, grid_size, export_format, db_dir)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # The drivers pick the format from the extension, so it is kept
+        with atomic_write(path, suffix=f".{export_format}") as tmp_path:
+            write(gdf, tmp_path)
+
+
+def update_exports(country, grid_size, db_dir=hotspot_store.DB_DIR):
+    # Rebuild the artifacts missing or older than the total, True if they were rebuilt
+    total_path = hotspot_store.total_path(country, grid_size, db_dir)
+    if not os.path.exists(total_path):
+        return False
+    total_mtime = os.stat(total_path).st_mtime_ns
+    if all(
+        os.path.exists(path) and os.stat(path).st_mtime_ns >= total_mtime
+        for path in (
+            export_path(country, grid_size, export_format, db_dir)
+            for export_format in EXPORT_FORMATS
+        )
+    ):
+        return False
+    write_exports(country, grid_size, db_dir)
+    return True
@@ -0,0 +1,121 @@
+import numpy as np
+import pyarrow as pa
+
+import hotspot_store
+
+
+class CellIndex:
+    """In-memory index over the cells of a total file, for window, point and top-K
+    queries. The cells are kept sorted by (row, col), so a window only scans the cells
+    of its rows, and their positions sorted by cell id are kept for point lookups.
+    """
+
+    def __init__(self, table, grid):
+        self.grid = grid
+        cell_ids = table.column("cell_id").to_numpy()
+        values = table.column("value").to_numpy()
+        colors, codes = hotspot_store.color_codes(table)
+        self.colors = np.array(colors, dtype=object)
+
+        rows, cols = self.grid.cell_rowcol(cell_ids)
+        order = np.lexsort((cols, rows))
+        self.rows, self.cols = rows[order], cols[order]
+        self.cell_ids, self.values, self.codes = cell_ids[order], values[order], codes[order]
+        self.id_order = np.argsort(self.cell_ids, kind="stable")
+        self.sorted_ids = self.cell_ids[self.id_order]
+
+    def __len__(self):
+        return len(self.cell_ids)
+
+    @property
+    def nbytes(self):
+        arrays = [
+            self.rows, self.cols, self.cell_ids, self.values, self.codes, self.id_order, self.sorted_ids
+        ]
+        return sum(array.nbytes for array in arrays)
+
+    def window(self, lat_min, lat_max, lon_min, lon_max):
+        """Positions of the cells intersecting a lat/lon window.
+
+        :rtype: np.ndarray
+        """
+        grid = self.grid
+        # Cells are matched on their true extent, so offsets are floored for every grid
+        row_min, row_max = np.floor(
+            (np.array([lat_min, lat_max]) - grid.lat_origin) / grid.cell_size
+        ).astype(np.int64)
+        col_min, col_max = np.floor(
+            (np.array([lon_min, lon_max]) - grid.lon_origin) / grid.cell_size
+        ).astype(np.int64)
+
+        start = np.searchsorted(self.rows, row_min, side="left")
+        end = np.searchsorted(self.rows, row_max, side="right")
+        cols = self.cols[start:end]
+        return start + np.flatnonzero((cols >= col_min) & (cols <= col_max))
+
+    def point(self, lat, lon):
+        """Position of the cell a coordinate is counted in, None if there is no such cell.
+        The cell is reached with the grid arithmetic and looked up by id.
+
+        :rtype: int or None
+        """
+        rows, cols = self.grid.cell_index(np.array([lat]), np.array([lon]))
+        if not self.grid.contains(rows, cols)[0]:
+            return None
+        cell_id = self.grid.cell_ids(rows, cols)[0]
+        position = np.searchsorted(self.sorted_ids, cell_id)
+        if position == len(self.sorted_ids) or self.sorted_ids[position] != cell_id:
+            return None
+        return int(self.id_order[position])
+
+    def top(self, k, positions=None):
+        """Positions of the k cells with the highest values, hottest first, optionally
+        only among the given positions.
+
+        :rtype: np.ndarray
+        """
+        if positions is None:
+            positions = np.arange(len(self.values))
+        if k <= 0:
+            return positions[:0]
+        if k < len(positions):
+            values = self.values[positions]
+            positions = positions[np.argpartition(values, len(values) - k)[len(values) - k:]]
+        return positions[np.argsort(self.values[positions], kind="stable")[::-1]]
+
+    def records(self, positions):
+        """Cell id, value, color and bounds of the cells at the given positions.
+
+        :rtype: pa.Table
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        cell_ids = self.cell_ids[positions]
+        lat_min, lat_max, lon_min, lon_max = self.grid.cell_bounds(cell_ids)
+        return pa.table(
+            {
+                "cell_id": pa.array(cell_ids, type=pa.uint64()),
+                "value": pa.array(self.values[positions], type=pa.uint64()),
+                "color": pa.array(self.colors[self.codes[positions]], type=pa.string()),
+                "lat_min": np.asarray(lat_min, dtype=np.float64),
+                "lat_max": np.asarray(lat_max, dtype=np.float64),
+                "lon_min": np.asarray(lon_min, dtype=np.float64),
+                "lon_max": np.asarray(lon_max, dtype=np.float64),
+            }
+        )
+
+
+def load_index(path):
+    return CellIndex(*hotspot_store.read_table(path))
+
+
+def to_columns(table):
+    # Compact JSON of a records table, a list of values per column
+    return {name: table.column(name).to_pylist() for name in table.column_names}
+
+
+def to_ipc(table):
+    # Arrow IPC stream of a records table
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
@@ -0,0 +1,131 @@
+import glob
+import hashlib
+import math
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+import cell_colors
+import cells_cache
+import hotspot_index
+import hotspot_store
+import morton
+
+TILE_SIZE = 256
+# Smallest size in pixels a cell is drawn at, coarser cells are used below it, so the
+# number of cells on screen stays about the same at every zoom
+MIN_CELL_PIXELS = 4
+
+
+def read_grid(path):
+    # Grid of a total, only its schema is read
+    with pa.memory_map(path, "r") as source:
+        metadata = pa.ipc.open_file(source).schema.metadata
+    return hotspot_store.grid_from_metadata(metadata)
+
+
+def country_totals(country, db_dir=hotspot_store.DB_DIR):
+    """Totals of a country and their grids, from the finest to the coarsest grid.
+    The grids are read from the schema of each file, through the shared cells cache.
+
+    :rtype: tuple of (str, GridSpec)
+    """
+    totals = [
+        (path, cells_cache.cells.get(path, read_grid))
+        for path in glob.glob(f"{db_dir}/{country}/total_*.{hotspot_store.EXTENSION}")
+    ]
+    return tuple(sorted(totals, key=lambda total: total[1].cell_size))
+
+
+def totals_version(totals):
+    # Short data version of a set of totals, changes when any of them is rewritten
+    versions = [f"{path}:{hotspot_store.data_version(path)}" for path, _ in totals]
+    return hashlib.sha256("|".join(versions).encode("utf-8")).hexdigest()[:16]
+
+
+def cell_pixels(grid, zoom):
+    # Width in pixels of a cell at a web mercator zoom, at the equator
+    return grid.cell_size / 360.0 * TILE_SIZE * 2 ** zoom
+
+
+def choose_level(totals, zoom, min_pixels=MIN_CELL_PIXELS):
+    """Picks the finest total whose cells are drawn at least min_pixels wide at a zoom.
+    When even the coarsest cells are smaller, they are rolled up by a power of 2.
+
+    :param totals: Totals of a country, as returned by country_totals.
+    :type totals: tuple
+    :return: The path of the total, its grid and the factor to roll it up by.
+    :rtype: (str, GridSpec, int)
+    """
+    for path, grid in totals:
+        if cell_pixels(grid, zoom) >= min_pixels:
+            return path, grid, 1
+    path, grid = totals[-1]
+    factor = 2 ** math.ceil(math.log2(min_pixels / cell_pixels(grid, zoom)))
+    if isinstance(grid, morton.MortonGrid):
+        factor = min(factor, 2 ** grid.level)
+    return path, grid, factor
+
+
+def roll_up(cells, grid, factor):
+    """Sums the cells into the cells of a grid factor times coarser and colors them again.
+
+    :param cells: DataFrame with the cell_id and value columns.
+    :type cells: pd.DataFrame
+    :return: The coarse cells DataFrame and the coarse grid.
+    :rtype: (pd.DataFrame, GridSpec)
+    """
+    coarse_grid = grid.coarsen(factor)
+    rows, cols = grid.cell_rowcol(cells["cell_id"].values)
+    cell_ids, values = morton.sum_by_key(
+        coarse_grid.cell_ids(rows // factor, cols // factor),
+        cells["value"].values.astype(np.float64),
+    )
+    coarse = pd.DataFrame({"cell_id": cell_ids, "value": values})
+    if len(coarse) and values.min() < values.max():
+        coarse = cell_colors.coloring(coarse)
+    else:
+        # The log binning of coloring needs at least two distinct values
+        coarse["color"] = pd.Categorical(["red"] * len(coarse))
+    return coarse, coarse_grid
+
+
+def lod_table(path, factor):
+    # Cells table and grid of a total, rolled up by factor
+    cells, grid = hotspot_store.read_cells(path)
+    if factor == 1:
+        return hotspot_store.to_table(cells, grid), grid
+    coarse, coarse_grid = roll_up(cells, grid, factor)
+    return hotspot_store.to_table(coarse, coarse_grid), coarse_grid
+
+
+def load_lod_index(path, factor):
+    return hotspot_index.CellIndex(*lod_table(path, factor))
+
+
+def lod_index(path, factor=1):
+    # Cell index of a total rolled up by factor, through the shared cells cache, so a
+    # rewritten total is rolled up again
+    if factor == 1:
+        return cells_cache.cells.get(path, hotspot_index.load_index)
+    return cells_cache.cells.get(path, load_lod_index, factor)
+
+
+def viewport_cells(country, zoom, bounds, limit=20, db_dir=hotspot_store.DB_DIR):
+    """Hottest cells inside the map viewport, at the resolution picked for the zoom.
+
+    :param zoom: Zoom of the map.
+    :type zoom: int
+    :param bounds: lat_min, lat_max, lon_min and lon_max of the viewport.
+    :type bounds: tuple
+    :return: The cells table, None without totals, and the grid the cells belong to.
+    :rtype: (pa.Table or None, GridSpec or None)
+    """
+    totals = country_totals(country, db_dir)
+    if not totals:
+        return None, None
+    path, _, factor = choose_level(totals, zoom)
+    cell_index = lod_index(path, factor)
+    positions = cell_index.top(limit, cell_index.window(*bounds))
+    return cell_index.records(positions), cell_index.grid
@@ -0,0 +1,275 @@
+import calendar
+import contextlib
+import fcntl
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from auxiliary_functions.atomic_files import atomic_write
+from grid_spec import GridSpec
+from morton import MortonGrid
+
+DB_DIR = "apps/searchHotspots/db"
+EXTENSION = "arrow"
+GRID_SPEC_KEY = b"grid_spec"
+APPLIED_MONTHS_KEY = b"applied_months"
+GRID_KINDS = {"degree": GridSpec, "morton": MortonGrid}
+
+SCHEMA = pa.schema(
+    [
+        ("cell_id", pa.uint64()),
+        ("value", pa.uint64()),
+        ("color", pa.dictionary(pa.int8(), pa.string())),
+    ]
+)
+
+
+#### PATHS
+
+
+def month_key(month):
+    return f"{month.year}_{month.month}"
+
+
+def month_path(country, month, grid_size, db_dir=DB_DIR):
+    return (
+        f"{db_dir}/{country}/{month_key(month)}/"
+        f"{calendar.month_name[int(month.month)]}_{grid_size}.{EXTENSION}"
+    )
+
+
+def total_path(country, grid_size, db_dir=DB_DIR):
+    return f"{db_dir}/{country}/total_{grid_size}.{EXTENSION}"
+
+
+#### WRITERS
+
+
+def to_table(cells, grid, applied_months=None):
+    """Converts a cells DataFrame into an Arrow table with the grid spec as metadata.
+
+    :param cells: DataFrame with the cell_id, value and color columns.
+    :type cells: pd.DataFrame
+    :param grid: Grid the cell ids refer to.
+    :type grid: GridSpec
+    :param applied_months: Month keys already folded into a total, stored with it.
+    :type applied_months: list or None
+    :rtype: pa.Table
+    """
+    color = cells["color"]
+    if not isinstance(color.dtype, pd.CategoricalDtype):
+        color = color.astype("category")
+
+    table = pa.Table.from_arrays(
+        [
+            pa.array(cells["cell_id"].values.astype(np.uint64), type=pa.uint64()),
+            pa.array(cells["value"].values.astype(np.uint64), type=pa.uint64()),
+            pa.DictionaryArray.from_arrays(
+                pa.array(color.cat.codes.values.astype(np.int8), mask=color.isna().values),
+                pa.array(color.cat.categories.astype(str).tolist(), type=pa.string()),
+            ),
+        ],
+        schema=SCHEMA,
+    )
+    metadata = {GRID_SPEC_KEY: json.dumps(grid.to_dict())}
+    if applied_months is not None:
+        metadata[APPLIED_MONTHS_KEY] = json.dumps(sorted(applied_months))
+    return table.replace_schema_metadata(metadata)
+
+
+def write_cells(path, cells, grid, applied_months=None):
+    """Writes the cells as an uncompressed Arrow IPC file, so readers can memory-map it.
+    The file is written next to its destination and moved in place, so readers never
+    see a half-written file.
+
+    :param path: Destination file path.
+    :type path: str
+    :param cells: DataFrame with the cell_id, value and color columns.
+    :type cells: pd.DataFrame
+    :param grid: Grid the cell ids refer to.
+    :type grid: GridSpec
+    :param applied_months: Month keys already folded into a total, stored with it.
+    :type applied_months: list or None
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = to_table(cells, grid, applied_months=applied_months)
+    with atomic_write(path) as tmp_path:
+        with pa.OSFile(tmp_path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+
+#### READERS
+
+
+def read_table(path, memory_map=True):
+    """Reads a cells file as an Arrow table, zero-copy when memory-mapped.
+
+    :return: The cells table and the grid spec stored with it.
+    :rtype: (pa.Table, GridSpec)
+    """
+    source = pa.memory_map(path, "r") if memory_map else pa.OSFile(path, "rb")
+    table = pa.ipc.open_file(source).read_all()
+    return table, grid_from_metadata(table.schema.metadata)
+
+
+def grid_from_metadata(metadata):
+    # Grid spec stored in the metadata of a cells file
+    grid_dict = json.loads(metadata[GRID_SPEC_KEY])
+    return GRID_KINDS[grid_dict.get("kind", "degree")].from_dict(grid_dict)
+
+
+def read_cells(path, memory_map=True, bounds=False):
+    """Reads a cells file into a DataFrame with cell_id, value and color columns.
+
+    :param bounds: Whether to add the lat_min, lat_max, lon_min and lon_max columns of each cell.
+    :type bounds: bool
+    :return: The cells DataFrame and the grid spec stored with it.
+    :rtype: (pd.DataFrame, GridSpec)
+    """
+    table, grid = read_table(path, memory_map=memory_map)
+    cells = table.to_pandas(split_blocks=True)
+    if bounds:
+        cells = with_bounds(cells, grid)
+    return cells, grid
+
+
+def color_codes(table):
+    """Decodes the color column of a cells table.
+
+    :return: The color names, with None appended for the cells without a color, and
+        the index of the color of each cell in them.
+    :rtype: (list, np.ndarray)
+    """
+    color = table.column("color").combine_chunks()
+    colors = color.dictionary.to_pylist()
+    codes = color.indices.fill_null(-1).to_numpy(zero_copy_only=False).astype(np.int64)
+    codes[codes < 0] = len(colors)
+    return colors + [None], codes
+
+
+def with_bounds(cells, grid):
+    # Add the bounds of every cell computed from the grid spec
+    lat_min, lat_max, lon_min, lon_max = grid.cell_bounds(cells["cell_id"].values)
+    return cells.assign(lat_min=lat_min, lat_max=lat_max, lon_min=lon_min, lon_max=lon_max)
+
+
+def data_version(path):
+    # Changes every time the file is rewritten, as files are replaced and never edited
+    stat = os.stat(path)
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+def read_applied_months(path):
+    # Month keys folded into a total, read from the file footer only
+    if not os.path.exists(path):
+        return []
+    with pa.memory_map(path, "r") as source:
+        metadata = pa.ipc.open_file(source).schema.metadata or {}
+    return json.loads(metadata.get(APPLIED_MONTHS_KEY, b"[]"))
+
+
+#### INCREMENTAL TOTALS
+
+
+@contextlib.contextmanager
+def locked(path):
+    # Exclusive lock on a sidecar file, held while a total is read and rewritten
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def merge_values(cell_ids, values, delta_ids, delta_values, sign=1):
+    """Keyed merge of per-cell values with a delta, on the cell id.
+
+    :param sign: 1 to add the delta, -1 to subtract it.
+    :type sign: int
+    :return: The sorted cell ids and their values, without the cells left at zero.
+    :rtype: (np.ndarray, np.ndarray)
+    """
+    merged_ids = np.union1d(cell_ids, delta_ids)
+    merged = np.bincount(
+        np.searchsorted(merged_ids, cell_ids),
+        weights=values.astype(np.float64),
+        minlength=len(merged_ids),
+    ) + sign * np.bincount(
+        np.searchsorted(merged_ids, delta_ids),
+        weights=delta_values.astype(np.float64),
+        minlength=len(merged_ids),
+    )
+    merged = np.round(merged).astype(np.int64)
+    if (merged < 0).any():
+        raise ValueError("Merging the delta leaves cells with negative values")
+
+    keep = merged > 0
+    return merged_ids[keep], merged[keep].astype(np.uint64)
+
+
+def update_total(path, key, cells, grid, recolor, sign):
+    with locked(path):
+        cell_ids = np.array([], dtype=np.uint64)
+        values = np.array([], dtype=np.uint64)
+        applied_months = []
+        if os.path.exists(path):
+            table, total_grid = read_table(path)
+            if total_grid != grid:
+                raise ValueError(f"Grid of {path} does not match: {total_grid} != {grid}")
+            cell_ids = table.column("cell_id").to_numpy()
+            values = table.column("value").to_numpy()
+            applied_months = json.loads(table.schema.metadata.get(APPLIED_MONTHS_KEY, b"[]"))
+
+        # Applying an applied month or retracting a missing one is a no-op
+        if (key in applied_months) == (sign > 0):
+            return False
+
+        cell_ids, values = merge_values(
+            cell_ids, values, cells["cell_id"].values, cells["value"].values, sign=sign
+        )
+        total = pd.DataFrame({"cell_id": cell_ids, "value": values})
+        if len(total):
+            total = recolor(total)
+        else:
+            total["color"] = pd.Categorical([])
+
+        if sign > 0:
+            applied_months = applied_months + [key]
+        else:
+            applied_months = [month for month in applied_months if month != key]
+        write_cells(path, total, grid, applied_months=applied_months)
+        return True
+
+
+def apply_month(path, key, cells, grid, recolor):
+    """Folds the cells of a month into a total, unless the month is already in it.
+
+    :param path: Path of the total file, created if it does not exist.
+    :type path: str
+    :param key: Month key, as returned by month_key.
+    :type key: str
+    :param cells: DataFrame with the cell_id and value columns of the month.
+    :type cells: pd.DataFrame
+    :param grid: Grid the cell ids refer to.
+    :type grid: GridSpec
+    :param recolor: Function that adds the color column to the merged cells.
+    :type recolor: callable
+    :return: Whether the month was applied.
+    :rtype: bool
+    """
+    return update_total(path, key, cells, grid, recolor, sign=1)
+
+
+def retract_month(path, key, cells, grid, recolor):
+    """Subtracts the cells of a month from a total, if the month is in it.
+
+    :return: Whether the month was retracted.
+    :rtype: bool
+    """
+    return update_total(path, key, cells, grid, recolor, sign=-1)
@@ -0,0 +1,177 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+import cells_cache
+import hotspot_lod
+import hotspot_store
+
+TILE_SIZE = hotspot_lod.TILE_SIZE
+MAX_ZOOM = 20
+# Rendered tiles kept in memory, evicted least recently used first. They are kept apart
+# from the loaded cells, so the many small tiles do not evict the cells they are drawn from
+TILE_CACHE_SIZE = 4096
+TILE_CACHE_MB = 256
+tiles = cells_cache.CellsCache(
+    max_bytes=TILE_CACHE_MB * 1024 ** 2, max_entries=TILE_CACHE_SIZE
+)
+
+# RGBA fill of each cell color, the colors of the dashboard legend
+COLOR_RGBA = {
+    "green": (0, 255, 0, 150),
+    "yellow": (255, 255, 0, 150),
+    "orange": (255, 165, 0, 160),
+    "red": (255, 0, 0, 170),
+}
+TRANSPARENT = (0, 0, 0, 0)
+
+
+class TileCells:
+    """Cells table of a total prepared for rendering: the sorted cell ids, the palette
+    index of each cell and the lat/lon extent of all the cells.
+    """
+
+    def __init__(self, table, grid):
+        self.grid = grid
+        cell_ids = table.column("cell_id").to_numpy()
+
+        # Last entry of the palette is the transparent pixel of the pixels without a cell
+        colors, codes = hotspot_store.color_codes(table)
+        self.palette = np.array(
+            [COLOR_RGBA.get(name, TRANSPARENT) for name in colors[:-1]] + [TRANSPARENT],
+            dtype=np.uint8,
+        )
+        self.empty_index = len(colors) - 1
+
+        order = np.argsort(cell_ids, kind="stable")
+        self.cell_ids, self.codes = cell_ids[order], codes[order]
+
+        if len(self.cell_ids):
+            lat_min, lat_max, lon_min, lon_max = self.grid.cell_bounds(self.cell_ids)
+            self.extent = lat_min.min(), lat_max.max(), lon_min.min(), lon_max.max()
+        else:
+            self.extent = None
+
+    @property
+    def nbytes(self):
+        return self.cell_ids.nbytes + self.codes.nbytes + self.palette.nbytes
+
+    def intersects(self, lat_min, lat_max, lon_min, lon_max):
+        if self.extent is None:
+            return False
+        extent_lat_min, extent_lat_max, extent_lon_min, extent_lon_max = self.extent
+        return (
+            lat_min < extent_lat_max
+            and lat_max > extent_lat_min
+            and lon_min < extent_lon_max
+            and lon_max > extent_lon_min
+        )
+
+
+def tile_bounds(z, x, y):
+    # (lat_min, lat_max, lon_min, lon_max) of a web mercator XYZ tile
+    n = 2 ** z
+    lon_min, lon_max = x / n * 360.0 - 180.0, (x + 1) / n * 360.0 - 180.0
+    lat_max = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * y / n))))
+    lat_min = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + 1) / n))))
+    return float(lat_min), float(lat_max), float(lon_min), float(lon_max)
+
+
+def pixel_coordinates(z, x, y, size=TILE_SIZE):
+    # Latitudes of the pixel rows and longitudes of the pixel columns of a tile, at the
+    # pixel centers. Web mercator is separable, so a tile is size + size coordinates
+    n = 2 ** z * size
+    offsets = np.arange(size) + 0.5
+    lons = (x * size + offsets) / n * 360.0 - 180.0
+    lats = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y * size + offsets) / n))))
+    return lats, lons
+
+
+def render_tile(cells, z, x, y, size=TILE_SIZE):
+    """Rasterizes the cells over a web mercator XYZ tile. Every pixel is assigned the
+    cell under its center and the cells are looked up by id, so the cost of a tile
+    depends on its size and not on the number of cells.
+
+    :param cells: Cells to render, as loaded by load_cells.
+    :type cells: TileCells
+    :return: RGBA pixels of the tile, of shape (size, size, 4).
+    :rtype: np.ndarray
+    """
+    if not len(cells.cell_ids):
+        return np.zeros((size, size, 4), dtype=np.uint8)
+
+    grid = cells.grid
+    lats, lons = pixel_coordinates(z, x, y, size)
+    # Cells are drawn at their true extent, so offsets are floored for every grid
+    rows = np.floor((lats - grid.lat_origin) / grid.cell_size).astype(np.int64)[:, None]
+    cols = np.floor((lons - grid.lon_origin) / grid.cell_size).astype(np.int64)[None, :]
+
+    inside = grid.contains(rows, cols)
+    pixel_ids = grid.cell_ids(np.where(inside, rows, 0), np.where(inside, cols, 0))
+    positions = np.searchsorted(cells.cell_ids, pixel_ids)
+    positions = np.minimum(positions, len(cells.cell_ids) - 1)
+    found = inside & (cells.cell_ids[positions] == pixel_ids)
+    return cells.palette[np.where(found, cells.codes[positions], cells.empty_index)]
+
+
+def encode_png(pixels):
+    buffer = io.BytesIO()
+    Image.fromarray(pixels, "RGBA").save(buffer, format="PNG", optimize=False)
+    return buffer.getvalue()
+
+
+# Tile of the areas without cells, encoded once
+EMPTY_TILE = encode_png(np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8))
+
+
+def read_tile_cells(path):
+    return TileCells(*hotspot_store.read_table(path))
+
+
+def read_lod_tile_cells(path, factor):
+    return TileCells(*hotspot_lod.lod_table(path, factor))
+
+
+def load_cells(path, factor=1):
+    # Cells of a total rolled up by factor, see hotspot_lod, through the shared cells
+    # cache, so a rewritten total is loaded again
+    if factor == 1:
+        return cells_cache.cells.get(path, read_tile_cells)
+    return cells_cache.cells.get(path, read_lod_tile_cells, factor)
+
+
+def render_png(path, factor, z, x, y):
+    cells = load_cells(path, factor)
+    if not cells.intersects(*tile_bounds(z, x, y)):
+        return EMPTY_TILE
+    return encode_png(render_tile(cells, z, x, y))
+
+
+def tile_png(path, z, x, y):
+    """Gets the PNG of an XYZ tile of a total file, cached per file, data version and tile.
+
+    :param path: Path of the total file, see hotspot_store.total_path.
+    :type path: str
+    :rtype: bytes
+    """
+    return tiles.get(path, render_png, 1, z, x, y)
+
+
+def lod_tile_png(totals, z, x, y):
+    """Gets the PNG of an XYZ tile of a country at the resolution picked for the zoom,
+    so the cells are never drawn smaller than hotspot_lod.MIN_CELL_PIXELS.
+
+    :param totals: Totals of the country, as returned by hotspot_lod.country_totals.
+    :type totals: tuple
+    :rtype: bytes
+    """
+    if not totals:
+        return EMPTY_TILE
+    path, _, factor = hotspot_lod.choose_level(totals, z)
+    return tiles.get(path, render_png, factor, z, x, y)
+
+
+def valid_tile(z, x, y):
+    # Whether z/x/y is a tile of the web mercator pyramid
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
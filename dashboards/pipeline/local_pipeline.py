@@ -1,144 +1,445 @@
 import pandas as pd
 import datetime
 import auxiliary_functions.generating_ADX_sample as utils
-import urllib.parse
+from auxiliary_functions.fetch_cache import FetchCache
 
+import grid_backends
 import grid_utils
-import geopandas
+import hotspot_store
+import morton
+import reference_data
+import stage_handoff
 import pycountry
 import os, sys
 from tqdm import tqdm
-import time
 import logging
 import datetime
+import argparse
+import concurrent.futures
 
-from pyspark.sql import SparkSession, DataFrame
-from pyspark.sql.types import *
-from pyspark.sql.functions import udf, col
+pd.set_option("display.max_columns", 100)
+
+# "degree" grids the countries with fixed-degree grids on their bounding box,
+# "morton" with a pyramid of global Morton tile levels
+GRID_SCHEME = os.environ.get("HOTSPOTS_GRID_SCHEME", "degree")
+GRID_SIZES = [0.08, 0.022]  # [0.022, 0.1]
+MORTON_LEVELS = [12, 14]
+COLOR_MAP = ["green", "yellow", "orange", "red"]
+
+# "pandas" grids the samples in the driver, "spark" with Spark, that is only started
+# when this backend is selected
+BACKEND = os.environ.get("HOTSPOTS_BACKEND", "pandas")
 
-spark = (
-    SparkSession.builder.master("local[8]")
-    .config("spark.driver.memory", "8G")
-    .appName("SearchLogs")
-    .getOrCreate()
+# Rows of a sample read and binned at once by the pandas backend, so the peak memory
+# of the grid stage is bounded by it and not by the sample size. 0 grids a sample at once
+CHUNK_SIZE = int(os.environ.get("HOTSPOTS_CHUNK_SIZE", 0))
+
+# "arrow" or "parquet" to also spill the samples handed to the grid stage to disk,
+# an empty value keeps them in memory only
+SPILL_FORMAT = os.environ.get("HOTSPOTS_SPILL") or None
+
+# Folder of the cached (country, day) ADX results, an empty value disables the cache
+FETCH_CACHE_DIR = os.environ.get(
+    "HOTSPOTS_FETCH_CACHE", "apps/searchHotspots/fetch-cache"
 )
 
-pd.set_option("display.max_columns", 100)
+
+# Reference data shared by every country, see load_reference_data
+reference = None
 version = datetime.datetime.today().strftime("%d-%m-%Y")
 logging.basicConfig(filename="monthly_script.log", level=logging.INFO)
 
 
-def parse_searched_query(x):
-    """Mapping function that receives the query string and decodes all encoded characters like %20 -> space
+def grid_backend():
+    # Backend of the grid stage, with the chunk size of the pandas backend
+    if BACKEND == "pandas":
+        return grid_backends.get_backend(BACKEND, chunk_size=CHUNK_SIZE)
+    return grid_backends.get_backend(BACKEND)
 
-    :param x: String containing encoded query string
-    :param x: str
-    """
-    if not x:
-        x = ""
-    else:
-        x = urllib.parse.unquote(x)
-        x = x[: min([idx if y == "." else len(x) for idx, y in enumerate(x)])]
-        # x = str(x).replace("\t", "").replace(",", " ").replace("\n", "").replace("+", " ").lower().strip()
 
-    return x
+# COMMAND ----------
 
 
 # COMMAND ----------
 
 
-# COMMAND ----------
+def prev_month_dates(month):
+    today = datetime.datetime.today() - datetime.timedelta(days=month)
+    prev_month_last_day = today.replace(day=1) - datetime.timedelta(days=1)
 
+    return prev_month_last_day, str(prev_month_last_day.day)
 
-def parse_address_and_search_request(df: pd.DataFrame) -> DataFrame:
-    """Function that gets the Pandas DF and converts it into a Spark DF, then it parses the searched query strings and
-    flattens the "address" Json column which generates new columns for each one of the address components.
 
-    :param df: DataFrame that contains the data as obtained from the sampling process.
-    :type df: pd.DataFrame
-    :param save_path: Specifies the path on which you want to save the data.
-    :type save_path: str
-    :return: A Spark DataFrame with all the relevant information
-    :rtype: DataFrame
-    """
-    # Create a spark Dataframe
-    df["search_query_counts"] = df["search_query_counts"].astype(str)
-    searchesDF = spark.createDataFrame(data=df)
+def country_grids(country_ISO3, reference):
+    # Grids the country is binned on, keyed by grid size or Morton level
+    if GRID_SCHEME == "morton":
+        return {level: morton.MortonGrid(level) for level in MORTON_LEVELS}
+    lat_range, lon_range = reference.bounding_box(country_ISO3)
+    return {
+        grid_size: grid_utils.create_grid(lat_range, lon_range, grid_size)
+        for grid_size in GRID_SIZES
+    }
 
-    parsingUDF = udf(lambda x: parse_searched_query(x))
-    searchesDF_parsedQuery = searchesDF.withColumn(
-        "searched_query", parsingUDF(col("searched_query"))
-    )
 
-    return searchesDF_parsedQuery
+def save_grid_sums(country_ISO3, center, prev_month, grid, grid_sums):
+    cell_colors_sums = grid_utils.color_grid_sums(grid, grid_sums, COLOR_MAP)
 
+    print(f"processing save_data")
+    if country_ISO3 in grid_utils.REGION_DIRS:
+        grid_utils.filter_by_region(
+            cell_colors_sums, country_ISO3, center, prev_month, grid
+        )
 
-def prev_month_dates(month):
-    today = datetime.datetime.today() - datetime.timedelta(days=month)
-    prev_month_last_day = today.replace(day=1) - datetime.timedelta(days=1)
+    grid_utils.save_data(cell_colors_sums, country_ISO3, center, prev_month, grid)
 
-    return prev_month_last_day, str(prev_month_last_day.day)
 
+def sample_name(country, prev_month):
+    # Name of the sample of a country handed from the fetch to the grid stage
+    return f"search_logs_{prev_month.month}_{country}"
 
-def grid_process_main(country, countries_geos, centers_df, prev_month):
-    grid_sizes = [0.08, 0.022]  # [0.022, 0.1]
-    color_map = ["green", "yellow", "orange", "red"]
 
+def grid_process_main(country, reference, prev_month):
     print(f"Processing grid for : {country}....")
 
-    coordinates_df = pd.read_csv(
-        f"apps/searchHotspots/search-logs/search_logs_{prev_month.month}_{country}.csv"
+    country_ISO3 = pycountry.countries.get(alpha_2=country.lower()).alpha_3
+    center = reference.center(country)
+    grids = country_grids(country_ISO3, reference)
+    grids_sums = grid_backend().grid_sums(
+        sample_name(country, prev_month), list(grids.values()), country, prev_month
     )
-    coordinates_df.dropna(subset=["location"], inplace=True)
-    center = centers_df[centers_df["AFF_ISO"] == country][
-        ["latitude", "longitude"]
-    ].values.tolist()[0]
 
-    for grid_size in grid_sizes:
+    failed_grids = []
+    for grid in grids.values():
+        try:
+            save_grid_sums(country_ISO3, center, prev_month, grid, grids_sums[grid])
+
+        except Exception as e:
+            print(e)
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+            print(exc_type, fname, exc_tb.tb_lineno)
+            print(f"Error calculating grid {grid.name} for {country_ISO3}")
+            failed_grids.append(grid.name)
+
+    # The other grids are saved, the caller keeps the sample to grid the failed ones again
+    if failed_grids:
+        raise RuntimeError(f"Could not save grids {failed_grids} for {country_ISO3}")
+
+
+def grid_stream_main(countries, reference, prev_month, ago, params, pushdown=False):
+    """Fetches the search logs of a batch of countries and folds every day into the cell
+    sums of the grids of its country as soon as it arrives, so the gridding overlaps with
+    the queries still running and neither the raw sample nor its CSV are ever held in full.
+    With pushdown, ADX already sums the counts per cell and only returns the cells.
+
+    :return: The countries that could not be processed.
+    :rtype: list
+    """
+    print(f"Streaming grid for : {countries}....")
+    failed = []
+    units = {}
+    for country in countries:
         try:
             country_ISO3 = pycountry.countries.get(alpha_2=country.lower()).alpha_3
+            grids = country_grids(country_ISO3, reference)
+            units[country] = (country_ISO3, reference.center(country), grids)
+        except Exception as e:
+            print(e)
+            print(f"Could not create grids for {country}")
+            failed.append(country)
+
+    accumulators = {
+        country: grid_utils.GridAccumulator(grids.values())
+        for country, (_, _, grids) in units.items()
+    }
+    utils.address_components_sample_generator(
+        country_list=list(units),
+        end=prev_month,
+        ago=ago,
+        check_query=False,
+        accumulators=accumulators,
+        batch_size=len(units),
+        # The coarser Morton levels are rolled up locally from the finest one
+        pushdown_grids={
+            country: accumulator.binned_grids
+            for country, accumulator in accumulators.items()
+        }
+        if pushdown
+        else None,
+        **params,
+    )
 
-            lat_range, lon_range = grid_utils.getBoundingBox(
-                country_ISO3, countries_geos
+    for country, (country_ISO3, center, grids) in units.items():
+        for grid in grids.values():
+            try:
+                save_grid_sums(
+                    country_ISO3,
+                    center,
+                    prev_month,
+                    grid,
+                    accumulators[country].grid_sums(grid),
+                )
+            except Exception as e:
+                print(e)
+                print(f"Error calculating grid {grid.name} for {country_ISO3}")
+                if country not in failed:
+                    failed.append(country)
+    return failed
+
+
+def load_reference_data():
+    # Read-only reference data every country work unit needs. Forked pool workers
+    # inherit it from the main process instead of loading it again.
+    global reference
+    if reference is not None:
+        return
+    reference = reference_data.load_reference_data()
+
+
+def process_country(
+    countries_iso, prev_month_last_day, ago, params, stream=False, pushdown=False
+):
+    """Fetches, saves and grids the search logs of one country, or of a batch of countries
+    fetched with the same queries. It is the unit of work of the monthly run, executed
+    either in the main process or in a pool worker, and only reads the module level
+    reference data loaded by load_reference_data.
+
+    :param countries_iso: ISO-2 code of the country, or tuple of ISO-2 codes of a batch.
+    :type countries_iso: str or tuple
+    :param prev_month_last_day: Last day of the month to process.
+    :type prev_month_last_day: datetime.datetime
+    :param ago: Number of days to query back from prev_month_last_day.
+    :type ago: str
+    :param params: Extra keyword arguments for utils.address_components_sample_generator.
+    :type params: dict
+    :param stream: Whether to grid the days as they are fetched instead of saving the sample first.
+    :type stream: bool
+    :param pushdown: Whether ADX sums the counts per cell of the grids, implies stream.
+    :type pushdown: bool
+    :return: The countries that could not be processed.
+    :rtype: list
+    """
+    countries = list(utils.key_countries(countries_iso))
+    print(f"Getting records for {countries_iso}")
+    if stream or pushdown:
+        try:
+            return grid_stream_main(
+                countries,
+                reference,
+                prev_month_last_day,
+                ago,
+                params,
+                pushdown=pushdown,
             )
+        except Exception as e:
+            print(e)
+            print(f"Could not stream records for {countries_iso}")
+            return countries
+
+    try:
+        responses_dict_requests = utils.address_components_sample_generator(
+            country_list=countries,
+            end=prev_month_last_day,
+            ago=ago,
+            check_query=False,
+            batch_size=len(countries),
+            **params,
+        )
+    except Exception as e:
+        print(e)
+        print(f"Could not get records for {countries_iso}")
+        return countries
+
+    try:
+        # Hand the samples to the grid stage, a spilled sample is then only on disk
+        for country in list(responses_dict_requests):
+            stage_handoff.put(
+                sample_name(country, prev_month_last_day),
+                responses_dict_requests.pop(country),
+                spill=grid_backend().spill or SPILL_FORMAT,
+            )
+    except Exception as e:
+        print(e)
+        print(f"Could not save records for {countries_iso}")
+        return countries
 
-            grid = grid_utils.create_grid(lat_range, lon_range, grid_size)
+    failed = []
+    for country in countries:
+        try:
+            grid_process_main(country, reference, prev_month_last_day)
+            stage_handoff.drop(sample_name(country, prev_month_last_day))
 
-            grid_sums = grid_utils.get_grid_sums(
-                coordinates_df, lat_range, lon_range, grid_size
-            )
+        except Exception as e:
+            print(e)
+            print(f"Could not get create grid for {country}")
+            # Keep the spilled sample, if any, to grid it again
+            stage_handoff.release(sample_name(country, prev_month_last_day))
+            failed.append(country)
 
-            cell_colors_sums = grid_utils.color_grid_sums(grid, grid_sums, color_map)
+    return failed
 
-            print(f"processing save_data")
-            if country_ISO3 == "USA":
-                grid_utils.filter_by_region(
-                    cell_colors_sums, country_ISO3, center, prev_month, grid_size
-                )
 
-            grid_utils.save_data(
-                cell_colors_sums, country_ISO3, center, prev_month, grid_size
-            )
+def retract_country(country, month):
+    # Subtract an aggregated month from the totals of a country, and of its regions,
+    # on every grid of the country
+    country_ISO3 = pycountry.countries.get(alpha_2=country.lower()).alpha_3
+    names = [country_ISO3]
+    if country_ISO3 in grid_utils.REGION_DIRS:
+        regions = grid_utils.load_regions(grid_utils.REGION_DIRS[country_ISO3])
+        names.extend(f"{country_ISO3}_{name}" for name, _, _ in regions)
+
+    for grid in country_grids(country_ISO3, reference).values():
+        for name in names:
+            if not grid_utils.retract_data(name, grid, month):
+                print(f"{hotspot_store.month_key(month)} is not in the {grid.name} total of {name}")
 
+
+def retract_countries(country_ISOs, month):
+    """Subtracts a month that was already aggregated from the totals of every country,
+    like when its sample turned out to be wrong. The month can then be processed again.
+
+    :param month: Any date of the month to retract.
+    :type month: datetime.datetime
+    :return: The countries the month could not be retracted from.
+    :rtype: list
+    """
+    failed = []
+    for country in tqdm(country_ISOs):
+        try:
+            retract_country(country, month)
         except Exception as e:
             print(e)
-            exc_type, exc_obj, exc_tb = sys.exc_info()
-            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-            print(exc_type, fname, exc_tb.tb_lineno)
-            print(f"Error calculating grid for {country_ISO3}")
-
-        finally:
-            if os.path.exists(
-                f"apps/searchHotspots/search-logs/search_logs_{prev_month.month}_{country}.csv"
-            ):
-                os.remove(
-                    f"apps/searchHotspots/search-logs/search_logs_{prev_month.month}_{country}.csv"
+            print(f"Could not retract {hotspot_store.month_key(month)} from {country}")
+            failed.append(country)
+    return failed
+
+
+def month_arg(value):
+    # Month given on the command line as YYYY-MM
+    return datetime.datetime.strptime(value, "%Y-%m")
+
+
+def run_countries(
+    country_ISOs,
+    prev_month_last_day,
+    ago,
+    params,
+    workers=1,
+    stream=False,
+    batch_size=1,
+    pushdown=False,
+):
+    """Processes every country, one after another or in a bounded process pool.
+    Every country writes to its own db folders, so both modes produce the same outputs.
+
+    :param workers: Number of country batches processed concurrently, must be 1 on the spark backend.
+    :type workers: int
+    :param stream: Whether to grid the days of each country as they are fetched.
+    :type stream: bool
+    :param batch_size: Number of countries fetched with the same ADX queries.
+    :type batch_size: int
+    :param pushdown: Whether ADX sums the counts per cell of the grids, implies stream.
+    :type pushdown: bool
+    :return: The countries that could not be processed.
+    :rtype: list
+    """
+    if BACKEND == "spark" and workers > 1:
+        # Every pool process would start its own local Spark session with its own
+        # driver memory, Spark already runs the gridding in parallel
+        raise ValueError("The spark backend grids one country at a time, use --workers 1")
+
+    batches = utils.batch_countries(country_ISOs, batch_size)
+    if workers <= 1:
+        failed = []
+        for countries_iso in tqdm(batches):
+            failed.extend(
+                process_country(
+                    countries_iso,
+                    prev_month_last_day,
+                    ago,
+                    params,
+                    stream=stream,
+                    pushdown=pushdown,
                 )
-                print("file deleted")
-            continue
+            )
+        return failed
+
+    failed = []
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers, initializer=load_reference_data
+    ) as executor:
+        futures = {
+            executor.submit(
+                process_country,
+                countries_iso,
+                prev_month_last_day,
+                ago,
+                params,
+                stream=stream,
+                pushdown=pushdown,
+            ): countries_iso
+            for countries_iso in batches
+        }
+        for future in tqdm(
+            concurrent.futures.as_completed(futures), total=len(futures)
+        ):
+            countries_iso = futures[future]
+            try:
+                batch_failed = future.result()
+            except Exception as e:
+                # A crashed worker only fails its own batch
+                print(e)
+                batch_failed = list(utils.key_countries(countries_iso))
+            for country in batch_failed:
+                failed.append(country)
+                logging.info(f"Could not process {country}")
+    return failed
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Monthly search hotspots pipeline")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.environ.get("HOTSPOTS_WORKERS", 1)),
+        help="Number of country batches processed concurrently, 1 runs them sequentially",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        default=os.environ.get("HOTSPOTS_STREAM") == "1",
+        help="Grid the days of each country as they are fetched, without the sample CSV",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=int(os.environ.get("HOTSPOTS_BATCH_SIZE", 1)),
+        help="Number of countries fetched with the same ADX queries",
+    )
+    parser.add_argument(
+        "--pushdown",
+        action="store_true",
+        default=os.environ.get("HOTSPOTS_PUSHDOWN") == "1",
+        help="Sum the counts per grid cell in ADX, implies --stream",
+    )
+    parser.add_argument(
+        "--retract",
+        type=month_arg,
+        metavar="YYYY-MM",
+        help="Subtract an already aggregated month from the totals instead of processing a month",
+    )
+    args = parser.parse_args()
+    if BACKEND == "spark" and args.workers > 1:
+        parser.error("HOTSPOTS_BACKEND=spark only supports --workers 1")
+
+    if args.retract is not None:
+        load_reference_data()
+        failed = retract_countries(reference.countries, args.retract)
+        logging.info(
+            f"Retracted {hotspot_store.month_key(args.retract)}, failed countries: {failed}"
+        )
+        sys.exit()
+
     today = datetime.datetime.today()
     print(today.day)
     logging.info(f"Starting monthly script at {datetime.datetime.now()}")
@@ -146,12 +447,12 @@ if __name__ == "__main__":
     for month in [0]:
         prev_month_last_day, ago = prev_month_dates(month)
         print(prev_month_last_day, ago)
-        centers_df = pd.read_csv(
-            "apps/searchHotspots/data/countries_centers(clean).csv"
-        )
+
+        ####  Mapping and GeoJson files Load
+        load_reference_data()
 
         # country_ISOs = ["US"]
-        country_ISOs = centers_df["ISO"].unique().tolist()
+        country_ISOs = reference.countries
         endpoint_list = (
             None  # (  ## If you are using only 1 endpoint: 'search 2 search'
         )
@@ -166,52 +467,19 @@ if __name__ == "__main__":
             "search 2 poiSearch",
         )
 
-        for countries_iso in tqdm(country_ISOs):
-            print(f"Getting records for {countries_iso}")
-            try:
-                responses_dict_requests = utils.address_components_sample_generator(
-                    country_list=[countries_iso],
-                    end=prev_month_last_day,
-                    endpoint_list=endpoint_list,
-                    sample=sample,
-                    ago=ago,
-                    check_query=False,
-                    exclude_endpoint_list=exclude_endpoint,
-                )
-            except Exception as e:
-                print(e)
-                print(f"Could not get records for {countries_iso}")
-                continue
-
-            # for country in [countries_iso]:
-            #     responses_dict_requests[country] = parse_address_and_search_request(
-            #         responses_dict_requests[country]
-            #     )
-
-            try:
-                # Saving the sample
-                utils.general_dbfs_save_function_dict_of_countries(
-                    responses_dict_requests,
-                    "results",
-                    f"search_logs_{prev_month_last_day.month}",
-                )
-            except Exception as e:
-                print(e)
-                print(f"Could not save records for {countries_iso}")
-                continue
-
-            ####  Mapping and GeoJson files Load
-            countries_geos = geopandas.read_file(
-                "apps/searchHotspots/data/countries.geojson",
-                driver="GeoJSON",
-            )
-
-            try:
-                grid_process_main(
-                    countries_iso, countries_geos, centers_df, prev_month_last_day
-                )
-
-            except Exception as e:
-                print(e)
-                print(f"Could not get create grid for {countries_iso}")
-                continue
+        failed = run_countries(
+            country_ISOs,
+            prev_month_last_day,
+            ago,
+            {
+                "endpoint_list": endpoint_list,
+                "sample": sample,
+                "exclude_endpoint_list": exclude_endpoint,
+                "cache": FetchCache(FETCH_CACHE_DIR) if FETCH_CACHE_DIR else None,
+            },
+            workers=args.workers,
+            stream=args.stream,
+            batch_size=args.batch_size,
+            pushdown=args.pushdown,
+        )
+        logging.info(f"Finished monthly script, failed countries: {failed}")
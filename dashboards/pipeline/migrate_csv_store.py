@@ -0,0 +1,113 @@
+"""One-off migration of the stringified-tuple CSV hotspot tree to the columnar store.
+
+Run it from the dashboards folder, like the pipeline:
+
+    python pipeline/migrate_csv_store.py [--delete-csv]
+"""
+import argparse
+import ast
+import glob
+import os
+import re
+
+import geopandas
+import numpy as np
+import pandas as pd
+
+import grid_utils
+import hotspot_store
+
+GRID_SIZE_PATTERN = re.compile(r"_(\d+(?:\.\d+)?)\.csv$")
+# Month folders are named by hotspot_store.month_key
+MONTH_KEY_PATTERN = re.compile(r"\d{4}_\d{1,2}")
+
+
+def csv_to_cells(csv_path, grid):
+    """Converts a CSV with color, value and grid_bbox columns into cell ids of the grid.
+
+    :param csv_path: Path of the CSV to convert.
+    :type csv_path: str
+    :param grid: Grid the bboxes of the CSV were built from.
+    :type grid: GridSpec
+    :return: DataFrame with the cell_id, color and value columns.
+    :rtype: pd.DataFrame
+    """
+    df = pd.read_csv(csv_path)
+    bboxes = np.array(
+        [ast.literal_eval(bbox) for bbox in df["grid_bbox"]], dtype=np.float64
+    ).reshape(-1, 4)
+
+    # Recover the (row, col) of every cell from its lower-left corner
+    rows = np.round((bboxes[:, 0] - grid.lat_origin) / grid.cell_size).astype(np.int64)
+    cols = np.round((bboxes[:, 2] - grid.lon_origin) / grid.cell_size).astype(np.int64)
+    inside = grid.contains(rows, cols)
+    if not inside.all():
+        print(f"{csv_path}: dropping {(~inside).sum()} cells outside of {grid}")
+
+    return pd.DataFrame(
+        {
+            "cell_id": grid.cell_ids(rows[inside], cols[inside]),
+            "color": df["color"].values[inside],
+            "value": df["value"].values[inside],
+        },
+        columns=grid_utils.CELL_COLUMNS,
+    )
+
+
+def applied_months(csv_path, db_dir, country, grid_size):
+    # A total already includes every month folder holding a file of its grid size, as
+    # a CSV or as a month already migrated
+    if not os.path.basename(csv_path).startswith("total_"):
+        return None
+    months = set()
+    for extension in ["csv", hotspot_store.EXTENSION]:
+        for month_file in glob.glob(f"{db_dir}/{country}/*/*_{grid_size}.{extension}"):
+            month = os.path.basename(os.path.dirname(month_file))
+            if MONTH_KEY_PATTERN.fullmatch(month):
+                months.add(month)
+    return sorted(months)
+
+
+def migrate(db_dir, countries_geos, delete_csv=False):
+    for csv_path in sorted(glob.glob(f"{db_dir}/*/**/*.csv", recursive=True)):
+        match = GRID_SIZE_PATTERN.search(csv_path)
+        if match is None:
+            print(f"Skipping {csv_path}: no grid size in the file name")
+            continue
+
+        # Region folders like USA_Midwest share the grid of their country
+        country = os.path.relpath(csv_path, db_dir).split(os.sep)[0]
+        country_ISO3 = country.split("_")[0]
+        try:
+            lat_range, lon_range = grid_utils.getBoundingBox(country_ISO3, countries_geos)
+            grid = grid_utils.create_grid(lat_range, lon_range, float(match.group(1)))
+            cells = csv_to_cells(csv_path, grid)
+            hotspot_store.write_cells(
+                f"{csv_path[:-len('.csv')]}.{hotspot_store.EXTENSION}",
+                cells,
+                grid,
+                applied_months=applied_months(csv_path, db_dir, country, match.group(1)),
+            )
+        except Exception as e:
+            print(e)
+            print(f"Could not migrate {csv_path}")
+            continue
+
+        if delete_csv:
+            os.remove(csv_path)
+        print(f"{csv_path} migrated")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db-dir", default=hotspot_store.DB_DIR)
+    parser.add_argument(
+        "--countries-geojson", default="apps/searchHotspots/data/countries.geojson"
+    )
+    parser.add_argument(
+        "--delete-csv", action="store_true", help="Remove every CSV once migrated"
+    )
+    args = parser.parse_args()
+
+    countries_geos = geopandas.read_file(args.countries_geojson, driver="GeoJSON")
+    migrate(args.db_dir, countries_geos, delete_csv=args.delete_csv)
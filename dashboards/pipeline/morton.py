@@ -0,0 +1,193 @@
+import numpy as np
+
+# Masks used to interleave the bits of two 32 bits integers into a 64 bits key
+SPREAD_STEPS = [
+    (16, 0x0000FFFF0000FFFF),
+    (8, 0x00FF00FF00FF00FF),
+    (4, 0x0F0F0F0F0F0F0F0F),
+    (2, 0x3333333333333333),
+    (1, 0x5555555555555555),
+]
+COMPACT_STEPS = [
+    (1, 0x3333333333333333),
+    (2, 0x0F0F0F0F0F0F0F0F),
+    (4, 0x00FF00FF00FF00FF),
+    (8, 0x0000FFFF0000FFFF),
+    (16, 0x00000000FFFFFFFF),
+]
+
+
+def spread_bits(values):
+    # Insert a zero bit on the left of every bit of the 32 bits values
+    values = np.asarray(values, dtype=np.uint64) & np.uint64(0xFFFFFFFF)
+    for shift, mask in SPREAD_STEPS:
+        values = (values | (values << np.uint64(shift))) & np.uint64(mask)
+    return values
+
+
+def compact_bits(values):
+    # Inverse of spread_bits, keeps every other bit of the 64 bits values
+    values = np.asarray(values, dtype=np.uint64) & np.uint64(0x5555555555555555)
+    for shift, mask in COMPACT_STEPS:
+        values = (values | (values >> np.uint64(shift))) & np.uint64(mask)
+    return values
+
+
+def encode(x, y):
+    """Morton (Z-order) key of tile columns x and rows y, x on the even bits.
+
+    :rtype: np.ndarray of uint64
+    """
+    return spread_bits(x) | (spread_bits(y) << np.uint64(1))
+
+
+def decode(keys):
+    """Tile columns x and rows y of Morton keys.
+
+    :rtype: (np.ndarray, np.ndarray)
+    """
+    keys = np.asarray(keys, dtype=np.uint64)
+    x = compact_bits(keys).astype(np.int64)
+    y = compact_bits(keys >> np.uint64(1)).astype(np.int64)
+    return x, y
+
+
+class MortonGrid:
+    """Global tile grid of a Morton level. Tiles are squares of 360 / 2 ** level
+    degrees starting at (-90, -180), and cell ids are the Morton keys of the
+    tiles, so the parent of a cell at the previous level is its id >> 2.
+
+    It has the same interface as GridSpec, with rows as tile rows (y) and cols
+    as tile columns (x).
+    """
+
+    __slots__ = ("level",)
+
+    # cell_index floors the tile offsets
+    rounding = "floor"
+
+    def __init__(self, level):
+        self.level = int(level)
+
+    def __repr__(self):
+        return f"MortonGrid(level={self.level})"
+
+    def __eq__(self, other):
+        if not isinstance(other, MortonGrid):
+            return NotImplemented
+        return self.level == other.level
+
+    def __hash__(self):
+        return hash(("morton", self.level))
+
+    @property
+    def name(self):
+        return f"morton{self.level}"
+
+    @property
+    def cell_size(self):
+        return 360.0 / 2 ** self.level
+
+    @property
+    def lat_origin(self):
+        return -90.0
+
+    @property
+    def lon_origin(self):
+        return -180.0
+
+    @property
+    def rows(self):
+        return 2 ** max(self.level - 1, 0)
+
+    @property
+    def cols(self):
+        return 2 ** self.level
+
+    @property
+    def shape(self):
+        return self.rows, self.cols
+
+    def lat_edges(self):
+        return self.lat_origin + np.arange(self.rows + 1) * self.cell_size
+
+    def lon_edges(self):
+        return self.lon_origin + np.arange(self.cols + 1) * self.cell_size
+
+    def contains(self, rows, cols):
+        rows, cols = np.asarray(rows), np.asarray(cols)
+        return (rows >= 0) & (rows < self.rows) & (cols >= 0) & (cols < self.cols)
+
+    def cell_index(self, lats, lons):
+        # (row, col) of the tile holding each coordinate
+        rows = np.floor((np.asarray(lats) - self.lat_origin) / self.cell_size)
+        cols = np.floor((np.asarray(lons) - self.lon_origin) / self.cell_size)
+        return rows.astype(np.int64), cols.astype(np.int64)
+
+    def cell_bbox(self, rows, cols):
+        # (lat_min, lat_max, lon_min, lon_max) of the tiles, vectorized over arrays
+        rows, cols = np.asarray(rows), np.asarray(cols)
+        lat_min = self.lat_origin + rows * self.cell_size
+        lon_min = self.lon_origin + cols * self.cell_size
+        bbox = lat_min, lat_min + self.cell_size, lon_min, lon_min + self.cell_size
+        if rows.ndim == 0 and cols.ndim == 0:
+            return tuple(float(bound) for bound in bbox)
+        return bbox
+
+    def cell_ids(self, rows, cols):
+        return encode(cols, rows)
+
+    def cell_rowcol(self, cell_ids):
+        cols, rows = decode(cell_ids)
+        return rows, cols
+
+    def cell_bounds(self, cell_ids):
+        return self.cell_bbox(*self.cell_rowcol(cell_ids))
+
+    def coarsen(self, factor):
+        # Grid of the level factor times coarser, factor must be a power of 2
+        levels = int(factor).bit_length() - 1
+        if factor != 2 ** levels or levels > self.level:
+            raise ValueError(f"Cannot coarsen level {self.level} by {factor}")
+        return MortonGrid(self.level - levels)
+
+    def to_dict(self):
+        return {"kind": "morton", "level": self.level}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["level"])
+
+
+def sum_by_key(keys, values):
+    # Sorted unique keys and the sum of the values of each key
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    sums = np.bincount(inverse, weights=values, minlength=len(unique_keys))
+    return unique_keys, np.round(sums).astype(np.int64)
+
+
+def roll_up(keys, values, from_level, to_level):
+    """Sums the values of Morton keys of a level into the keys of a coarser level.
+
+    :rtype: (np.ndarray, np.ndarray)
+    """
+    if to_level > from_level:
+        raise ValueError(f"Cannot roll up level {from_level} into finer level {to_level}")
+    parents = np.asarray(keys, dtype=np.uint64) >> np.uint64(2 * (from_level - to_level))
+    return sum_by_key(parents, values)
+
+
+def split_pyramid(grids):
+    """Splits grids into the grids binned from the points and the Morton levels rolled
+    up from the finest Morton level among them, so the points are only binned once for
+    the whole pyramid.
+
+    :return: The grids to bin, and a dictionary with the rolled up grids as keys and the
+        grid they are rolled up from as values.
+    :rtype: (list, dict)
+    """
+    levels = sorted(
+        (grid for grid in grids if isinstance(grid, MortonGrid)), key=lambda grid: grid.level
+    )
+    binned = [grid for grid in grids if not isinstance(grid, MortonGrid)] + levels[-1:]
+    return binned, {grid: levels[-1] for grid in levels[:-1]}
@@ -0,0 +1,107 @@
+import json
+import os
+
+import geopandas
+import pandas as pd
+
+from auxiliary_functions.atomic_files import atomic_write
+
+REFERENCE_DIR = "apps/searchHotspots/data"
+COUNTRIES_GEOJSON = f"{REFERENCE_DIR}/countries.geojson"
+CENTERS_CSV = f"{REFERENCE_DIR}/countries_centers(clean).csv"
+PACK_PATH = f"{REFERENCE_DIR}/reference_pack.json"
+
+
+class ReferenceData:
+    """Reference data of the countries, indexed by ISO code for O(1) lookups:
+    the bounding box by ISO-3 code and the center coordinates by ISO-2 code.
+    """
+
+    __slots__ = ("bounding_boxes", "centers", "countries")
+
+    def __init__(self, bounding_boxes, centers, countries):
+        self.bounding_boxes = bounding_boxes
+        self.centers = centers
+        self.countries = countries
+
+    def bounding_box(self, country_ISO3):
+        """Same lat_range and lon_range as grid_utils.getBoundingBox.
+
+        :rtype: (list, list)
+        """
+        if country_ISO3 not in self.bounding_boxes:
+            raise ValueError(f"Country not found in the geojson: {country_ISO3}")
+        lat_range, lon_range = self.bounding_boxes[country_ISO3]
+        return list(lat_range), list(lon_range)
+
+    def center(self, country_ISO2):
+        """[latitude, longitude] of the country center.
+
+        :rtype: list
+        """
+        if country_ISO2 not in self.centers:
+            raise ValueError(f"Country not found in the centers: {country_ISO2}")
+        return list(self.centers[country_ISO2])
+
+    def to_dict(self):
+        return {attr: getattr(self, attr) for attr in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(*(data[attr] for attr in cls.__slots__))
+
+
+def source_fingerprint(paths):
+    # Size and modification time of the source files the pack is built from
+    return [[path, os.path.getsize(path), os.stat(path).st_mtime_ns] for path in paths]
+
+
+def build_reference_data(countries_geojson=COUNTRIES_GEOJSON, centers_csv=CENTERS_CSV):
+    """Builds the reference data from the countries GeoJSON and the centers CSV.
+
+    :rtype: ReferenceData
+    """
+    countries_geos = geopandas.read_file(countries_geojson, driver="GeoJSON")
+    bounding_boxes = {}
+    for country_ISO3, geometry in zip(countries_geos["ISO_A3"], countries_geos.geometry):
+        # Keep the first feature of each country, like getBoundingBox
+        if geometry is None or country_ISO3 in bounding_boxes:
+            continue
+        min_x, min_y, max_x, max_y = geometry.bounds
+        bounding_boxes[country_ISO3] = [
+            [round(min_y, 4), round(max_y, 4)],
+            [round(min_x, 4), round(max_x, 4)],
+        ]
+
+    centers_df = pd.read_csv(centers_csv)
+    centers = {}
+    for country_ISO2, lat, lon in zip(
+        centers_df["AFF_ISO"], centers_df["latitude"], centers_df["longitude"]
+    ):
+        centers.setdefault(country_ISO2, [lat, lon])
+
+    return ReferenceData(
+        bounding_boxes, centers, centers_df["ISO"].unique().tolist()
+    )
+
+
+def load_reference_data(
+    pack_path=PACK_PATH, countries_geojson=COUNTRIES_GEOJSON, centers_csv=CENTERS_CSV
+):
+    """Loads the reference data from its cached pack, which is only rebuilt when the
+    GeoJSON or the CSV it was built from changed.
+
+    :rtype: ReferenceData
+    """
+    fingerprint = source_fingerprint([countries_geojson, centers_csv])
+    if os.path.exists(pack_path):
+        with open(pack_path) as infile:
+            pack = json.load(infile)
+        if pack["sources"] == fingerprint:
+            return ReferenceData.from_dict(pack["data"])
+
+    reference = build_reference_data(countries_geojson, centers_csv)
+    with atomic_write(pack_path) as tmp_path:
+        with open(tmp_path, "w") as outfile:
+            json.dump({"sources": fingerprint, "data": reference.to_dict()}, outfile)
+    return reference
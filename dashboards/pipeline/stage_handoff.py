@@ -0,0 +1,108 @@
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from auxiliary_functions.atomic_files import atomic_write
+
+SPILL_DIR = "apps/searchHotspots/search-logs"
+SPILL_FORMATS = {"arrow", "parquet"}
+
+# Tables handed from one stage to the next in this process, by name
+tables = {}
+
+
+def spill_path(name, spill_format, spill_dir=SPILL_DIR):
+    return f"{spill_dir}/{name}.{spill_format}"
+
+
+def put(name, df, spill=None, spill_dir=SPILL_DIR):
+    """Hands a DataFrame to the next stage as a typed Arrow table kept in memory, or
+    spilled to disk so it survives the process. A spilled table is not kept in memory,
+    the next stage reads it back from its spill file.
+
+    :param name: Name the next stage gets the table with.
+    :type name: str
+    :param df: DataFrame or Arrow table to hand over.
+    :type df: pd.DataFrame or pa.Table
+    :param spill: "arrow" to spill to an Arrow IPC file, "parquet" to a Parquet file, None to keep it in memory.
+    :type spill: str or None
+    :rtype: pa.Table
+    """
+    if spill is not None and spill not in SPILL_FORMATS:
+        raise ValueError(f"Unknown spill format: {spill}")
+    table = df if isinstance(df, pa.Table) else pa.Table.from_pandas(df, preserve_index=False)
+    if spill is None:
+        tables[name] = table
+    else:
+        # Released so the spill file, and not a stale table or spill, is read back
+        tables.pop(name, None)
+        for spill_format in SPILL_FORMATS - {spill}:
+            stale_path = spill_path(name, spill_format, spill_dir)
+            if os.path.exists(stale_path):
+                os.remove(stale_path)
+        path = spill_path(name, spill, spill_dir)
+        os.makedirs(spill_dir, exist_ok=True)
+        with atomic_write(path) as tmp_path:
+            if spill == "arrow":
+                with pa.OSFile(tmp_path, "wb") as sink:
+                    with pa.ipc.new_file(sink, table.schema) as writer:
+                        writer.write_table(table)
+            else:
+                pq.write_table(table, tmp_path)
+    return table
+
+
+def get(name, spill_dir=SPILL_DIR):
+    """Gets a handed over table from memory, or from its spill file when it was
+    handed over by another process. Arrow IPC spills are memory-mapped.
+
+    :rtype: pa.Table
+    """
+    if name in tables:
+        return tables[name]
+
+    arrow_path = spill_path(name, "arrow", spill_dir)
+    if os.path.exists(arrow_path):
+        return pa.ipc.open_file(pa.memory_map(arrow_path, "r")).read_all()
+    parquet_path = spill_path(name, "parquet", spill_dir)
+    if os.path.exists(parquet_path):
+        return pq.read_table(parquet_path)
+    raise KeyError(f"No table handed over as {name}")
+
+
+def iter_batches(name, columns=None, chunk_size=1_000_000, spill_dir=SPILL_DIR):
+    """Iterates over a handed over table in record batches of up to chunk_size rows,
+    reading only the given columns. A Parquet spill is read one batch at a time and an
+    Arrow IPC spill is memory-mapped, so neither is loaded in memory at once.
+
+    :param columns: Names of the columns to read, defaults to None which reads them all.
+    :type columns: list or None
+    :rtype: typing.Iterator[pa.RecordBatch]
+    """
+    parquet_path = spill_path(name, "parquet", spill_dir)
+    in_file = name not in tables and not os.path.exists(spill_path(name, "arrow", spill_dir))
+    if in_file and os.path.exists(parquet_path):
+        yield from pq.ParquetFile(parquet_path).iter_batches(
+            batch_size=chunk_size, columns=columns
+        )
+        return
+
+    table = get(name, spill_dir=spill_dir)
+    if columns is not None:
+        table = table.select(columns)
+    yield from table.to_batches(max_chunksize=chunk_size)
+
+
+def release(name):
+    # Release the in-memory table, keeping its spill files
+    tables.pop(name, None)
+
+
+def drop(name, spill_dir=SPILL_DIR):
+    # Release the table and remove its spill files
+    tables.pop(name, None)
+    for spill_format in SPILL_FORMATS:
+        path = spill_path(name, spill_format, spill_dir)
+        if os.path.exists(path):
+            os.remove(path)
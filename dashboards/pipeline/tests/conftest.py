@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The pipeline modules are imported like in the pipeline scripts, from the pipeline folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,78 @@
+import pandas as pd
+
+from auxiliary_functions import address_flattening
+from auxiliary_functions.address_flattening import flatten_addresses
+
+
+def test_string_components():
+    addresses = pd.Series(
+        ['{"streetName": "Gran Via", "postalCode": "28013"}', None, ""], index=[5, 6, 7]
+    )
+    flat = flatten_addresses(addresses, ("streetName", "postalCode"))
+
+    assert list(flat.index) == [5, 6, 7]
+    assert flat.loc[5].tolist() == ["Gran Via", "28013"]
+    assert flat.loc[6].isna().all() and flat.loc[7].isna().all()
+
+
+def test_mixed_type_components():
+    addresses = pd.Series(
+        [
+            '{"streetName": "Gran Via", "postalCode": 28013}',
+            '{"streetName": "Calle Mayor", "postalCode": "28001"}',
+            '{"streetNumber": 12.5, "postalCode": null, "extra": [1, 2]}',
+            '{"streetName": true}',
+        ]
+    )
+    flat = flatten_addresses(addresses, ("streetName", "streetNumber", "postalCode"))
+
+    assert flat["postalCode"].tolist()[:2] == ["28013", "28001"]
+    assert pd.isna(flat.loc[2, "postalCode"])
+    assert flat.loc[2, "streetNumber"] == "12.5"
+    assert flat["streetName"].tolist()[:2] == ["Gran Via", "Calle Mayor"]
+    assert pd.isna(flat.loc[2, "streetName"])
+    assert flat.loc[3, "streetName"] == "true"
+
+
+def test_mixed_types_only_affect_their_chunk():
+    addresses = pd.Series(['{"postalCode": "28013"}', '{"postalCode": 28001}'])
+    flat = flatten_addresses(addresses, ("postalCode",), chunk_size=1)
+
+    assert flat["postalCode"].tolist() == ["28013", "28001"]
+
+
+def test_components_of_one_kind_keep_the_bulk_path(monkeypatch):
+    def parse_component_rows(lines, name):
+        raise AssertionError(f"{name} was parsed address by address")
+
+    monkeypatch.setattr(address_flattening, "parse_component_rows", parse_component_rows)
+    addresses = pd.Series(
+        [
+            '{"streetName": "Gran Via", "postalCode": 28013, "streetNumber": 12.5}',
+            '{"streetName": "Calle Mayor", "postalCode": 28001, "streetNumber": 3}',
+            '{"streetName": "Alcala", "postalCode": null}',
+            '[]',
+        ]
+    )
+    flat = flatten_addresses(addresses, ("streetName", "postalCode", "streetNumber"))
+
+    assert flat["streetName"].tolist()[:3] == ["Gran Via", "Calle Mayor", "Alcala"]
+    assert flat["postalCode"].tolist()[:2] == ["28013", "28001"]
+    assert flat["streetNumber"].tolist()[:2] == ["12.5", "3"]
+    assert flat.loc[2:].isna().sum().sum() == 5
+
+
+def test_only_the_components_mixing_kinds_are_parsed_address_by_address(monkeypatch):
+    parsed = []
+    parse_component_rows = address_flattening.parse_component_rows
+
+    def record_component_rows(lines, name):
+        parsed.append(name)
+        return parse_component_rows(lines, name)
+
+    monkeypatch.setattr(address_flattening, "parse_component_rows", record_component_rows)
+    addresses = pd.Series(['{"streetName": "Gran Via", "postalCode": 28013}', '{"postalCode": "28001"}'])
+    flat = flatten_addresses(addresses, ("streetName", "postalCode"))
+
+    assert parsed == ["postalCode"]
+    assert flat["postalCode"].tolist() == ["28013", "28001"]
@@ -0,0 +1,85 @@
+import threading
+import time
+from datetime import timedelta
+
+import pytest
+from azure.kusto.data import ClientRequestProperties
+
+from auxiliary_functions import adx_fetch
+
+
+class FlakyClient:
+    # Stand-in for a KustoClient whose queries fail `failures` times before they succeed
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def execute(self, database, query, properties):
+        with self.lock:
+            self.calls.append((time.monotonic(), database, query, properties))
+            if len(self.calls) <= self.failures:
+                raise ConnectionError(f"attempt {len(self.calls)} failed")
+        return query.upper()
+
+
+@pytest.fixture
+def no_jitter(monkeypatch):
+    monkeypatch.setattr(adx_fetch.random, "uniform", lambda low, high: 1.0)
+
+
+def gaps(calls):
+    times = [call[0] for call in calls]
+    return [after - before for before, after in zip(times, times[1:])]
+
+
+def test_failed_queries_are_retried_with_exponential_backoff(no_jitter):
+    client = FlakyClient(failures=2)
+    with adx_fetch.FetchEngine(client, "db", retries=3, backoff=0.05, timeout=None) as engine:
+        assert engine.execute("query") == "QUERY"
+
+    assert len(client.calls) == 3
+    first, second = gaps(client.calls)
+    assert first >= 0.05
+    assert second >= 0.1
+
+
+def test_last_error_is_raised_once_retries_are_exhausted(no_jitter):
+    client = FlakyClient(failures=10)
+    with adx_fetch.FetchEngine(client, "db", retries=2, backoff=0.01, timeout=None) as engine:
+        with pytest.raises(ConnectionError, match="attempt 3 failed"):
+            engine.execute("query")
+    assert len(client.calls) == 3
+
+
+def test_fetch_reports_the_exhausted_queries_as_errors(no_jitter):
+    client = FlakyClient(failures=1)
+    with adx_fetch.FetchEngine(client, "db", max_workers=1, retries=0, timeout=None) as engine:
+        results = sorted(engine.fetch([("ES", "a"), ("PT", "b")], decode=lambda response: response))
+
+    assert [(key, status) for key, status, _ in results] == [("ES", "error"), ("PT", "success")]
+    assert isinstance(results[0][2], ConnectionError)
+    assert results[1][2] == "B"
+
+
+def test_queries_run_with_the_server_side_timeout():
+    client = FlakyClient()
+    with adx_fetch.FetchEngine(client, "db", timeout=30) as engine:
+        engine.execute("query")
+
+    properties = client.calls[0][3]
+    assert isinstance(properties, ClientRequestProperties)
+    assert properties.get_option(ClientRequestProperties.request_timeout_option_name, None) == timedelta(
+        seconds=30
+    )
+
+
+def test_rate_limiter_spaces_the_calls_of_every_thread():
+    client = FlakyClient()
+    with adx_fetch.FetchEngine(client, "db", max_workers=4, rate_limit=20, timeout=None) as engine:
+        for future in [engine.submit(str(i), decode=lambda response: response) for i in range(6)]:
+            future.result()
+
+    assert len(client.calls) == 6
+    # Bursts of one query, then one query every 1 / 20 seconds
+    assert min(gaps(sorted(client.calls))) >= 0.045
@@ -0,0 +1,38 @@
+import os
+
+import pytest
+
+from auxiliary_functions.atomic_files import atomic_write
+
+
+def test_file_is_replaced_once_written(tmp_path):
+    path = str(tmp_path / "total.arrow")
+    with open(path, "w") as sink:
+        sink.write("old")
+
+    with atomic_write(path) as tmp:
+        with open(tmp, "w") as sink:
+            sink.write("new")
+        with open(path) as source:
+            assert source.read() == "old"
+
+    with open(path) as source:
+        assert source.read() == "new"
+    assert os.listdir(tmp_path) == ["total.arrow"]
+
+
+def test_failed_write_keeps_the_file_and_removes_the_temporary_one(tmp_path):
+    path = str(tmp_path / "export.fgb")
+    with open(path, "w") as sink:
+        sink.write("old")
+
+    with pytest.raises(RuntimeError):
+        with atomic_write(path, suffix=".fgb") as tmp:
+            assert tmp.endswith(".fgb")
+            with open(tmp, "w") as sink:
+                sink.write("partial")
+            raise RuntimeError("write failed")
+
+    with open(path) as source:
+        assert source.read() == "old"
+    assert os.listdir(tmp_path) == ["export.fgb"]
@@ -0,0 +1,58 @@
+import os
+
+import numpy as np
+
+import cells_cache
+
+
+def load(path, scale=1):
+    load.calls += 1
+    with open(path) as source:
+        return np.full(100, int(source.read()) * scale, dtype=np.int64)
+
+
+load.calls = 0
+
+
+def write(path, value, mtime_ns):
+    with open(path, "w") as sink:
+        sink.write(str(value))
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_values_are_loaded_once_per_data_version(tmp_path):
+    path = str(tmp_path / "total.arrow")
+    write(path, 1, 10 ** 18)
+    cache = cells_cache.CellsCache()
+    load.calls = 0
+
+    assert cache.get(path, load)[0] == 1
+    assert cache.get(path, load)[0] == 1
+    assert load.calls == 1
+
+    write(path, 2, 2 * 10 ** 18)
+    assert cache.get(path, load)[0] == 2
+    assert load.calls == 2
+
+
+def test_loader_arguments_are_part_of_the_key(tmp_path):
+    path = str(tmp_path / "total.arrow")
+    write(path, 3, 10 ** 18)
+    cache = cells_cache.CellsCache()
+
+    assert cache.get(path, load)[0] == 3
+    assert cache.get(path, load, 2)[0] == 6
+    assert len(cache.entries) == 2
+
+
+def test_least_recently_used_values_are_evicted_above_max_bytes(tmp_path):
+    paths = [str(tmp_path / f"total_{i}.arrow") for i in range(3)]
+    for i, path in enumerate(paths):
+        write(path, i, 10 ** 18)
+    # Room for two arrays of 100 int64
+    cache = cells_cache.CellsCache(max_bytes=1600)
+
+    for path in paths:
+        cache.get(path, load)
+    assert [key[0] for key in cache.entries] == paths[1:]
+    assert cache.nbytes == 1600
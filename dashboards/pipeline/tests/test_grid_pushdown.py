@@ -0,0 +1,107 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+import grid_utils
+import morton
+from auxiliary_functions.grid_pushdown import cell_summary_kql, evaluate_cell_summary
+from grid_spec import GridSpec
+
+SPAIN = GridSpec(36.0, -9.3, 0.08, 100, 200)
+# Grid crossing the equator and the prime meridian, so cells have negative offsets
+EQUATOR = GridSpec(-1.0, -1.0, 0.5, 4, 4)
+
+GOLDEN_KQL = [
+    "| extend lat = todouble(parse_json(location).lat), lon = todouble(parse_json(location).lon)",
+    "| where isfinite(lat) and isfinite(lon)",
+    "| join kind=inner (",
+    "datatable(countryCode:string, grid:string, lat_origin:real, lon_origin:real, cell_size:real, "
+    "rows:long, cols:long, truncate:bool)",
+    "['ES', '0.08', real(36.0), real(-9.3), real(0.08), long(100), long(200), true, "
+    "'ES', 'morton12', real(-90.0), real(-180.0), real(0.087890625), long(2048), long(4096), false]",
+    ") on countryCode",
+    "| extend row_offset = (lat - lat_origin) / cell_size, col_offset = (lon - lon_origin) / cell_size",
+    "| extend grid_row = tolong(iff(truncate and row_offset < 0, -floor(-row_offset, 1), "
+    "floor(row_offset, 1))), grid_col = tolong(iff(truncate and col_offset < 0, "
+    "-floor(-col_offset, 1), floor(col_offset, 1)))",
+    "| where grid_row >= 0 and grid_row < rows and grid_col >= 0 and grid_col < cols",
+    "| summarize search_query_counts = sum(search_query_counts) by countryCode, grid, grid_row, grid_col",
+]
+
+
+def test_cell_summary_kql_golden():
+    kql = cell_summary_kql({"ES": [SPAIN, morton.MortonGrid(12)]})
+    assert [line.strip() for line in kql.strip().splitlines()] == GOLDEN_KQL
+
+
+def sample(lats, lons, counts, country="XX"):
+    return pd.DataFrame(
+        {
+            "countryCode": country,
+            "location": [json.dumps({"lat": lat, "lon": lon}) for lat, lon in zip(lats, lons)],
+            "search_query_counts": np.asarray(counts, dtype=np.int64),
+        }
+    )
+
+
+def pushdown_sums(df, grids):
+    # Cells of the local evaluation of the KQL, folded like the pushdown responses
+    accumulator = grid_utils.GridAccumulator(grids)
+    accumulator.add(evaluate_cell_summary(df, {"XX": grids}).drop(columns="countryCode"))
+    return accumulator
+
+
+def local_sums(df, grids):
+    accumulator = grid_utils.GridAccumulator(grids)
+    accumulator.add(df)
+    return accumulator
+
+
+def as_dict(sums):
+    return dict(zip(sums.index.tolist(), sums.values.tolist()))
+
+
+def test_pushdown_matches_local_binning_on_edges_and_negative_offsets():
+    # Points on the cell edges, and within a cell of the origin on the negative side,
+    # where truncating and flooring the offsets give different cells
+    lats = [-1.0, -0.5, 0.0, 0.25, -1.2, -0.75, 0.999, 1.0, -0.3]
+    lons = [-1.0, 0.0, -0.5, 0.75, -0.8, -1.3, 0.5, 0.999, -0.3]
+    counts = [1, 2, 3, 4, 5, 6, 7, 8, 9]
+    grids = [EQUATOR, morton.MortonGrid(10), morton.MortonGrid(8)]
+    df = sample(lats, lons, counts)
+
+    pushdown, local = pushdown_sums(df, grids), local_sums(df, grids)
+    for grid in grids:
+        assert as_dict(pushdown.grid_sums(grid)) == as_dict(local.grid_sums(grid))
+
+    # Truncating puts (-1.2, -0.8) and (-0.75, -1.3) in the first cell of the degree
+    # grid with (-1.0, -1.0), like int() did
+    assert as_dict(local.grid_sums(EQUATOR))[(0, 0)] == 1 + 5 + 6
+
+
+def test_pushdown_matches_bin_grid_sums_on_random_points():
+    rng = np.random.default_rng(0)
+    lats = rng.uniform(35.0, 45.0, 3000).round(4)
+    lons = rng.uniform(-10.0, 5.0, 3000).round(4)
+    counts = rng.integers(1, 20, 3000)
+    df = sample(lats, lons, counts)
+
+    expected = grid_utils.bin_grid_sums(
+        lats, lons, counts, (SPAIN.lat_origin, None), (SPAIN.lon_origin, None), SPAIN.cell_size
+    )
+    rows, cols = np.array(expected.index.tolist()).T
+    inside = SPAIN.contains(rows, cols)
+    expected = {
+        cell: value for cell, value, keep in zip(expected.index, expected.values, inside) if keep
+    }
+    assert as_dict(pushdown_sums(df, [SPAIN]).grid_sums(SPAIN)) == expected
+
+
+def test_pushdown_keeps_the_countries_apart():
+    df = pd.concat([sample([40.0], [-3.0], [5], "ES"), sample([40.0], [-3.0], [7], "PT")])
+    cells = evaluate_cell_summary(df, {"ES": [SPAIN], "PT": [SPAIN]})
+    assert sorted(zip(cells["countryCode"], cells["search_query_counts"])) == [
+        ("ES", 5),
+        ("PT", 7),
+    ]
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+import grid_utils
+import morton
+from grid_spec import GridSpec
+
+
+def random_points(seed, size=2000):
+    rng = np.random.default_rng(seed)
+    lats = rng.uniform(-60.0, 60.0, size)
+    lons = rng.uniform(-170.0, 170.0, size)
+    counts = rng.integers(1, 50, size).astype(np.uint32)
+    return lats, lons, counts
+
+
+def direct_sums(grid, lats, lons, counts):
+    # Per-cell sums of a grid binned on its own from the points
+    rows, cols = grid.cell_index(lats, lons)
+    inside = grid.contains(rows, cols)
+    index = pd.MultiIndex.from_arrays([rows[inside], cols[inside]])
+    return pd.Series(counts[inside].astype(np.int64), index=index).groupby(level=[0, 1]).sum()
+
+
+def assert_same_sums(sums, expected):
+    assert dict(zip(sums.index.tolist(), sums.values.tolist())) == dict(
+        zip(expected.index.tolist(), expected.values.tolist())
+    )
+
+
+def test_accumulator_only_bins_the_finest_morton_level():
+    grids = [morton.MortonGrid(6), GridSpec(-60.0, -170.0, 5.0, 24, 68), morton.MortonGrid(9)]
+    accumulator = grid_utils.GridAccumulator(grids)
+    assert accumulator.binned_grids == [grids[1], grids[2]]
+    assert accumulator.rolled_up == {grids[0]: grids[2]}
+
+
+def test_rolled_up_levels_match_binning_every_level():
+    grids = [morton.MortonGrid(level) for level in (5, 7, 10)]
+    accumulator = grid_utils.GridAccumulator(grids)
+    # Folded in two chunks, like the chunked and streaming paths
+    for seed in (0, 1):
+        accumulator.add_coordinates(*random_points(seed))
+
+    lats, lons, counts = (
+        np.concatenate(arrays) for arrays in zip(random_points(0), random_points(1))
+    )
+    for grid in grids:
+        assert_same_sums(accumulator.grid_sums(grid), direct_sums(grid, lats, lons, counts))
+
+
+def test_pushdown_rows_of_rolled_up_levels_are_ignored():
+    grids = [morton.MortonGrid(4), morton.MortonGrid(6)]
+    accumulator = grid_utils.GridAccumulator(grids)
+    accumulator.add_cells(
+        pd.DataFrame(
+            {
+                "grid": ["morton6", "morton6", "morton4"],
+                "grid_row": [0, 1, 0],
+                "grid_col": [0, 1, 0],
+                "search_query_counts": [3, 4, 100],
+            }
+        )
+    )
+    assert accumulator.grid_sums(grids[0]).tolist() == [7]
+    assert accumulator.grid_sums(grids[1]).tolist() == [3, 4]
+
+
+def test_points_on_cell_edges_are_counted_once():
+    grid = GridSpec(40.0, -4.0, 0.5, 2, 2)
+    # On an inner edge, on the outer edges of the origin and past the last edges
+    lats = np.array([40.5, 40.25, 40.0, 41.0, 40.25])
+    lons = np.array([-3.75, -3.5, -4.0, -3.75, -3.0])
+    counts = np.array([1, 2, 4, 8, 16])
+    sums = grid_utils.bin_grid_sums(lats, lons, counts, (40.0, 41.0), (-4.0, -3.0), 0.5)
+    cells = grid_utils.color_grid_sums(grid, sums, ["green", "yellow", "orange", "red"])
+
+    # A point on an edge shared by two cells only goes to the cell after it, and the
+    # points on the last edges fall outside the grid
+    assert sorted(zip(cells["cell_id"].tolist(), cells["value"].tolist())) == [
+        (0, 4),
+        (1, 2),
+        (2, 1),
+    ]
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import hotspot_index
+import hotspot_store
+from grid_spec import GridSpec
+
+GRID = GridSpec(40.0, -4.0, 1.0, 10, 10)
+# (row, col) and value of every cell
+CELLS = {(0, 0): 5, (0, 9): 1, (2, 3): 40, (2, 4): 20, (3, 3): 30, (9, 9): 7}
+
+
+@pytest.fixture
+def cell_index():
+    rows, cols = np.array(list(CELLS)).T
+    cells = pd.DataFrame(
+        {
+            "cell_id": GRID.cell_ids(rows, cols),
+            "value": np.array(list(CELLS.values()), dtype=np.uint64),
+            "color": pd.Categorical(["green", "green", "red", "yellow", "orange", None]),
+        }
+    )
+    # Shuffled, the index sorts the cells itself
+    return hotspot_index.CellIndex(
+        hotspot_store.to_table(cells.iloc[[3, 0, 5, 2, 1, 4]], GRID), GRID
+    )
+
+
+def rowcols(cell_index, positions):
+    return sorted(zip(cell_index.rows[positions].tolist(), cell_index.cols[positions].tolist()))
+
+
+def test_window_returns_the_intersecting_cells(cell_index):
+    # Rows 2 to 3 and cols 3 to 4 of the grid
+    positions = cell_index.window(42.5, 43.5, -0.5, 0.5)
+    assert rowcols(cell_index, positions) == [(2, 3), (2, 4), (3, 3)]
+
+
+def test_window_without_cells(cell_index):
+    assert len(cell_index.window(45.2, 45.8, -3.8, -3.2)) == 0
+
+
+def test_point_finds_the_cell_of_a_coordinate(cell_index):
+    position = cell_index.point(42.5, -0.5)
+    assert rowcols(cell_index, [position]) == [(2, 3)]
+    assert cell_index.values[position] == 40
+
+
+def test_point_outside_of_the_cells(cell_index):
+    assert cell_index.point(41.5, -3.5) is None
+    assert cell_index.point(60.0, -3.5) is None
+
+
+def test_top_returns_the_hottest_cells_first(cell_index):
+    assert cell_index.values[cell_index.top(3)].tolist() == [40, 30, 20]
+    assert len(cell_index.top(0)) == 0
+    assert len(cell_index.top(100)) == len(CELLS)
+
+
+def test_top_among_a_window(cell_index):
+    positions = cell_index.window(39.0, 41.0, -5.0, 6.0)
+    assert cell_index.values[cell_index.top(1, positions)].tolist() == [5]
+
+
+def test_records(cell_index):
+    table = cell_index.records([cell_index.point(49.5, 5.5), cell_index.point(42.5, -0.5)])
+    assert table.column("value").to_pylist() == [7, 40]
+    assert table.column("color").to_pylist() == [None, "red"]
+    assert table.column("lat_min").to_pylist() == [49.0, 42.0]
+    assert table.column("lon_max").to_pylist() == [6.0, 0.0]
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import hotspot_lod
+import hotspot_store
+from grid_spec import GridSpec
+
+FINE = GridSpec(40.0, -4.0, 0.25, 8, 8)
+COARSE = GridSpec(40.0, -4.0, 1.0, 2, 2)
+
+
+def write_total(db_dir, grid, rows, cols, values):
+    cells = pd.DataFrame(
+        {
+            "cell_id": grid.cell_ids(rows, cols),
+            "value": np.array(values, dtype=np.uint64),
+            "color": pd.Categorical(["red"] * len(values)),
+        }
+    )
+    hotspot_store.write_cells(hotspot_store.total_path("ESP", grid.name, db_dir), cells, grid)
+
+
+@pytest.fixture
+def db_dir(tmp_path):
+    write_total(str(tmp_path), FINE, [0, 0, 1, 5], [0, 1, 1, 7], [1, 2, 3, 40])
+    write_total(str(tmp_path), COARSE, [0, 1], [0, 1], [6, 40])
+    return str(tmp_path)
+
+
+def test_country_totals_go_from_the_finest_grid(db_dir):
+    totals = hotspot_lod.country_totals("ESP", db_dir)
+    assert [grid for _, grid in totals] == [FINE, COARSE]
+    assert hotspot_lod.country_totals("FRA", db_dir) == ()
+
+
+def test_choose_level(db_dir):
+    totals = hotspot_lod.country_totals("ESP", db_dir)
+    # 0.25 degree cells are at least 4 pixels wide from zoom 5, 1 degree cells from zoom 3
+    assert hotspot_lod.choose_level(totals, 5)[1:] == (FINE, 1)
+    assert hotspot_lod.choose_level(totals, 4)[1:] == (COARSE, 1)
+    assert hotspot_lod.choose_level(totals, 1)[1:] == (COARSE, 4)
+    assert hotspot_lod.choose_level(totals, 0)[1:] == (COARSE, 8)
+
+
+def test_viewport_cells_of_a_rolled_up_level(db_dir):
+    cells, grid = hotspot_lod.viewport_cells("ESP", 1, (39.0, 43.0, -5.0, 0.0), db_dir=db_dir)
+    assert grid == COARSE.coarsen(4)
+    assert cells.column("value").to_pylist() == [46]
+
+
+def test_viewport_cells_without_totals(db_dir):
+    assert hotspot_lod.viewport_cells("FRA", 5, (39.0, 43.0, -5.0, 0.0), db_dir=db_dir) == (
+        None,
+        None,
+    )
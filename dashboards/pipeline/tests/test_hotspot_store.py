@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import hotspot_store
+from grid_spec import GridSpec
+
+GRID = GridSpec(40.0, -4.0, 0.08, 10, 10)
+
+
+def red(cells):
+    cells["color"] = pd.Categorical(["red"] * len(cells))
+    return cells
+
+
+def month_cells(cell_ids, values):
+    return pd.DataFrame(
+        {"cell_id": np.array(cell_ids, dtype=np.uint64), "value": np.array(values, dtype=np.uint64)}
+    )
+
+
+def total_values(path):
+    cells, _ = hotspot_store.read_cells(path)
+    return dict(zip(cells["cell_id"].tolist(), cells["value"].tolist()))
+
+
+@pytest.fixture
+def path(tmp_path):
+    return hotspot_store.total_path("ESP", GRID.name, db_dir=str(tmp_path))
+
+
+def test_merge_disjoint_cells():
+    cell_ids, values = hotspot_store.merge_values(
+        np.array([1, 5], dtype=np.uint64),
+        np.array([10, 50], dtype=np.uint64),
+        np.array([3], dtype=np.uint64),
+        np.array([30], dtype=np.uint64),
+    )
+    assert cell_ids.tolist() == [1, 3, 5]
+    assert values.tolist() == [10, 30, 50]
+
+
+def test_merge_overlapping_cells():
+    cell_ids, values = hotspot_store.merge_values(
+        np.array([1, 5], dtype=np.uint64),
+        np.array([10, 50], dtype=np.uint64),
+        np.array([5, 7], dtype=np.uint64),
+        np.array([5, 70], dtype=np.uint64),
+    )
+    assert cell_ids.tolist() == [1, 5, 7]
+    assert values.tolist() == [10, 55, 70]
+
+
+def test_merge_drops_zeroed_cells():
+    cell_ids, values = hotspot_store.merge_values(
+        np.array([1, 5], dtype=np.uint64),
+        np.array([10, 50], dtype=np.uint64),
+        np.array([5], dtype=np.uint64),
+        np.array([50], dtype=np.uint64),
+        sign=-1,
+    )
+    assert cell_ids.tolist() == [1]
+    assert values.tolist() == [10]
+
+
+def test_merge_rejects_negative_cells():
+    with pytest.raises(ValueError):
+        hotspot_store.merge_values(
+            np.array([1], dtype=np.uint64),
+            np.array([10], dtype=np.uint64),
+            np.array([1], dtype=np.uint64),
+            np.array([20], dtype=np.uint64),
+            sign=-1,
+        )
+
+
+def test_applying_a_month_twice_is_a_no_op(path):
+    cells = month_cells([1, 2], [10, 20])
+    assert hotspot_store.apply_month(path, "2023_1", cells, GRID, red)
+    version = hotspot_store.data_version(path)
+
+    assert not hotspot_store.apply_month(path, "2023_1", cells, GRID, red)
+    assert hotspot_store.data_version(path) == version
+    assert total_values(path) == {1: 10, 2: 20}
+    assert hotspot_store.read_applied_months(path) == ["2023_1"]
+
+
+def test_retracting_a_month_restores_the_previous_total(path):
+    hotspot_store.apply_month(path, "2023_1", month_cells([1, 2], [10, 20]), GRID, red)
+    february = month_cells([2, 3], [5, 30])
+    hotspot_store.apply_month(path, "2023_2", february, GRID, red)
+    assert total_values(path) == {1: 10, 2: 25, 3: 30}
+
+    assert hotspot_store.retract_month(path, "2023_2", february, GRID, red)
+    assert total_values(path) == {1: 10, 2: 20}
+    assert hotspot_store.read_applied_months(path) == ["2023_1"]
+    assert not hotspot_store.retract_month(path, "2023_2", february, GRID, red)
+
+
+def test_applying_on_another_grid_fails(path):
+    hotspot_store.apply_month(path, "2023_1", month_cells([1], [10]), GRID, red)
+    with pytest.raises(ValueError):
+        hotspot_store.apply_month(
+            path, "2023_2", month_cells([1], [10]), GridSpec(40.0, -4.0, 0.022, 10, 10), red
+        )
+
+
+def test_color_codes_put_the_cells_without_a_color_last():
+    cells = month_cells([1, 2, 3], [10, 20, 30])
+    cells["color"] = pd.Categorical(["red", None, "green"], categories=["green", "red"])
+    colors, codes = hotspot_store.color_codes(hotspot_store.to_table(cells, GRID))
+    assert colors == ["green", "red", None]
+    assert codes.tolist() == [1, 2, 0]
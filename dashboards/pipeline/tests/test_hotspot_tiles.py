@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("PIL")
+
+import hotspot_store
+import hotspot_tiles
+from grid_spec import GridSpec
+
+# Cells of 1 degree around the origin, the size of a zoom 8 tile
+GRID = GridSpec(-2.0, -2.0, 1.0, 4, 4)
+
+
+@pytest.fixture
+def path(tmp_path):
+    cells = pd.DataFrame(
+        {
+            "cell_id": GRID.cell_ids([2, 2], [2, 3]),
+            "value": np.array([5, 50], dtype=np.uint64),
+            "color": pd.Categorical(["green", "red"]),
+        }
+    )
+    path = hotspot_store.total_path("ESP", GRID.name, str(tmp_path))
+    hotspot_store.write_cells(path, cells, GRID)
+    return path
+
+
+def test_render_tile_colors_the_pixels_of_the_cells(path):
+    cells = hotspot_tiles.load_cells(path)
+    # North east quarter of the world at zoom 1
+    pixels = hotspot_tiles.render_tile(cells, 1, 1, 0)
+    colors = {tuple(pixel) for pixel in pixels.reshape(-1, 4)}
+    assert colors == {
+        hotspot_tiles.TRANSPARENT,
+        hotspot_tiles.COLOR_RGBA["green"],
+        hotspot_tiles.COLOR_RGBA["red"],
+    }
+
+
+def test_tiles_without_cells_are_empty(path):
+    assert hotspot_tiles.tile_png(path, 1, 0, 1) == hotspot_tiles.EMPTY_TILE
+    assert hotspot_tiles.tile_png(path, 1, 1, 0) != hotspot_tiles.EMPTY_TILE
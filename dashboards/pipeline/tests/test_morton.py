@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+import morton
+
+
+def test_encode_interleaves_x_on_the_even_bits():
+    assert morton.encode([0, 1, 0, 1, 2], [0, 0, 1, 1, 0]).tolist() == [0, 1, 2, 3, 4]
+
+
+def test_decode_inverts_encode():
+    rng = np.random.default_rng(0)
+    x = rng.integers(0, 2 ** 32, size=1000)
+    y = rng.integers(0, 2 ** 32, size=1000)
+    decoded_x, decoded_y = morton.decode(morton.encode(x, y))
+    assert decoded_x.tolist() == x.tolist()
+    assert decoded_y.tolist() == y.tolist()
+
+
+def test_parent_is_the_key_shifted_by_two_bits():
+    x, y = np.array([5, 6, 7]), np.array([9, 10, 11])
+    assert (morton.encode(x, y) >> np.uint64(2)).tolist() == morton.encode(x // 2, y // 2).tolist()
+
+
+def test_roll_up_sums_the_children():
+    # The four children of (0, 0) and one child of (1, 0) at the next level
+    keys = morton.encode([0, 1, 0, 1, 2], [0, 0, 1, 1, 0])
+    parents, sums = morton.roll_up(keys, np.array([1, 2, 3, 4, 5], dtype=np.float64), 3, 2)
+    assert parents.tolist() == morton.encode([0, 1], [0, 0]).tolist()
+    assert sums.tolist() == [10, 5]
+
+
+def test_roll_up_over_levels_matches_binning_at_the_coarse_level():
+    rng = np.random.default_rng(1)
+    lats, lons = rng.uniform(-89, 89, 500), rng.uniform(-179, 179, 500)
+    counts = rng.integers(1, 100, 500).astype(np.float64)
+
+    def bin_level(level):
+        grid = morton.MortonGrid(level)
+        return morton.sum_by_key(grid.cell_ids(*grid.cell_index(lats, lons)), counts)
+
+    keys, sums = morton.roll_up(*bin_level(10), 10, 6)
+    coarse_keys, coarse_sums = bin_level(6)
+    assert keys.tolist() == coarse_keys.tolist()
+    assert sums.tolist() == coarse_sums.tolist()
+
+
+def test_roll_up_into_a_finer_level_fails():
+    with pytest.raises(ValueError):
+        morton.roll_up(np.array([0], dtype=np.uint64), np.array([1.0]), 4, 5)
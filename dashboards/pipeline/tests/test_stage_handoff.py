@@ -0,0 +1,52 @@
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+import stage_handoff
+
+
+@pytest.fixture
+def sample_df():
+    return pd.DataFrame(
+        {
+            "location": ['{"lat": 40.4, "lon": -3.7}'] * 5,
+            "search_query_counts": [1, 2, 3, 4, 5],
+        }
+    )
+
+
+def test_in_memory_handoff(sample_df, tmp_path):
+    stage_handoff.put("memory", sample_df, spill_dir=str(tmp_path))
+    try:
+        assert "memory" in stage_handoff.tables
+        assert stage_handoff.get("memory", spill_dir=str(tmp_path)).num_rows == 5
+        assert not list(tmp_path.iterdir())
+    finally:
+        stage_handoff.drop("memory", spill_dir=str(tmp_path))
+
+
+@pytest.mark.parametrize("spill", ["arrow", "parquet"])
+def test_spilled_table_is_not_kept_in_memory(sample_df, tmp_path, spill):
+    stage_handoff.put("spilled", sample_df, spill=spill, spill_dir=str(tmp_path))
+    try:
+        assert "spilled" not in stage_handoff.tables
+        batches = list(
+            stage_handoff.iter_batches(
+                "spilled", ["search_query_counts"], chunk_size=2, spill_dir=str(tmp_path)
+            )
+        )
+        assert [batch.num_rows for batch in batches] == [2, 2, 1]
+        assert pa.Table.from_batches(batches).column_names == ["search_query_counts"]
+        assert stage_handoff.get("spilled", spill_dir=str(tmp_path)).num_rows == 5
+    finally:
+        stage_handoff.drop("spilled", spill_dir=str(tmp_path))
+    assert not list(tmp_path.iterdir())
+
+
+def test_spill_replaces_the_other_format(sample_df, tmp_path):
+    stage_handoff.put("stale", sample_df, spill="arrow", spill_dir=str(tmp_path))
+    stage_handoff.put("stale", sample_df.head(2), spill="parquet", spill_dir=str(tmp_path))
+    try:
+        assert stage_handoff.get("stale", spill_dir=str(tmp_path)).num_rows == 2
+    finally:
+        stage_handoff.drop("stale", spill_dir=str(tmp_path))